@@ -81,6 +81,9 @@ app.config['COMPRESS_MIMETYPES'] = [
 app.config['COMPRESS_LEVEL'] = 6  # Nivel de compresión (1-9, 6 es balance entre velocidad y tamaño)
 app.config['COMPRESS_MIN_SIZE'] = 500  # Comprimir respuestas > 500 bytes
 
+# Rate limiting (desactivable para pruebas de carga locales: RATELIMIT_ENABLED=False)
+app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED', 'True') == 'True'
+
 # Inicializar extensiones
 # Inicializar extensiones
 jwt.init_app(app)
@@ -252,6 +255,26 @@ with app.app_context():
             db.session.rollback()
             print(f"Nota: Error en migración stock: {e}")
 
+        # Resumen de stock por producto (estado_stock y stock_talles_bajos sin default para detectar filas a completar)
+        try:
+            db.session.execute(text("ALTER TABLE productos ADD COLUMN IF NOT EXISTS stock_total INTEGER DEFAULT 0"))
+            db.session.execute(text("ALTER TABLE productos ADD COLUMN IF NOT EXISTS stock_max_talle INTEGER DEFAULT 0"))
+            db.session.execute(text("ALTER TABLE productos ADD COLUMN IF NOT EXISTS estado_stock VARCHAR(20)"))
+            db.session.execute(text("ALTER TABLE productos ADD COLUMN IF NOT EXISTS stock_version INTEGER DEFAULT 0"))
+            db.session.execute(text("ALTER TABLE productos ADD COLUMN IF NOT EXISTS stock_talles_bajos INTEGER"))
+            db.session.execute(text("CREATE INDEX IF NOT EXISTS idx_producto_activo_estado_stock ON productos(activo, estado_stock)"))
+            db.session.commit()
+
+            from models import actualizar_resumen_stock
+            pendientes = [row[0] for row in db.session.execute(text("SELECT id FROM productos WHERE estado_stock IS NULL OR stock_talles_bajos IS NULL"))]
+            if pendientes:
+                actualizar_resumen_stock(pendientes)
+                db.session.commit()
+                print(f"✓ Resumen de stock calculado para {len(pendientes)} productos")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Nota: Error en migración resumen de stock: {e}")
+
         # Constraints (en bloques separados por si ya existen)
         try:
             db.session.execute(text("ALTER TABLE productos ADD CONSTRAINT fk_producto_relacionado FOREIGN KEY (producto_relacionado_id) REFERENCES productos(id)"))
@@ -273,6 +296,10 @@ with app.app_context():
 
         print("✓ Verificación de esquema PostgreSQL completada")
 
+    # Índice full-text para la búsqueda del catálogo (FTS5 en SQLite, tsvector + GIN en PostgreSQL)
+    from services.search_service import SearchService
+    SearchService.ensure_index()
+
 # Health check simple que no usa BD
 # Health check simple que no usa BD
 @app.route('/')
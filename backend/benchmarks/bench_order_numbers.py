@@ -0,0 +1,115 @@
+"""
+Prueba de concurrencia de la numeración de pedidos (services/order_number_service.py).
+
+Crea una base SQLite temporal (o usa DATABASE_URL con --database-url), con un pedido previo
+para verificar que la numeración continúa desde él, y lanza varios procesos (como los
+workers de gunicorn) con varios threads cada uno pidiendo números a la vez. Verifica que
+no haya repetidos ni números por debajo del pedido previo y reporta el throughput.
+
+Uso (desde backend/):
+    python benchmarks/bench_order_numbers.py
+    python benchmarks/bench_order_numbers.py --procesos 4 --threads 8 --numeros 500
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PEDIDO_PREVIO = 'AB9998'
+
+
+def _entorno(database_url: str):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['CACHE_WARM_URLS'] = ''
+    sys.path.insert(0, BACKEND)
+
+
+def _preparar_base(database_url: str):
+    _entorno(database_url)
+    from app import app
+    from models import db, Pedido, Contador, MetodoPago
+    with app.app_context():
+        Contador.query.delete()
+        if not Pedido.query.filter_by(numero_pedido=PEDIDO_PREVIO).first():
+            metodo = MetodoPago.query.first() or MetodoPago(nombre='Transferencia')
+            db.session.add(metodo)
+            db.session.flush()
+            db.session.add(Pedido(
+                numero_pedido=PEDIDO_PREVIO, cliente_nombre='bench', cliente_email='bench@local',
+                cliente_direccion='-', cliente_codigo_postal='5800', cliente_localidad='-',
+                cliente_provincia='-', metodo_pago_id=metodo.id, subtotal=0, total=0
+            ))
+        db.session.commit()
+
+
+def _worker(database_url: str, threads: int, numeros: int, cola):
+    _entorno(database_url)
+    from threading import Thread
+    from app import app
+    from services.order_number_service import OrderNumberService
+
+    resultado = []
+
+    def pedir():
+        with app.app_context():
+            for _ in range(numeros):
+                resultado.append(OrderNumberService.siguiente())
+
+    hilos = [Thread(target=pedir) for _ in range(threads)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    cola.put(resultado)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--procesos', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--numeros', type=int, default=250, help='Números por thread')
+    parser.add_argument('--database-url', help='Base a usar (por defecto una SQLite temporal)')
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix='bench_numeros_')
+    database_url = args.database_url or f"sqlite:///{os.path.join(directorio, 'bench.db')}"
+    _preparar_base(database_url)
+
+    # spawn: cada proceso abre sus propias conexiones, como un worker de gunicorn
+    contexto = multiprocessing.get_context('spawn')
+    cola = contexto.Queue()
+    procesos = [
+        contexto.Process(target=_worker, args=(database_url, args.threads, args.numeros, cola))
+        for _ in range(args.procesos)
+    ]
+    inicio = time.perf_counter()
+    for proceso in procesos:
+        proceso.start()
+    numeros = []
+    for _ in procesos:
+        numeros.extend(cola.get())
+    for proceso in procesos:
+        proceso.join()
+    transcurrido = time.perf_counter() - inicio
+
+    from services.order_number_service import OrderNumberService
+    esperados = args.procesos * args.threads * args.numeros
+    repetidos = len(numeros) - len(set(numeros))
+    minimo_valido = OrderNumberService.ordinal(PEDIDO_PREVIO)
+    fuera_de_secuencia = [n for n in numeros if (OrderNumberService.ordinal(n) or -1) <= minimo_valido]
+
+    print(f"{len(numeros)}/{esperados} números en {transcurrido:.2f} s "
+          f"({len(numeros) / transcurrido:.0f}/s, incluye el arranque de {args.procesos} procesos)")
+    print(f"Rango: {min(numeros)} .. {max(numeros)}  repetidos: {repetidos}  "
+          f"<= {PEDIDO_PREVIO}: {len(fuera_de_secuencia)}")
+    if len(numeros) != esperados or repetidos or fuera_de_secuencia:
+        print("FALLA")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Micro-benchmark del motor de precios (services/pricing_service.py) sobre carritos sintéticos.
+
+Compara PricingService.cotizar contra la implementación anterior del checkout (que expandía
+cada unidad a una lista y la ordenaba para el 2x1/3x2) y verifica que ambas den el mismo
+descuento por línea. No usa la base de datos.
+
+Uso (desde backend/):
+    python benchmarks/bench_pricing.py
+    python benchmarks/bench_pricing.py --lineas 10 100 1000 --max-cantidad 50 --repeticiones 5
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.pricing_service import PricingService, tipo_regla
+
+CATEGORIAS = list(range(1, 21))
+CATEGORIAS_REDUCIDAS = frozenset((8, 9, 10))
+
+
+def generar_promos(rng, productos: int):
+    """Promociones de todos los tipos y alcances: por producto, por categoría y de tienda"""
+    promos = []
+    tipos = ('descuento_porcentaje', 'descuento_fijo', '2x1', '3x2')
+    for i in range(12):
+        alcance = ('producto', 'categoria', 'tienda')[i % 3]
+        promos.append({
+            'id': i + 1,
+            'alcance': alcance,
+            'tipo': tipos[i % len(tipos)],
+            'valor': rng.choice((5, 10, 20, 500)),
+            'productos': rng.sample(range(1, productos + 1), min(productos, 50)) if alcance == 'producto' else (),
+            'categorias': rng.sample(CATEGORIAS, 3) if alcance == 'categoria' else (),
+        })
+    return promos
+
+
+def generar_carrito(rng, lineas: int, productos: int, max_cantidad: int):
+    return [{
+        'producto_id': rng.randint(1, productos),
+        'categoria_id': rng.choice(CATEGORIAS),
+        'precio_unitario': float(rng.randrange(5000, 60000, 500)),
+        'cantidad': rng.randint(1, max_cantidad),
+    } for _ in range(lineas)]
+
+
+def descuentos_legacy(lineas, promos):
+    """Descuento por línea (cantidad + promociones) con el algoritmo anterior del checkout"""
+    items = [dict(linea, descuento_aplicado=0) for linea in lineas]
+    total_qty = sum(item['cantidad'] for item in items)
+    pct = 15 if total_qty >= 3 else 10 if total_qty == 2 else 0
+    for item in items:
+        item['descuento_aplicado'] += (item['precio_unitario'] * item['cantidad'] * pct) / 100
+
+    for promo in promos:
+        productos, categorias = set(promo['productos']), set(promo['categorias'])
+        aplicables = [
+            item for item in items
+            if promo['alcance'] == 'tienda'
+            or (promo['alcance'] == 'producto' and item['producto_id'] in productos)
+            or (promo['alcance'] == 'categoria' and item['categoria_id'] in categorias)
+        ]
+        tipo, valor = promo['tipo'].lower(), promo['valor'] or 0
+        if 'porcentaje' in tipo:
+            for item in aplicables:
+                item['descuento_aplicado'] += (item['precio_unitario'] * item['cantidad'] * valor) / 100
+        elif 'fijo' in tipo:
+            for item in aplicables:
+                item['descuento_aplicado'] += min(valor * item['cantidad'], item['precio_unitario'] * item['cantidad'])
+        elif '2x1' in tipo or '3x2' in tipo:
+            unidades = []
+            for item in aplicables:
+                for _ in range(item['cantidad']):
+                    unidades.append({'precio': item['precio_unitario'], 'ref_item': item})
+            unidades.sort(key=lambda x: x['precio'], reverse=True)
+            n = 2 if '2x1' in tipo else 3
+            for i, unidad in enumerate(unidades):
+                if (i + 1) % n == 0:
+                    unidad['ref_item']['descuento_aplicado'] += unidad['precio']
+    return [item['descuento_aplicado'] for item in items]
+
+
+def medir(funcion, repeticiones: int) -> float:
+    """Mejor tiempo (ms) de `repeticiones` ejecuciones"""
+    mejor = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        transcurrido = (time.perf_counter() - inicio) * 1000
+        mejor = transcurrido if mejor is None else min(mejor, transcurrido)
+    return mejor
+
+
+def verificar(rng, casos: int = 200):
+    """Carritos chicos al azar: el motor y la implementación anterior deben coincidir"""
+    for _ in range(casos):
+        promos = generar_promos(rng, 40)
+        lineas = generar_carrito(rng, rng.randint(1, 15), 40, 6)
+        reglas = PricingService.compilar(promos)
+        cotizacion = PricingService.cotizar(lineas, reglas)
+        esperado = descuentos_legacy(lineas, promos)
+        for linea, valor in zip(cotizacion['lineas'], esperado):
+            if abs(linea['descuento_aplicado'] - valor) > 1e-6:
+                raise AssertionError(f"Diferencia en {linea['producto_id']}: {linea['descuento_aplicado']} != {valor}")
+    # Reglas NxM de una sola línea (PromocionProducto.calcular_descuento)
+    for cantidad in range(0, 12):
+        assert PricingService.descuento_linea(tipo_regla('2x1'), 0, cantidad, 100) == 100 * (cantidad // 2)
+        assert PricingService.descuento_linea(tipo_regla('llevas_4_paga_3'), 0, cantidad, 100) == 100 * (cantidad // 4)
+    print(f"OK: {casos} carritos al azar coinciden con la implementación anterior")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lineas', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--max-cantidad', type=int, default=20)
+    parser.add_argument('--productos', type=int, default=2000)
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--sin-legacy', action='store_true', help='No medir la implementación anterior')
+    args = parser.parse_args()
+
+    rng = random.Random(args.semilla)
+    verificar(rng)
+
+    promos = generar_promos(rng, args.productos)
+    compilar_ms = medir(lambda: PricingService.compilar(promos), args.repeticiones)
+    reglas = PricingService.compilar(promos)
+    print(f"Compilar {len(promos)} promociones: {compilar_ms:.3f} ms\n")
+
+    print(f"{'líneas':>8} {'unidades':>10} {'motor ms':>10} {'legacy ms':>11} {'x':>7}")
+    for cantidad_lineas in args.lineas:
+        lineas = generar_carrito(rng, cantidad_lineas, args.productos, args.max_cantidad)
+        unidades = sum(linea['cantidad'] for linea in lineas)
+        motor_ms = medir(lambda: PricingService.cotizar(
+            lineas, reglas, metodo_pago='Transferencia', categorias_reducidas=CATEGORIAS_REDUCIDAS
+        ), args.repeticiones)
+        if args.sin_legacy:
+            print(f"{cantidad_lineas:>8} {unidades:>10} {motor_ms:>10.3f} {'-':>11} {'-':>7}")
+            continue
+        legacy_ms = medir(lambda: descuentos_legacy(lineas, promos), args.repeticiones)
+        print(f"{cantidad_lineas:>8} {unidades:>10} {motor_ms:>10.3f} {legacy_ms:>11.3f} {legacy_ms / motor_ms:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""
+Prueba de carga y concurrencia del checkout, la aprobación de pedidos y las ventas externas.
+
+Siembra en una base local (SQLite temporal por defecto, o --database-url) una categoría con
+pocos productos y poco stock por talle, y lanza con --concurrencia clientes a la vez:
+  1. checkouts (POST /api/orders) que compiten por los mismos talles
+  2. aprobaciones de todos los pedidos creados (POST /api/admin/pedidos/<id>/aprobar, o
+     con --lote POST /api/admin/pedidos/aprobar-lote en lotes superpuestos) mezcladas con ventas externas (POST /api/admin/ventas-externas) sobre los mismos talles.
+     Con --duplicadas N cada pedido recibe además N aprobaciones individuales lanzadas a la
+     vez que la primera (o que su lote, con --lote) para forzar aprobaciones dobles
+Después verifica los invariantes: ningún stock negativo, numero_pedido único, ningún pedido
+aprobado más de una vez, ventas_count de cada producto igual a las unidades aprobadas +
+vendidas por fuera, y stock final igual al inicial menos esas unidades. Reporta throughput y latencias p50/p95/p99 por operación.
+
+Por defecto usa el test client de Flask en este proceso (threads). Con --gunicorn levanta un
+gunicorn local con esa cantidad de workers (una corrida por valor, para ver cómo escala) y
+con --url usa un servidor ya levantado contra la misma base (con RATELIMIT_ENABLED=False).
+
+Uso (desde backend/):
+    python benchmarks/stress_checkout.py
+    python benchmarks/stress_checkout.py --checkouts 500 --ventas 100 --concurrencia 32
+    python benchmarks/stress_checkout.py --gunicorn 1 2 4
+    python benchmarks/stress_checkout.py --lote 20
+    python benchmarks/stress_checkout.py --duplicadas 3 --lote 20
+    python benchmarks/stress_checkout.py --database-url postgresql://localhost/stress --gunicorn 4
+"""
+import argparse
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _entorno(database_url: str):
+    """Variables para este proceso y para los workers de gunicorn (antes de importar app)"""
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['RATELIMIT_ENABLED'] = 'False'
+    os.environ['CACHE_WARM_URLS'] = ''
+    os.environ.pop('BREVO_API_KEY', None)  # sin emails reales
+    sys.path.insert(0, BACKEND)
+
+
+# ==================== DATOS ====================
+
+def sembrar(app, productos: int, talles: int, stock: int) -> dict:
+    """Categoría nueva con `productos` productos y `stock` unidades en cada uno de `talles` talles"""
+    from flask_jwt_extended import create_access_token
+    from models import db, Admin, Categoria, MetodoPago, Producto, StockTalle, Talle
+
+    with app.app_context():
+        sufijo = f"{int(time.time() * 1000)}"
+        nombres_talle = ['S', 'M', 'L', 'XL', 'XXL', 'XS'][:talles]
+        talles_db = []
+        for orden, nombre in enumerate(nombres_talle):
+            talle = Talle.query.filter_by(nombre=nombre).first()
+            if not talle:
+                talle = Talle(nombre=nombre, orden=orden)
+                db.session.add(talle)
+            talles_db.append(talle)
+        metodo = MetodoPago.query.filter(MetodoPago.nombre.ilike('%transferencia%')).first()
+        if not metodo:
+            metodo = MetodoPago(nombre='Transferencia')
+            db.session.add(metodo)
+        categoria = Categoria(nombre=f'Stress {sufijo}', slug=f'stress-{sufijo}')
+        db.session.add(categoria)
+        db.session.flush()
+
+        lineas = []
+        for i in range(productos):
+            producto = Producto(nombre=f'Stress {sufijo} #{i}', precio_base=10000 + i * 500,
+                                categoria_id=categoria.id, ventas_count=0)
+            db.session.add(producto)
+            db.session.flush()
+            for talle in talles_db:
+                db.session.add(StockTalle(producto_id=producto.id, talle_id=talle.id, cantidad=stock))
+                lineas.append((producto.id, talle.id))
+        db.session.commit()
+
+        admin = Admin.query.first()
+        return {
+            'lineas': lineas,
+            'producto_ids': sorted({p for p, _ in lineas}),
+            'stock_inicial': {linea: stock for linea in lineas},
+            'metodo_pago_id': metodo.id,
+            'auth': {'Authorization': f'Bearer {create_access_token(identity=str(admin.id))}'},
+        }
+
+
+def verificar(app, datos: dict) -> list:
+    """Invariantes después de la corrida. Retorna la lista de violaciones (vacía si todo bien)"""
+    from models import db, ItemPedido, Pedido, Producto, StockTalle, VentaExterna
+
+    with app.app_context():
+        db.session.remove()
+        producto_ids = datos['producto_ids']
+        errores = []
+
+        stock = {
+            (st.producto_id, st.talle_id): st.cantidad
+            for st in StockTalle.query.filter(StockTalle.producto_id.in_(producto_ids))
+        }
+        negativos = {linea: cantidad for linea, cantidad in stock.items() if cantidad < 0}
+        if negativos:
+            errores.append(f"Stock negativo: {negativos}")
+
+        duplicados = db.session.execute(
+            db.select(Pedido.numero_pedido, db.func.count())
+            .group_by(Pedido.numero_pedido).having(db.func.count() > 1)
+        ).all()
+        if duplicados:
+            errores.append(f"numero_pedido repetidos: {duplicados[:10]}")
+
+        vendidas = {}
+        aprobados = db.session.execute(
+            db.select(ItemPedido.producto_id, ItemPedido.talle_id, ItemPedido.cantidad)
+            .join(Pedido, Pedido.id == ItemPedido.pedido_id)
+            .where(Pedido.aprobado.is_(True), ItemPedido.producto_id.in_(producto_ids))
+        ).all()
+        externas = db.session.execute(
+            db.select(VentaExterna.producto_id, VentaExterna.talle_id, VentaExterna.cantidad)
+            .where(VentaExterna.producto_id.in_(producto_ids))
+        ).all()
+        for producto_id, talle_id, cantidad in list(aprobados) + list(externas):
+            vendidas[(producto_id, talle_id)] = vendidas.get((producto_id, talle_id), 0) + cantidad
+
+        ventas_count = dict(db.session.execute(
+            db.select(Producto.id, Producto.ventas_count).where(Producto.id.in_(producto_ids))
+        ).all())
+        for producto_id in producto_ids:
+            esperado = sum(c for (p, _), c in vendidas.items() if p == producto_id)
+            if (ventas_count.get(producto_id) or 0) != esperado:
+                errores.append(f"ventas_count de {producto_id}: {ventas_count.get(producto_id)} != {esperado}")
+
+        for linea, inicial in datos['stock_inicial'].items():
+            if stock.get(linea) != inicial - vendidas.get(linea, 0):
+                errores.append(f"Stock de {linea}: {stock.get(linea)} != {inicial} - {vendidas.get(linea, 0)}")
+
+        datos['unidades_vendidas'] = sum(vendidas.values())
+        return errores
+
+
+def aprobaciones_dobles(resultados) -> list:
+    """Pedidos que más de una request (individual o de lote) informó como aprobados"""
+    exitos = {}
+    for operacion, status, _, respuesta in resultados:
+        if status != 200:
+            continue
+        if operacion == 'aprobacion':
+            ids = [respuesta.get('pedido', {}).get('id')]
+        elif operacion == 'aprobacion_lote':
+            ids = [r['id'] for r in respuesta.get('resultados', []) if r.get('estado') == 'aprobado']
+        else:
+            continue
+        for pid in ids:
+            exitos[pid] = exitos.get(pid, 0) + 1
+    dobles = {pid: n for pid, n in exitos.items() if n > 1}
+    return [f"Pedidos aprobados más de una vez: {dict(list(dobles.items())[:10])}"] if dobles else []
+
+
+# ==================== CLIENTES ====================
+
+class ClienteFlask:
+    """Test client de Flask, uno por thread"""
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def post(self, path: str, json=None, headers=None):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        respuesta = self.local.client.post(path, json=json, headers=headers)
+        return respuesta.status_code, respuesta.get_json(silent=True) or {}
+
+
+class ClienteHttp:
+    """requests contra un servidor local, una sesión (keep-alive) por thread"""
+    def __init__(self, url: str):
+        import requests
+        self.requests = requests
+        self.url = url.rstrip('/')
+        self.local = threading.local()
+
+    def post(self, path: str, json=None, headers=None):
+        if not hasattr(self.local, 'session'):
+            self.local.session = self.requests.Session()
+        try:
+            respuesta = self.local.session.post(self.url + path, json=json, headers=headers, timeout=60)
+        except self.requests.RequestException as e:
+            return 0, {'error': str(e)}
+        try:
+            return respuesta.status_code, respuesta.json()
+        except ValueError:
+            return respuesta.status_code, {}
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def levantar_gunicorn(workers: int):
+    """gunicorn local con `workers` workers sync; retorna (proceso, url) cuando ya responde"""
+    import requests
+    puerto = _puerto_libre()
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{puerto}',
+         '--timeout', '120', '--log-level', 'warning', 'app:app'],
+        cwd=BACKEND, env=os.environ.copy(), stdout=subprocess.DEVNULL
+    )
+    url = f'http://127.0.0.1:{puerto}'
+    limite = time.time() + 60
+    while time.time() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError("gunicorn terminó al arrancar")
+        try:
+            requests.get(f'{url}/api/metodos-pago', timeout=2)
+            return proceso, url
+        except requests.RequestException:
+            time.sleep(0.3)
+    proceso.terminate()
+    raise RuntimeError("gunicorn no respondió en 60 s")
+
+
+# ==================== CARGA ====================
+
+def percentil(valores, p: float) -> float:
+    """Percentil por rango más cercano (valores ordenados)"""
+    if not valores:
+        return 0.0
+    indice = max(0, min(len(valores) - 1, math.ceil(p / 100 * len(valores)) - 1))
+    return valores[indice]
+
+
+def ejecutar(cliente, tareas, concurrencia: int):
+    """Corre las tareas (operacion, path, json, headers) en paralelo; retorna (resultados, segundos)"""
+    resultados = []
+    lock = threading.Lock()
+
+    def correr(tarea):
+        operacion, path, cuerpo, headers = tarea
+        inicio = time.perf_counter()
+        status, respuesta = cliente.post(path, json=cuerpo, headers=headers)
+        ms = (time.perf_counter() - inicio) * 1000
+        with lock:
+            resultados.append((operacion, status, ms, respuesta))
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        list(pool.map(correr, tareas))
+    return resultados, time.perf_counter() - inicio
+
+
+def reportar(titulo: str, resultados, segundos: float):
+    print(f"\n{titulo}: {len(resultados)} requests en {segundos:.2f} s ({len(resultados) / segundos:.1f} req/s)")
+    print(f"{'operación':<14} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  status")
+    for operacion in sorted({r[0] for r in resultados}):
+        propios = [r for r in resultados if r[0] == operacion]
+        latencias = sorted(r[2] for r in propios)
+        estados = {}
+        for r in propios:
+            estados[r[1]] = estados.get(r[1], 0) + 1
+        print(f"{operacion:<14} {len(propios):>6} {percentil(latencias, 50):>9.1f} "
+              f"{percentil(latencias, 95):>9.1f} {percentil(latencias, 99):>9.1f}  "
+              f"{dict(sorted(estados.items()))}")
+    errores = [r for r in resultados if r[1] >= 500 or r[1] == 0]
+    for r in errores[:5]:
+        print(f"  {r[0]} {r[1]}: {r[3].get('error')}")
+
+
+def carrito(rng, lineas):
+    elegidas = rng.sample(lineas, rng.randint(1, min(2, len(lineas))))
+    return [{'producto_id': p, 'talle_id': t, 'cantidad': rng.randint(1, 2)} for p, t in elegidas]
+
+
+def escenario(app, cliente, args, etiqueta: str) -> bool:
+    datos = sembrar(app, args.productos, args.talles, args.stock)
+    rng = random.Random(args.semilla)
+    auth = datos['auth']
+
+    checkouts = [('checkout', '/api/orders', {
+        'cliente_nombre': f'Stress {i}', 'cliente_email': f'stress{i}@local.test', 'calle': 'Calle',
+        'altura': i, 'codigo_postal': '5800', 'ciudad': 'Río Cuarto', 'provincia': 'Córdoba',
+        'metodo_pago': datos['metodo_pago_id'], 'items': carrito(rng, datos['lineas'])
+    }, None) for i in range(args.checkouts)]
+    resultados, segundos = ejecutar(cliente, checkouts, args.concurrencia)
+    reportar(f"[{etiqueta}] Checkouts", resultados, segundos)
+
+    pedido_ids = [r[3]['id'] for r in resultados if r[1] == 201 and 'id' in r[3]]
+
+    def aprobacion(pid):
+        return ('aprobacion', f'/api/admin/pedidos/{pid}/aprobar', None, auth)
+
+    # Grupos de requests que se lanzan juntos (consecutivos en el pool): las aprobaciones
+    # duplicadas de un mismo pedido compiten entre sí
+    grupos = []
+    if args.lote:
+        # Lotes superpuestos: cada pedido va en dos lotes distintos para forzar conflictos,
+        # y sus aprobaciones individuales duplicadas salen junto al primero de ellos
+        rng.shuffle(pedido_ids)
+        vistos = set()
+        for ids in (pedido_ids, rng.sample(pedido_ids, len(pedido_ids))):
+            for i in range(0, len(ids), args.lote):
+                lote = ids[i:i + args.lote]
+                grupo = [('aprobacion_lote', '/api/admin/pedidos/aprobar-lote', {'pedido_ids': lote}, auth)]
+                grupo += [aprobacion(pid) for pid in lote if pid not in vistos for _ in range(args.duplicadas)]
+                vistos.update(lote)
+                grupos.append(grupo)
+    else:
+        grupos = [[aprobacion(pid)] * (1 + args.duplicadas) for pid in pedido_ids]
+    for _ in range(args.ventas):
+        producto_id, talle_id = rng.choice(datos['lineas'])
+        grupos.append([('venta_externa', '/api/admin/ventas-externas', {
+            'producto_id': producto_id, 'talle_id': talle_id, 'cantidad': rng.randint(1, 2),
+            'precio_unitario': 10000, 'notas': 'stress'
+        }, auth)])
+    rng.shuffle(grupos)
+    mutaciones = [tarea for grupo in grupos for tarea in grupo]
+    resultados, segundos = ejecutar(cliente, mutaciones, args.concurrencia)
+    reportar(f"[{etiqueta}] Aprobaciones y ventas externas", resultados, segundos)
+
+    errores = verificar(app, datos) + aprobaciones_dobles(resultados)
+    total_stock = sum(datos['stock_inicial'].values())
+    print(f"\n[{etiqueta}] Unidades vendidas: {datos['unidades_vendidas']} de {total_stock}")
+    if errores:
+        print(f"[{etiqueta}] INVARIANTES VIOLADOS:")
+        for error in errores[:20]:
+            print(f"  - {error}")
+        return False
+    print(f"[{etiqueta}] Invariantes OK: stock >= 0, numero_pedido único, sin aprobaciones dobles, "
+          f"ventas_count y stock consistentes")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checkouts', type=int, default=200)
+    parser.add_argument('--ventas', type=int, default=50, help='Ventas externas concurrentes con las aprobaciones')
+    parser.add_argument('--lote', type=int, default=0, metavar='N',
+                        help='Aprobar con /api/admin/pedidos/aprobar-lote en lotes de N (superpuestos)')
+    parser.add_argument('--duplicadas', type=int, default=1, metavar='N',
+                        help='Aprobaciones individuales extra y simultáneas de cada pedido (0 para ninguna)')
+    parser.add_argument('--concurrencia', type=int, default=16)
+    parser.add_argument('--productos', type=int, default=5)
+    parser.add_argument('--talles', type=int, default=2)
+    parser.add_argument('--stock', type=int, default=10, help='Unidades iniciales por talle')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--database-url', help='Base a usar (por defecto una SQLite temporal)')
+    modo = parser.add_mutually_exclusive_group()
+    modo.add_argument('--gunicorn', type=int, nargs='+', metavar='WORKERS',
+                      help='Levantar gunicorn local con estas cantidades de workers (una corrida por valor)')
+    modo.add_argument('--url', help='Servidor ya levantado contra la misma base')
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='stress_'), 'stress.db')}"
+    _entorno(database_url)
+    from app import app
+
+    ok = True
+    if args.gunicorn:
+        for workers in args.gunicorn:
+            proceso, url = levantar_gunicorn(workers)
+            try:
+                ok &= escenario(app, ClienteHttp(url), args, f"gunicorn -w {workers}")
+            finally:
+                proceso.terminate()
+                proceso.wait()
+    elif args.url:
+        ok = escenario(app, ClienteHttp(args.url), args, args.url)
+    else:
+        ok = escenario(app, ClienteFlask(app), args, 'test client')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,7 @@ from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
 from extensions import limiter
-from cache_utils import cache, invalidate_cache
+from cache_utils import cache, invalidate_cache, get_or_compute
 from models import *
 from sqlalchemy import func
 from datetime import datetime, timedelta
@@ -11,7 +11,15 @@ import os
 import json
 from PIL import Image
 from pathlib import Path
+from threading import Thread
 from services.admin_service import AdminService
+from services.category_service import CategoryService
+from services.promotion_service import PromotionService
+from services.catalog_cache_service import CatalogCacheService
+from services.cache_stats_service import CacheStatsService
+from services.fragment_cache_service import FragmentCacheService
+from services.stock_service import StockService, StockInsuficiente
+from services.order_service import OrderService, ConflictoAprobacion, APROBAR_LOTE_MAX
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,6 +27,9 @@ logger = logging.getLogger(__name__)
 store_admin_bp = Blueprint('store_admin', __name__)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+
+# Estadísticas del dashboard: se invalidan juntas ante cualquier venta o cambio de pedido
+cache_estadisticas = cache.namespace('estadisticas')
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -28,13 +39,12 @@ def allowed_file(filename):
 @jwt_required()
 def get_estadisticas():
     """Obtener estadísticas generales - REFACTORIZADO"""
-    cache_key = "estadisticas:general_v3"
-    cached_result = cache.get(cache_key)
-    if cached_result: return jsonify(cached_result), 200
-    
     try:
-        stats = AdminService.get_dashboard_stats()
-        cache.set(cache_key, stats, ttl_seconds=300)
+        # Un solo cálculo a la vez; vencido, se sirve el anterior mientras se recalcula
+        stats = get_or_compute(
+            cache_estadisticas.key("general_v3"), AdminService.get_dashboard_stats,
+            ttl_seconds=300, stale_seconds=300
+        )
         return jsonify(stats), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -50,17 +60,18 @@ def get_estadisticas_ventas():
     if anio:
         anio = int(anio)
     
-    cache_key = f"estadisticas_ventas:{periodo}:{fecha_ref}:{semana_offset}:{anio}"
-    cached_result = cache.get(cache_key)
-    if cached_result: return jsonify(cached_result), 200
+    cache_key = f"ventas:{periodo}:{fecha_ref}:{semana_offset}:{anio}"
     
     try:
         dt_ref = None
         if fecha_ref:
             dt_ref = datetime.strptime(fecha_ref, '%Y-%m-%d')
             
-        stats = AdminService.get_sales_stats(periodo, dt_ref, semana_offset, anio)
-        cache.set(cache_key, stats, ttl_seconds=300)
+        stats = get_or_compute(
+            cache_estadisticas.key(cache_key),
+            lambda: AdminService.get_sales_stats(periodo, dt_ref, semana_offset, anio),
+            ttl_seconds=300, stale_seconds=300
+        )
         return jsonify(stats), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -132,10 +143,14 @@ def create_producto():
                        # Bidireccional: Asegurar que el otro producto también apunte a este
                        if producto not in rel_prod.relacionados:
                            rel_prod.relacionados.append(producto)
+                           # Cambia su detalle (ETag): la relación sola no dispara onupdate
+                           rel_prod.updated_at = datetime.utcnow()
 
             db.session.add(producto)
             db.session.commit()
-            invalidate_cache(pattern='productos')
+            CatalogCacheService.invalidar_productos(
+                [producto.id] + [r.id for r in producto.relacionados], [producto.categoria_id], membresia=True
+            )
             return jsonify(producto.to_dict()), 201
         except Exception as e:
             db.session.rollback()
@@ -183,9 +198,11 @@ def manage_product(id):
                 for promo in producto.promociones:
                     promo.productos.remove(producto)
             
+            categoria_id = producto.categoria_id
             db.session.delete(producto)
             db.session.commit()
-            invalidate_cache(pattern='productos')
+            PromotionService.invalidate()
+            CatalogCacheService.invalidar_productos([id], [categoria_id], membresia=True)
             return jsonify({'message': 'Producto eliminado'}), 200
         except Exception as e:
             db.session.rollback()
@@ -199,6 +216,9 @@ def manage_product(id):
             return jsonify({'error': error_msg}), 500
     
     data = request.get_json()
+    # Estado previo para invalidar también los listados / relacionados de antes del cambio
+    categoria_anterior = producto.categoria_id
+    relacionados_anteriores = [r.id for r in producto.relacionados]
     try:
         if 'nombre' in data: producto.nombre = data['nombre']
         if 'descripcion' in data: producto.descripcion = data['descripcion']
@@ -232,10 +252,18 @@ def manage_product(id):
                     # Nota: Esto no elimina automáticamente la relación inversa si se quita aquí.
                     if producto not in p.relacionados:
                         p.relacionados.append(producto)
+                        p.updated_at = datetime.utcnow()
             producto.relacionados = nuevos_relacionados
+            # La relación M:N no dispara onupdate: marcar el cambio para el ETag del detalle
+            producto.updated_at = datetime.utcnow()
             
         db.session.commit()
-        invalidate_cache(pattern='productos')
+        PromotionService.invalidate()
+        CatalogCacheService.invalidar_productos(
+            [id] + relacionados_anteriores + [r.id for r in producto.relacionados],
+            [categoria_anterior, producto.categoria_id],
+            membresia=True
+        )
         return jsonify(producto.to_dict()), 200
     except Exception as e:
         db.session.rollback()
@@ -287,7 +315,8 @@ def create_categoria():
                     db.session.add(sub_cat)
 
             db.session.commit()
-            invalidate_cache(pattern='categorias')
+            CategoryService.invalidate()
+            invalidate_cache(namespace='get_categorias')
             return jsonify(categoria.to_dict()), 201
         except Exception as e:
             db.session.rollback()
@@ -315,13 +344,17 @@ def manage_category(id):
                 return jsonify({'error': 'La categoría tiene productos asociados. Use force=true para borrar.'}), 400
             db.session.delete(categoria)
             db.session.commit()
-            invalidate_cache(pattern='categorias')
+            CategoryService.invalidate()
+            PromotionService.invalidate()
+            invalidate_cache(namespace='get_categorias')
+            CatalogCacheService.invalidar_categoria(id)
             return jsonify({'message': 'Categoría eliminada'}), 200
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': str(e)}), 500
             
     data = request.get_json()
+    padre_anterior = categoria.categoria_padre_id
     try:
         if 'nombre' in data: categoria.nombre = data['nombre']
         if 'descripcion' in data: categoria.descripcion = data['descripcion']
@@ -354,8 +387,13 @@ def manage_category(id):
                     db.session.add(sub_cat)
 
         db.session.commit()
-        invalidate_cache(pattern='categorias')
-        invalidate_cache(pattern='productos') # Invalida cache de productos para reflejar cambios de nombre de categoría
+        CategoryService.invalidate()
+        PromotionService.invalidate()
+        invalidate_cache(namespace='get_categorias')
+        # Invalida las páginas del catálogo con productos de esta categoría (nombres) y los listados que la abarcan
+        CatalogCacheService.invalidar_categoria(
+            id, categoria.categoria_padre_id if categoria.categoria_padre_id != padre_anterior else None
+        )
         return jsonify(categoria.to_dict()), 200
     except Exception as e:
         db.session.rollback()
@@ -382,6 +420,7 @@ def manage_stock():
                 )
                 db.session.add(stock)
             db.session.commit()
+            CatalogCacheService.invalidar_stock([data['producto_id']])
             return jsonify({'message': 'Stock actualizado'}), 200
         except Exception as e:
             db.session.rollback()
@@ -451,8 +490,10 @@ def manage_single_stock(id):
     stock = StockTalle.query.get_or_404(id)
     if request.method == 'DELETE':
         try:
+            producto_id = stock.producto_id
             db.session.delete(stock)
             db.session.commit()
+            CatalogCacheService.invalidar_stock([producto_id])
             return jsonify({'message': 'Stock eliminado'}), 200
         except Exception as e:
             db.session.rollback()
@@ -468,6 +509,7 @@ def manage_single_stock(id):
             stock.talle_id = data['talle_id']
             
         db.session.commit()
+        CatalogCacheService.invalidar_stock([stock.producto_id])
         return jsonify(stock.to_dict()), 200
     except Exception as e:
         db.session.rollback()
@@ -531,6 +573,7 @@ def add_stock_by_sizes():
             })
         
         db.session.commit()
+        CatalogCacheService.invalidar_stock([product_id])
         
         return jsonify({
             'message': 'Stock actualizado exitosamente',
@@ -572,7 +615,10 @@ def upload_imagen(producto_id):
                 es_principal=request.form.get('es_principal')=='true'
             )
             db.session.add(imagen)
+            # Las imágenes forman parte del detalle: marcar el producto para su ETag
+            Producto.query.filter_by(id=producto_id).update({'updated_at': datetime.utcnow()})
             db.session.commit()
+            CatalogCacheService.invalidar_productos([producto_id])
             return jsonify(imagen.to_dict()), 201
         except Exception as e:
             logger.error(f"Error processing image: {e}")
@@ -583,8 +629,11 @@ def upload_imagen(producto_id):
 @jwt_required()
 def delete_imagen(imagen_id):
     imagen = ImagenProducto.query.get_or_404(imagen_id)
+    producto_id = imagen.producto_id
     db.session.delete(imagen)
+    Producto.query.filter_by(id=producto_id).update({'updated_at': datetime.utcnow()})
     db.session.commit()
+    CatalogCacheService.invalidar_productos([producto_id])
     return jsonify({'message': 'Deleted'}), 200
 
 # ==================== PEDIDOS ====================
@@ -657,7 +706,7 @@ def update_pedido_estado(pedido_id):
             pedido.estado = data['estado']
         
         db.session.commit()
-        invalidate_cache(pattern='estadisticas')
+        cache_estadisticas.invalidate()
         
         return jsonify(pedido.to_dict()), 200
     except Exception as e:
@@ -698,49 +747,34 @@ def aprobar_pedido(pedido_id):
         if pedido.fecha_expiracion and pedido.fecha_expiracion < datetime.utcnow():
             return jsonify({'error': 'El pedido ha expirado y no puede ser aprobado'}), 400
         
-        # Verificar stock disponible antes de aprobar
-        for item in pedido.items:
-            stock_talle = StockTalle.query.filter_by(
-                producto_id=item.producto_id,
-                talle_id=item.talle_id
-            ).first()
-            
-            if not stock_talle or stock_talle.cantidad < item.cantidad:
-                producto = Producto.query.get(item.producto_id)
-                talle = Talle.query.get(item.talle_id)
-                return jsonify({
-                    'error': f'Stock insuficiente para {producto.nombre} talle {talle.nombre}'
-                }), 400
-        
         # Obtener admin que aprueba
         admin_identity = get_jwt_identity()
         admin = Admin.query.filter_by(username=admin_identity).first()
         
-        # Aprobar pedido
-        pedido.aprobado = True
-        pedido.fecha_aprobacion = datetime.utcnow()
-        pedido.admin_aprobador_id = admin.id if admin else None
-        pedido.estado = 'confirmado'
-        
-        # Reducir stock y actualizar ventas
-        for item in pedido.items:
-            stock_talle = StockTalle.query.filter_by(
-                producto_id=item.producto_id,
-                talle_id=item.talle_id
-            ).first()
-            
-            if stock_talle:
-                stock_talle.reducir_stock(item.cantidad)
-            
-            producto = Producto.query.get(item.producto_id)
-            if producto:
-                producto.ventas_count = (producto.ventas_count or 0) + item.cantidad
+        # Aprobar pedido: UPDATE condicional, si otra aprobación simultánea ya lo marcó no se
+        # descuenta el stock dos veces
+        pedidos_t = Pedido.__table__
+        marcados = db.session.execute(
+            pedidos_t.update()
+            .where(pedidos_t.c.id == pedido.id, pedidos_t.c.aprobado.is_(False))
+            .values(aprobado=True, estado='confirmado', fecha_aprobacion=datetime.utcnow(),
+                    admin_aprobador_id=admin.id if admin else None)
+        ).rowcount
+        if marcados != 1:
+            db.session.rollback()
+            return jsonify({'error': 'El pedido ya está aprobado'}), 409
+        
+        # Reducir stock y actualizar ventas: UPDATE condicionales, falla si otra aprobación
+        # o venta externa se llevó las unidades
+        producto_ids = StockService.descontar(
+            (item.producto_id, item.talle_id, item.cantidad) for item in pedido.items
+        )
         
         db.session.commit()
         
         # Invalidar caches relevantes
-        invalidate_cache(pattern='estadisticas')
-        invalidate_cache(pattern='productos')
+        cache_estadisticas.invalidate()
+        CatalogCacheService.invalidar_stock(producto_ids)
         
         # Enviar notificaciones al cliente (email)
         try:
@@ -754,10 +788,66 @@ def aprobar_pedido(pedido_id):
             'pedido': pedido.to_dict()
         }), 200
         
+    except StockInsuficiente as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@store_admin_bp.route('/api/admin/pedidos/aprobar-lote', methods=['POST'])
+@jwt_required()
+def aprobar_pedidos_lote():
+    """
+    Aprueba varios pedidos en una sola transacción: {"pedido_ids": [1, 2, ...]}.
+    Los que no tienen stock (repartido en el orden recibido), ya estaban aprobados o
+    expiraron se informan sin frenar al resto. Responde un resultado compacto por pedido
+    (sin el pedido completo) y envía los emails de aprobación en segundo plano.
+    """
+    data = request.get_json(silent=True) or {}
+    pedido_ids = data.get('pedido_ids')
+    if not isinstance(pedido_ids, list) or not pedido_ids:
+        return jsonify({'error': 'pedido_ids debe ser una lista de ids'}), 400
+    try:
+        pedido_ids = [int(pid) for pid in pedido_ids]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'pedido_ids debe ser una lista de ids'}), 400
+    if len(pedido_ids) > APROBAR_LOTE_MAX:
+        return jsonify({'error': f'Máximo {APROBAR_LOTE_MAX} pedidos por lote'}), 400
+
+    try:
+        admin = db.session.get(Admin, int(get_jwt_identity()))
+        resultado = OrderService.aprobar_lote(pedido_ids, admin.id if admin else None)
+    except ConflictoAprobacion as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+    # Invalidar caches relevantes una sola vez para todo el lote
+    aprobados = resultado['aprobados']
+    if aprobados:
+        cache_estadisticas.invalidate()
+        CatalogCacheService.invalidar_stock(resultado['producto_ids'])
+
+        # Enviar notificaciones al cliente (email) sin demorar la respuesta
+        def enviar_notificaciones(app, ids):
+            with app.app_context():
+                from services.notification_service import NotificationService
+                for pedido in Pedido.query.filter(Pedido.id.in_(ids)).all():
+                    try:
+                        NotificationService.send_order_approved_email(pedido)
+                    except Exception as notif_err:
+                        logging.error(f"Error enviando notificacion aprobacion {pedido.id}: {notif_err}")
+
+        Thread(target=enviar_notificaciones, args=(current_app._get_current_object(), aprobados)).start()
+
+    return jsonify({
+        'aprobados': len(aprobados),
+        'rechazados': len(resultado['resultados']) - len(aprobados),
+        'resultados': resultado['resultados']
+    }), 200
+
 # Endpoints de notas internas (ya existían en el plan original)
 @store_admin_bp.route('/api/admin/pedidos/<int:pedido_id>/notas', methods=['GET', 'POST'])
 @jwt_required()
@@ -842,17 +932,6 @@ def crear_venta_externa():
         if not talle:
             return jsonify({'error': 'Talle no encontrado'}), 404
         
-        # Verificar stock disponible
-        stock_talle = StockTalle.query.filter_by(
-            producto_id=producto_id,
-            talle_id=talle_id
-        ).first()
-        
-        if not stock_talle or stock_talle.cantidad < cantidad:
-            return jsonify({
-                'error': f'Stock insuficiente para {producto.nombre} talle {talle.nombre}. Disponible: {stock_talle.cantidad if stock_talle else 0}'
-            }), 400
-        
         # Obtener admin que registra la venta
         admin_id = get_jwt_identity()
         admin = Admin.query.get(int(admin_id))
@@ -875,24 +954,24 @@ def crear_venta_externa():
             notas=data.get('notas', '')
         )
         
-        # Reducir stock
-        stock_talle.reducir_stock(cantidad)
-        
-        # Incrementar contador de ventas del producto
-        producto.ventas_count = (producto.ventas_count or 0) + cantidad
+        # Reducir stock e incrementar contador de ventas (UPDATE condicional: valida el stock)
+        StockService.descontar([(producto_id, talle_id, cantidad)])
         
         db.session.add(venta)
         db.session.commit()
         
         # Invalidar caches relevantes
-        invalidate_cache(pattern='estadisticas')
-        invalidate_cache(pattern='productos')
+        cache_estadisticas.invalidate()
+        CatalogCacheService.invalidar_stock([producto_id])
         
         return jsonify({
             'message': 'Venta externa registrada exitosamente',
             'venta': venta.to_dict()
         }), 201
         
+    except StockInsuficiente as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -959,26 +1038,15 @@ def eliminar_venta_externa(venta_id):
     try:
         venta = VentaExterna.query.get_or_404(venta_id)
         
-        # Restaurar stock
-        stock_talle = StockTalle.query.filter_by(
-            producto_id=venta.producto_id,
-            talle_id=venta.talle_id
-        ).first()
-        
-        if stock_talle:
-            stock_talle.aumentar_stock(venta.cantidad)
-        
-        # Decrementar contador de ventas del producto
-        producto = Producto.query.get(venta.producto_id)
-        if producto and producto.ventas_count:
-            producto.ventas_count = max(0, producto.ventas_count - venta.cantidad)
+        # Restaurar stock y decrementar contador de ventas del producto
+        StockService.reponer([(venta.producto_id, venta.talle_id, venta.cantidad)])
         
         db.session.delete(venta)
         db.session.commit()
         
         # Invalidar caches relevantes
-        invalidate_cache(pattern='estadisticas')
-        invalidate_cache(pattern='productos')
+        cache_estadisticas.invalidate()
+        CatalogCacheService.invalidar_stock([venta.producto_id])
         
         return jsonify({'message': 'Venta externa eliminada y stock restaurado'}), 200
         
@@ -1039,7 +1107,13 @@ def create_promocion():
             
         db.session.add(promocion)
         db.session.commit()
-        invalidate_cache(pattern='productos')
+        PromotionService.invalidate()
+        CatalogCacheService.invalidar_promocion(
+            promocion.id,
+            [p.id for p in promocion.productos],
+            [c.id for c in promocion.categorias],
+            alcance_tienda=promocion.alcance == 'tienda'
+        )
         return jsonify(promocion.to_dict()), 201
     except Exception as e:
         db.session.rollback()
@@ -1049,12 +1123,19 @@ def create_promocion():
 @jwt_required()
 def manage_promocion(id):
     promocion = PromocionProducto.query.get_or_404(id)
+    # Vínculos previos: las páginas que mostraban la promoción también deben invalidarse
+    productos_anteriores = [p.id for p in promocion.productos]
+    categorias_anteriores = [c.id for c in promocion.categorias]
+    alcance_anterior = promocion.alcance
     
     if request.method == 'DELETE':
         try:
             db.session.delete(promocion)
             db.session.commit()
-            invalidate_cache(pattern='productos')
+            PromotionService.invalidate()
+            CatalogCacheService.invalidar_promocion(
+                id, productos_anteriores, categorias_anteriores, alcance_tienda=alcance_anterior == 'tienda'
+            )
             return jsonify({'message': 'Promoción eliminada'}), 200
         except Exception as e:
             db.session.rollback()
@@ -1093,7 +1174,13 @@ def manage_promocion(id):
             promocion.categorias = categorias
             
         db.session.commit()
-        invalidate_cache(pattern='productos')
+        PromotionService.invalidate()
+        CatalogCacheService.invalidar_promocion(
+            id,
+            productos_anteriores + [p.id for p in promocion.productos],
+            categorias_anteriores + [c.id for c in promocion.categorias],
+            alcance_tienda='tienda' in (alcance_anterior, promocion.alcance)
+        )
         return jsonify(promocion.to_dict()), 200
     except Exception as e:
         db.session.rollback()
@@ -1109,6 +1196,7 @@ def create_talle():
         talle = Talle(nombre=data['nombre'], orden=data.get('orden', 0))
         db.session.add(talle)
         db.session.commit()
+        invalidate_cache(namespace='get_talles')
         return jsonify(talle.to_dict()), 201
     except Exception as e:
         db.session.rollback()
@@ -1121,6 +1209,8 @@ def delete_talle(id):
     try:
         db.session.delete(talle)
         db.session.commit()
+        invalidate_cache(namespace='get_talles')
+        FragmentCacheService.invalidar()
         return jsonify({'message': 'Talle eliminado'}), 200
     except Exception as e:
         db.session.rollback()
@@ -1134,11 +1224,44 @@ def create_color():
         color = Color(nombre=data['nombre'], codigo_hex=data.get('codigo_hex'))
         db.session.add(color)
         db.session.commit()
+        invalidate_cache(namespace='get_colores')
         return jsonify(color.to_dict()), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+# ==================== CACHÉ ====================
+
+@store_admin_bp.route('/api/admin/cache/stats', methods=['GET'])
+@jwt_required()
+def get_cache_stats():
+    """Hits, misses, ocupación y tiempo de recálculo por namespace (del worker que responde)"""
+    return jsonify(CacheStatsService.resumen()), 200
+
+@store_admin_bp.route('/api/admin/cache/metrics', methods=['GET'])
+@jwt_required()
+def get_cache_metrics():
+    """Las mismas métricas en formato de texto de Prometheus"""
+    return current_app.response_class(
+        CacheStatsService.prometheus(), mimetype='text/plain; version=0.0.4'
+    )
+
+@store_admin_bp.route('/api/admin/cache/flush', methods=['POST'])
+@jwt_required()
+def flush_cache():
+    """Invalida un namespace ({"namespace": "get_talles"}) o todo el caché ({"todo": true})"""
+    data = request.get_json(silent=True) or {}
+    try:
+        if data.get('todo') is True:
+            CacheStatsService.flush_todo()
+            logger.info(f"Caché vaciado por {get_jwt_identity()}")
+            return jsonify({'message': 'Caché vaciado'}), 200
+        CacheStatsService.flush(data.get('namespace'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    logger.info(f"Namespace de caché '{data['namespace']}' invalidado por {get_jwt_identity()}")
+    return jsonify({'message': f"Namespace '{data['namespace']}' invalidado"}), 200
+
 @store_admin_bp.route('/api/admin/db/fix-sequences', methods=['POST'])
 @jwt_required()
 def fix_db_sequences_route():
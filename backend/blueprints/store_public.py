@@ -2,17 +2,21 @@ from flask import Blueprint, request, jsonify, send_from_directory, current_app
 from extensions import limiter, mail
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_mail import Message
-from cache_utils import cache, invalidate_cache, cached
+from cache_utils import cache, invalidate_cache, cached_response, conditional
 from models import *
-from sqlalchemy import or_, and_, desc
+from sqlalchemy import and_, desc, select, func
+from sqlalchemy.orm import joinedload
 from datetime import datetime
 import uuid
 import os
 import json
 import logging
 from threading import Thread
-from services.product_service import ProductService
+from services.product_service import ProductService, BATCH_MAX_IDS
 from services.order_service import OrderService
+from services.category_service import CategoryService
+from services.promotion_service import PromotionService
+from services.catalog_cache_service import CatalogCacheService
 
 logger = logging.getLogger(__name__)
 store_public_bp = Blueprint('store_public', __name__)
@@ -22,29 +26,121 @@ store_public_bp = Blueprint('store_public', __name__)
 @store_public_bp.route('/api/productos', methods=['GET'])
 def get_productos():
     """Obtener productos con filtros y paginación (público) - REFACTORIZADO"""
-    # CACHE DESACTIVADO TEMPORALMENTE PARA ORDENAMIENTO DE STOCK
-    # cache_key = f"productos:{request.query_string.decode()}"
-    # cached_result = cache.get(cache_key)
-    # if cached_result: return jsonify(cached_result), 200
+    # Caché por tags: se invalida solo lo afectado por cada escritura (ver CatalogCacheService)
+    cache_key = CatalogCacheService.make_key(request.args)
+    cached_body = CatalogCacheService.get(cache_key)
+    if cached_body: return cached_body.response()
 
     page = request.args.get('page', 1, type=int)
     page_size = request.args.get('page_size', 12, type=int)
     filters = request.args.to_dict()
-    
-    pagination = ProductService.get_catalog(filters, page, page_size)
+
+    # Proyección: ?view=card (tarjetas de listado) y/o ?fields=id,nombre,...
+    try:
+        view, fields = ProductService.parse_projection(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Modo cursor (opt-in): ?cursor= para la primera página, luego el next_cursor recibido
+    if 'cursor' in request.args:
+        incluir_total = request.args.get('incluir_total', 'false') == 'true'
+        try:
+            items, next_cursor, total = ProductService.get_catalog_cursor(
+                filters, request.args.get('cursor') or None, page_size, incluir_total, view=view
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        result = {
+            'items': ProductService.serialize(items, view, fields),
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None,
+            'page_size': page_size
+        }
+        if total is not None:
+            result['total'] = total
+        return CatalogCacheService.set(cache_key, result, filters, items).response()
+
+    pagination = ProductService.get_catalog(filters, page, page_size, view=view)
     
     result = {
-        'items': [p.to_dict() for p in pagination.items],
+        'items': ProductService.serialize(pagination.items, view, fields),
         'total': pagination.total,
         'page': page,
         'page_size': page_size,
         'pages': pagination.pages
     }
     
-    # cache.set(cache_key, result, ttl_seconds=300)
-    return jsonify(result), 200
+    return CatalogCacheService.set(cache_key, result, filters, pagination.items).response()
+
+@store_public_bp.route('/api/productos/facets', methods=['GET'])
+def get_productos_facets():
+    """Conteos por categoría, versión, banda de precio y estado de stock (mismos filtros que /api/productos)"""
+    cache_key = CatalogCacheService.make_key(request.args, prefijo='facetas')
+    cached_body = CatalogCacheService.get(cache_key)
+    if cached_body: return cached_body.response()
+
+    filters = request.args.to_dict()
+    rangos_precio = None
+    try:
+        if request.args.get('rangos_precio'):
+            # ?rangos_precio=0,30000,60000 (límites inferiores de cada banda)
+            rangos_precio = [float(v) for v in request.args['rangos_precio'].split(',') if v.strip()]
+        result = ProductService.get_facets(filters, rangos_precio)
+    except ValueError:
+        return jsonify({'error': 'Parámetros inválidos'}), 400
+
+    return CatalogCacheService.set_facetas(cache_key, result, filters).response()
+
+@store_public_bp.route('/api/productos/batch', methods=['GET'])
+def get_productos_batch():
+    """Varios productos por id en un solo pedido (carrito, favoritos, vistos recientemente)"""
+    try:
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+        view, fields = ProductService.parse_projection(request.args)
+    except ValueError:
+        return jsonify({'error': 'Parámetros inválidos'}), 400
+    if len(ids) > BATCH_MAX_IDS:
+        return jsonify({'error': f'Máximo {BATCH_MAX_IDS} productos por pedido'}), 400
+
+    productos = ProductService.get_batch(ids, view=view)
+    encontrados = [productos[i] for i in dict.fromkeys(ids) if i in productos]
+    items = ProductService.serialize(encontrados, view, fields)
+    return jsonify({
+        'productos': {str(p.id): item for p, item in zip(encontrados, items)},
+        'no_encontrados': [i for i in dict.fromkeys(ids) if i not in productos]
+    }), 200
+
+def _version_producto(id):
+    """
+    Sello del detalle de un producto con una sola query liviana: updated_at del producto,
+    de su stock y de sus relacionados (más cantidades, para detectar bajas), junto con
+    las versiones del grafo de categorías y del índice de promociones.
+    """
+    stock = StockTalle.__table__
+    rel = productos_relacionados
+    relacionados = Producto.__table__.alias('relacionados')
+    fila = db.session.execute(select(
+        Producto.updated_at,
+        Producto.activo,
+        select(func.max(stock.c.updated_at)).where(stock.c.producto_id == Producto.id).scalar_subquery(),
+        select(func.count()).select_from(stock).where(stock.c.producto_id == Producto.id).scalar_subquery(),
+        select(func.max(relacionados.c.updated_at)).select_from(
+            rel.join(relacionados, relacionados.c.id == rel.c.relacionado_id)
+        ).where(rel.c.producto_id == Producto.id).scalar_subquery(),
+        select(func.count()).select_from(rel).where(rel.c.producto_id == Producto.id).scalar_subquery()
+    ).where(Producto.id == id)).first()
+    if fila is None:
+        return None
+
+    grafo = CategoryService.get_graph()
+    index = PromotionService.get_index()
+    # Last-Modified también avanza cuando se reconstruyen los índices en memoria
+    fechas = [f for f in (fila[0], fila[2], fila[4], grafo.construido, index.generado) if f]
+    return (tuple(fila), grafo.version, index.version), max(fechas)
 
 @store_public_bp.route('/api/productos/<int:id>', methods=['GET'])
+@conditional(_version_producto)
 def get_producto(id):
     """Obtener detalle de producto (público)"""
     producto = Producto.query.get_or_404(id)
@@ -72,17 +168,11 @@ def get_categorias():
 
 @store_public_bp.route('/api/categorias/tree', methods=['GET'])
 # @cached(ttl_seconds=1) # Disabled cache temporarily to debug
+@conditional(lambda: (CategoryService.get_graph().version, None))
 def get_categorias_tree():
     try:
-        try:
-            # Intentar obtener con ordenamiento (puede fallar si falta la columna o migración)
-            categorias_raiz = Categoria.query.filter_by(categoria_padre_id=None).order_by(Categoria.orden).all()
-        except Exception as e_sort:
-            logger.warning(f"Error ordenando categorías (posible falta de columna orden): {e_sort}")
-            # Fallback sin ordenamiento
-            categorias_raiz = Categoria.query.filter_by(categoria_padre_id=None).all()
-            
-        return jsonify([c.get_arbol_completo() for c in categorias_raiz]), 200
+        # Árbol armado desde el grafo de categorías en memoria (una sola query al construirlo)
+        return jsonify(CategoryService.get_graph().arbol()), 200
     except Exception as e:
         logger.error(f"Error en Categorias Tree: {str(e)}")
         return jsonify({'error': 'Error generando el árbol de categorías'}), 500
@@ -90,7 +180,8 @@ def get_categorias_tree():
 # ==================== TALLES Y COLORES ====================
 
 @store_public_bp.route('/api/talles', methods=['GET'])
-@cached(ttl_seconds=3600)
+@conditional(ttl_seconds=3600)
+@cached_response(ttl_seconds=3600)
 def get_talles():
     talles = Talle.query.all()
     orden = {'S':1, 'M':2, 'L':3, 'XL':4, 'XXL':5, 'XXXL':6}
@@ -100,7 +191,8 @@ def get_talles():
     return jsonify([t.to_dict() for t in talles_s]), 200
 
 @store_public_bp.route('/api/colores', methods=['GET'])
-@cached(ttl_seconds=3600)
+@conditional(ttl_seconds=3600)
+@cached_response(ttl_seconds=3600)
 def get_colores():
     colores = Color.query.all()
     return jsonify([c.to_dict() for c in colores]), 200
@@ -108,14 +200,10 @@ def get_colores():
 # ==================== PROMOCIONES ====================
 
 @store_public_bp.route('/api/promociones', methods=['GET'])
+@conditional(lambda: (PromotionService.get_index().version, None))
 def get_promociones():
-    ahora = datetime.utcnow()
-    promos = PromocionProducto.query.filter(
-        PromocionProducto.activa == True,
-        PromocionProducto.fecha_inicio <= ahora,
-        or_(PromocionProducto.fecha_fin.is_(None), PromocionProducto.fecha_fin >= ahora)
-    ).all()
-    return jsonify([p.to_dict() for p in promos]), 200
+    # Promociones vigentes desde el índice en memoria (ya serializadas)
+    return jsonify(list(PromotionService.get_index().promos.values())), 200
 
 @store_public_bp.route('/api/promociones/validar', methods=['POST'])
 def validar_cupon():
@@ -154,15 +242,32 @@ def create_pedido():
     data = request.get_json()
     try:
         pedido = OrderService.create_order(data)
+        # Serializar antes del commit: después, cada producto y talle del pedido se releería
+        respuesta = pedido.to_dict()
         db.session.commit()
-        return jsonify(pedido.to_dict()), 201
+        return jsonify(respuesta), 201
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error Checkout: {str(e)}")
         return jsonify({'error': str(e)}), 400
 
+@store_public_bp.route('/api/checkout/quote', methods=['POST'])
+@limiter.limit("60 per minute")
+def cotizar_checkout():
+    """
+    Cotiza el carrito con las mismas reglas que POST /api/orders (stock, promociones, cupón,
+    método de pago) y las opciones de envío, sin crear el pedido ni consumir el cupón.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(OrderService.quote(data)), 200
+    except Exception as e:
+        logger.info(f"Cotización rechazada: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
 @store_public_bp.route('/api/metodos-pago', methods=['GET'])
-@cached(ttl_seconds=3600)
+@conditional(ttl_seconds=3600)
+@cached_response(ttl_seconds=3600)
 def get_metodos_pago():
     metodos = MetodoPago.query.filter_by(activo=True).all()
     return jsonify([m.to_dict() for m in metodos]), 200
@@ -316,7 +421,10 @@ def get_cart():
             # Pero por ahora devolvemos vacío o error
              return jsonify({'items': []}), 200
 
-        carrito = Carrito.query.filter_by(cliente_id=cliente.id).first()
+        # Items y sus talles en la misma query que el carrito
+        carrito = Carrito.query.options(
+            joinedload(Carrito.items).joinedload(ItemCarrito.talle)
+        ).filter_by(cliente_id=cliente.id).first()
         if not carrito:
             return jsonify({'items': [], 'updated_at': None}), 200
             
@@ -333,13 +441,18 @@ def get_cart():
                 return jsonify({'items': [], 'updated_at': None}), 200
 
         # Formato compatible con frontend CartItem
+        # Todos los productos del carrito en una sola carga (incluye inactivos, como antes)
+        productos = ProductService.get_batch([item.producto_id for item in carrito.items], solo_activos=False)
+        en_carrito = [productos.get(item.producto_id) or item.producto for item in carrito.items]
+        # Vista full: importante el stock para validaciones (desde los fragmentos cacheados)
+        serializados = ProductService.serialize(en_carrito, 'full')
         items = []
-        for item in carrito.items:
+        for item, producto, producto_dict in zip(carrito.items, en_carrito, serializados):
             items.append({
-                'producto': item.producto.to_dict(include_stock=True), # Importante el stock para validaciones
+                'producto': producto_dict,
                 'talle': item.talle.to_dict(),
                 'cantidad': item.cantidad,
-                'precio_unitario': item.producto.precio_base, # Siempre base, igual que frontend
+                'precio_unitario': producto.precio_base, # Siempre base, igual que frontend
                 'descuento': 0 # Frontend recalcula descuentos dinámicos
             })
             
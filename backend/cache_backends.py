@@ -0,0 +1,499 @@
+"""
+Backends compartidos del caché y bus de invalidación entre workers.
+
+Con varios workers de gunicorn cada proceso tiene su propio caché en memoria. Hay dos
+formas de mantenerlos coherentes (ver crear_cache en cache_utils):
+- Un almacén compartido (SQLiteCache en el mismo host, RedisCache entre hosts): todos los
+  workers leen y escriben las mismas entradas, así que una invalidación vale para todos.
+- Caché en memoria por worker + bus de invalidación (LocalBus, SQLiteBus, RedisBus): cada
+  invalidación se publica y los demás workers la aplican a su copia antes de leer.
+
+Los valores de los almacenes compartidos se serializan con pickle: usar solo almacenes
+de confianza (un archivo local del servidor o un Redis privado).
+"""
+from typing import Any, Iterable, Optional
+from threading import local, Lock, Thread
+from collections import deque
+import json
+import logging
+import os
+import pickle
+import re
+import sqlite3
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Eventos del bus: ('bump', namespace) | ('tags', [tags]) | ('delete', clave) | ('pattern', patrón) | ('clear',)
+
+class CacheNamespace:
+    """
+    Grupo de claves que se invalida de una vez incrementando su generación.
+
+    Uso:
+        estadisticas = cache.namespace('estadisticas')
+        estadisticas.set('general', stats)
+        estadisticas.get('general')
+        estadisticas.invalidate()
+    """
+    def __init__(self, cache, name: str):
+        self.cache = cache
+        self.name = name
+
+    def key(self, suffix: str) -> str:
+        return f"{self.name}@{self.cache.generation(self.name)}:{suffix}"
+
+    def get(self, suffix: str) -> Optional[Any]:
+        return self.cache.get(self.key(suffix))
+
+    def set(self, suffix: str, value: Any, ttl_seconds: int = 300, tags: Optional[Iterable[str]] = None):
+        self.cache.set(self.key(suffix), value, ttl_seconds, tags)
+
+    def invalidate(self) -> int:
+        return self.cache.bump(self.name)
+
+
+_SEPARADOR_NAMESPACE = re.compile(r'[@:]')
+
+def namespace_de(key: str) -> str:
+    """Namespace de una clave: lo que precede a la generación o al primer ':'"""
+    return _SEPARADOR_NAMESPACE.split(key, 1)[0]
+
+_CONTADORES_NAMESPACE = ('hits', 'misses', 'evictions', 'expirations', 'calculos', 'tiempo_calculo')
+
+
+class BaseCache:
+    """Contadores y helpers comunes a todos los backends"""
+    backend = 'base'
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._por_namespace = {}  # namespace -> contadores (ver _CONTADORES_NAMESPACE)
+
+    def namespace(self, name: str) -> CacheNamespace:
+        return CacheNamespace(self, name)
+
+    def _contar(self, key: str, contador: str, cantidad: float = 1):
+        """Suma al contador global y al del namespace de la clave"""
+        if contador in ('hits', 'misses', 'evictions', 'expirations'):
+            setattr(self, contador, getattr(self, contador) + cantidad)
+        contadores = self._por_namespace.get(namespace_de(key))
+        if contadores is None:
+            contadores = self._por_namespace.setdefault(namespace_de(key), dict.fromkeys(_CONTADORES_NAMESPACE, 0))
+        contadores[contador] += cantidad
+
+    def registrar_calculo(self, key: str, segundos: float):
+        """Registra cuánto tardó en calcularse un valor (get_or_compute)"""
+        self._contar(key, 'calculos')
+        self._contar(key, 'tiempo_calculo', segundos)
+
+    def _ocupacion_por_namespace(self) -> dict:
+        """namespace -> (entradas, bytes). Los backends que no pueden calcularlo retornan {}"""
+        return {}
+
+    def stats_by_namespace(self) -> list:
+        """Contadores de este proceso y ocupación actual, por namespace"""
+        ocupacion = self._ocupacion_por_namespace()
+        resultado = []
+        for ns in sorted(set(self._por_namespace) | set(ocupacion)):
+            c = dict(self._por_namespace.get(ns) or dict.fromkeys(_CONTADORES_NAMESPACE, 0))
+            consultas = c['hits'] + c['misses']
+            entradas, bytes_ = ocupacion.get(ns, (None, None))
+            resultado.append({
+                'namespace': ns,
+                'hits': c['hits'],
+                'misses': c['misses'],
+                'hit_ratio': round(c['hits'] / consultas, 4) if consultas else None,
+                'entries': entradas,
+                'bytes': bytes_,
+                'evictions': c['evictions'],
+                'expirations': c['expirations'],
+                'recomputes': c['calculos'],
+                'recompute_seconds_total': round(c['tiempo_calculo'], 6),
+                'recompute_avg_ms': round(c['tiempo_calculo'] / c['calculos'] * 1000, 3) if c['calculos'] else None
+            })
+        return resultado
+
+    def _contadores(self) -> dict:
+        consultas = self.hits + self.misses
+        return {
+            'backend': self.backend,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / consultas, 4) if consultas else None,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+
+class SQLiteCache(BaseCache):
+    """
+    Almacén compartido por todos los workers de un mismo host en un archivo SQLite (WAL).
+    Al superar max_entries o max_bytes descarta primero las entradas más próximas a vencer
+    (actualizar el orden de uso en cada lectura costaría una escritura por hit).
+    """
+    backend = 'sqlite'
+
+    def __init__(self, path: str, max_entries: int, max_bytes: int, sweep_interval: int = 30):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._ultimo_barrido = 0
+        self._local = local()
+        with self._conn() as conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS cache_entradas (
+                    clave TEXT PRIMARY KEY, valor BLOB NOT NULL, vence REAL NOT NULL, tamanio INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_cache_entradas_vence ON cache_entradas (vence);
+                CREATE TABLE IF NOT EXISTS cache_tags (
+                    tag TEXT NOT NULL,
+                    clave TEXT NOT NULL REFERENCES cache_entradas (clave) ON DELETE CASCADE,
+                    PRIMARY KEY (tag, clave)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_cache_tags_clave ON cache_tags (clave);
+                CREATE TABLE IF NOT EXISTS cache_generaciones (namespace TEXT PRIMARY KEY, generacion INTEGER NOT NULL);
+            ''')
+
+    def _conn(self) -> sqlite3.Connection:
+        # Una conexión por thread y por proceso (no reutilizar la del master tras el fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        fila = self._conn().execute(
+            'SELECT valor, vence FROM cache_entradas WHERE clave = ?', (key,)
+        ).fetchone()
+        if fila is not None:
+            if fila[1] >= time.time():
+                self._contar(key, 'hits')
+                return pickle.loads(fila[0])
+            # Solo si sigue vencida: otro worker pudo haber guardado un valor nuevo en el medio
+            self._conn().execute('DELETE FROM cache_entradas WHERE clave = ? AND vence < ?', (key, time.time()))
+            self._contar(key, 'expirations')
+        self._contar(key, 'misses')
+        return None
+
+    def set(self, key: str, value: Any, ttl_seconds: int = 300, tags: Optional[Iterable[str]] = None):
+        try:
+            valor = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.debug(f"Valor no serializable para el caché ({key}): {e}")
+            return
+        tamanio = len(key) + len(valor)
+        if tamanio > self.max_bytes:
+            # No entra, pero el valor anterior de la clave ya no es el vigente
+            self.delete(key)
+            return
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM cache_entradas WHERE clave = ?', (key,))
+            conn.execute(
+                'INSERT INTO cache_entradas (clave, valor, vence, tamanio) VALUES (?, ?, ?, ?)',
+                (key, valor, time.time() + ttl_seconds, tamanio)
+            )
+            if tags:
+                conn.executemany('INSERT OR IGNORE INTO cache_tags (tag, clave) VALUES (?, ?)',
+                                 [(tag, key) for tag in set(tags)])
+        if time.monotonic() - self._ultimo_barrido >= self.sweep_interval:
+            self._barrer()
+
+    def _barrer(self):
+        """Elimina las vencidas y, si se superó el presupuesto, las más próximas a vencer"""
+        self._ultimo_barrido = time.monotonic()
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self.expirations += conn.execute('DELETE FROM cache_entradas WHERE vence < ?', (time.time(),)).rowcount
+            entradas, bytes_ = conn.execute('SELECT count(*), coalesce(sum(tamanio), 0) FROM cache_entradas').fetchone()
+            sobrantes = max(0, entradas - self.max_entries)
+            if bytes_ > self.max_bytes and entradas:
+                # Aproximación por tamaño promedio: liberar lo que sobra más un 10% de margen
+                promedio = bytes_ / entradas
+                sobrantes = max(sobrantes, int((bytes_ - self.max_bytes * 0.9) / promedio) + 1)
+            if sobrantes:
+                self.evictions += conn.execute(
+                    'DELETE FROM cache_entradas WHERE clave IN '
+                    '(SELECT clave FROM cache_entradas ORDER BY vence LIMIT ?)', (sobrantes,)
+                ).rowcount
+
+    def delete(self, key: str):
+        self._conn().execute('DELETE FROM cache_entradas WHERE clave = ?', (key,))
+
+    def clear(self):
+        self._conn().execute('DELETE FROM cache_entradas')
+
+    def clear_pattern(self, pattern: str):
+        self._conn().execute('DELETE FROM cache_entradas WHERE instr(clave, ?) > 0', (pattern,))
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        tags = list(tags)
+        if not tags:
+            return 0
+        marcas = ','.join('?' * len(tags))
+        return self._conn().execute(
+            f'DELETE FROM cache_entradas WHERE clave IN (SELECT clave FROM cache_tags WHERE tag IN ({marcas}))',
+            tags
+        ).rowcount
+
+    def generation(self, namespace: str) -> int:
+        fila = self._conn().execute(
+            'SELECT generacion FROM cache_generaciones WHERE namespace = ?', (namespace,)
+        ).fetchone()
+        return fila[0] if fila else 0
+
+    def bump(self, namespace: str) -> int:
+        return self._conn().execute(
+            'INSERT INTO cache_generaciones (namespace, generacion) VALUES (?, 1) '
+            'ON CONFLICT (namespace) DO UPDATE SET generacion = generacion + 1 RETURNING generacion',
+            (namespace,)
+        ).fetchone()[0]
+
+    def _ocupacion_por_namespace(self) -> dict:
+        ocupacion = {}
+        for clave, tamanio in self._conn().execute('SELECT clave, tamanio FROM cache_entradas'):
+            entradas, bytes_ = ocupacion.get(namespace_de(clave), (0, 0))
+            ocupacion[namespace_de(clave)] = (entradas + 1, bytes_ + tamanio)
+        return ocupacion
+
+    def stats(self) -> dict:
+        entradas, bytes_ = self._conn().execute(
+            'SELECT count(*), coalesce(sum(tamanio), 0) FROM cache_entradas'
+        ).fetchone()
+        return {
+            'entries': entradas,
+            'bytes': bytes_,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            **self._contadores()
+        }
+
+
+def _cliente_redis(url: str):
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("CACHE_BACKEND/CACHE_BUS 'redis' requiere el paquete 'redis' (pip install redis)")
+    return redis.Redis.from_url(url)
+
+
+class RedisCache(BaseCache):
+    """
+    Almacén compartido en Redis (o un servidor compatible con el protocolo).
+    El límite de memoria y la política de desalojo son los del servidor (maxmemory-policy).
+    client: instancia compatible con redis.Redis (permite usar un sustituto local).
+    """
+    backend = 'redis'
+    # Los sets de tags viven al menos lo que la entrada más larga del caché
+    TAG_TTL = 24 * 3600
+
+    def __init__(self, url: Optional[str] = None, client=None, prefijo: str = 'elvestuario:cache:'):
+        super().__init__()
+        self.client = client if client is not None else _cliente_redis(url)
+        self.prefijo = prefijo
+
+    def _k(self, key: str) -> str:
+        return self.prefijo + 'e:' + key
+
+    def _tag(self, tag: str) -> str:
+        return self.prefijo + 't:' + tag
+
+    def get(self, key: str) -> Optional[Any]:
+        valor = self.client.get(self._k(key))
+        if valor is None:
+            self._contar(key, 'misses')
+            return None
+        self._contar(key, 'hits')
+        return pickle.loads(valor)
+
+    def set(self, key: str, value: Any, ttl_seconds: int = 300, tags: Optional[Iterable[str]] = None):
+        try:
+            valor = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.debug(f"Valor no serializable para el caché ({key}): {e}")
+            return
+        pipe = self.client.pipeline()
+        pipe.set(self._k(key), valor, ex=max(1, int(ttl_seconds)))
+        for tag in set(tags or ()):
+            pipe.sadd(self._tag(tag), key)
+            pipe.expire(self._tag(tag), max(self.TAG_TTL, int(ttl_seconds)))
+        pipe.execute()
+
+    def delete(self, key: str):
+        self.client.delete(self._k(key))
+
+    def _borrar_match(self, match: str):
+        claves = list(self.client.scan_iter(match=match, count=500))
+        for i in range(0, len(claves), 500):
+            self.client.delete(*claves[i:i + 500])
+
+    def clear(self):
+        self._borrar_match(self.prefijo + 'e:*')
+        self._borrar_match(self.prefijo + 't:*')
+
+    def clear_pattern(self, pattern: str):
+        # Escapar los comodines de SCAN MATCH
+        for c in '\\*?[]':
+            pattern = pattern.replace(c, '\\' + c)
+        self._borrar_match(self.prefijo + 'e:*' + pattern + '*')
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        claves = set()
+        for tag in tags:
+            claves.update(self.client.smembers(self._tag(tag)))
+            self.client.delete(self._tag(tag))
+        if not claves:
+            return 0
+        return self.client.delete(*[self._k(c.decode() if isinstance(c, bytes) else c) for c in claves])
+
+    def generation(self, namespace: str) -> int:
+        return int(self.client.get(self.prefijo + 'g:' + namespace) or 0)
+
+    def bump(self, namespace: str) -> int:
+        return int(self.client.incr(self.prefijo + 'g:' + namespace))
+
+    def stats(self) -> dict:
+        return self._contadores()
+
+
+# ==================== BUS DE INVALIDACIÓN ====================
+
+class LocalBus:
+    """
+    Bus dentro del proceso: los buses creados sobre el mismo canal se ven entre sí.
+    Sirve para simular varios workers con varias instancias de SimpleCache.
+
+    Uso:
+        canal = []
+        cache_a = SimpleCache(bus=LocalBus(canal))
+        cache_b = SimpleCache(bus=LocalBus(canal))
+    """
+    def __init__(self, canal: Optional[list] = None):
+        self.canal = canal if canal is not None else []
+        self._visto = len(self.canal)
+        self._origen = uuid.uuid4().hex
+
+    def publish(self, evento: tuple):
+        self.canal.append((self._origen, evento))
+
+    def poll(self) -> list:
+        nuevos = self.canal[self._visto:]
+        self._visto += len(nuevos)
+        return [evento for origen, evento in nuevos if origen != self._origen]
+
+
+class SQLiteBus:
+    """
+    Bus entre los workers de un mismo host sobre una tabla SQLite. poll() consulta
+    PRAGMA data_version, que solo cambia cuando otra conexión escribió en el archivo:
+    mientras no haya invalidaciones no lee ninguna fila.
+    """
+    # Los eventos más viejos que esto ya no interesan a nadie (los TTL son menores)
+    RETENCION = 3600
+
+    def __init__(self, path: str):
+        self.path = path
+        self._origen = uuid.uuid4().hex
+        self._pid = os.getpid()
+        self._publicados = 0
+        self._local = local()
+        self._lock = Lock()
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_eventos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, origen TEXT NOT NULL, evento TEXT NOT NULL, creado REAL NOT NULL
+            )
+        ''')
+        self._visto = conn.execute('SELECT coalesce(max(id), 0) FROM cache_eventos').fetchone()[0]
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            # Proceso hijo (fork): identidad propia para no ignorar los eventos del padre
+            self._pid = os.getpid()
+            self._origen = uuid.uuid4().hex
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.data_version = None
+        return conn
+
+    def publish(self, evento: tuple):
+        conn = self._conn()
+        ahora = time.time()
+        conn.execute('INSERT INTO cache_eventos (origen, evento, creado) VALUES (?, ?, ?)',
+                     (self._origen, json.dumps(evento), ahora))
+        self._publicados += 1
+        if self._publicados % 100 == 0:
+            conn.execute('DELETE FROM cache_eventos WHERE creado < ?', (ahora - self.RETENCION,))
+
+    def poll(self) -> list:
+        conn = self._conn()
+        # data_version es propio de cada conexión (una por thread)
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._local.data_version:
+            return []
+        self._local.data_version = data_version
+        with self._lock:
+            filas = conn.execute(
+                'SELECT id, origen, evento FROM cache_eventos WHERE id > ? ORDER BY id', (self._visto,)
+            ).fetchall()
+            if filas:
+                self._visto = filas[-1][0]
+        return [tuple(json.loads(evento)) for _, origen, evento in filas if origen != self._origen]
+
+
+class RedisBus:
+    """Bus sobre pub/sub de Redis; un thread por worker recibe los eventos de los demás"""
+    CANAL = 'elvestuario:cache:invalidaciones'
+
+    def __init__(self, url: Optional[str] = None, client=None):
+        self.client = client if client is not None else _cliente_redis(url)
+        self._origen = uuid.uuid4().hex
+        self._pendientes = deque()
+        self._pid = None
+
+    def _escuchar(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.CANAL)
+        for mensaje in pubsub.listen():
+            try:
+                origen, evento = json.loads(mensaje['data'])
+            except (TypeError, ValueError, KeyError):
+                continue
+            if origen != self._origen:
+                self._pendientes.append(tuple(evento))
+
+    def _iniciar(self):
+        # El thread se inicia en el worker (después del fork), no en el master
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._origen = uuid.uuid4().hex
+            Thread(target=self._escuchar, daemon=True, name='cache-bus').start()
+
+    def publish(self, evento: tuple):
+        self._iniciar()
+        self.client.publish(self.CANAL, json.dumps([self._origen, evento]))
+
+    def poll(self) -> list:
+        self._iniciar()
+        eventos = []
+        while self._pendientes:
+            eventos.append(self._pendientes.popleft())
+        return eventos
@@ -1,90 +1,471 @@
 """
 Sistema de caché simple en memoria con TTL (Time To Live)
 """
-from datetime import datetime, timedelta
+from collections import OrderedDict
 from functools import wraps
-from typing import Any, Callable, Optional
+from threading import Lock, RLock, Thread
+from typing import Any, Callable, Iterable, Optional
+from urllib.parse import urlencode
 import hashlib
+import heapq
+import itertools
 import json
+import logging
+import math
+import os
+import random
+import sys
+import time
+from cache_backends import BaseCache, CacheNamespace, SQLiteCache, RedisCache, SQLiteBus, RedisBus, namespace_de
+
+logger = logging.getLogger(__name__)
+
+# Presupuesto del caché por proceso (cada worker de gunicorn tiene el suyo)
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 5000))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# Cada cuántos segundos, como mínimo, una escritura barre las entradas vencidas
+CACHE_SWEEP_INTERVAL = 30
+# memory (por proceso) | sqlite (compartido en el host) | redis (compartido entre hosts)
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+# Con CACHE_BACKEND=memory: bus para propagar invalidaciones entre workers (none | sqlite | redis)
+CACHE_BUS = os.environ.get('CACHE_BUS', 'none')
+# Archivo SQLite o URL de Redis del backend / bus
+CACHE_URL = os.environ.get('CACHE_URL')
+# Fracción máxima en que se acorta al azar cada TTL de @cached (evita vencimientos simultáneos)
+CACHE_TTL_JITTER = 0.1
+# Cuánto espera un request a que otro termine de calcular la misma clave antes de calcularla él
+SINGLE_FLIGHT_TIMEOUT = 30
+
+def _estimar_tamanio(value: Any) -> int:
+    """Tamaño aproximado en bytes de un valor cacheado (cuerpo de la respuesta o su JSON)"""
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, CachedBody):
+        return sum(len(cuerpo) for cuerpo in value.variantes.values())
+    if isinstance(value, tuple):
+        return sum(_estimar_tamanio(v) for v in value)
+    if hasattr(value, 'get_data') and not getattr(value, 'is_streamed', False):
+        # Response de Flask
+        return len(value.get_data())
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
 
 class CacheEntry:
-    """Entrada de caché con valor y tiempo de expiración"""
-    def __init__(self, value: Any, ttl_seconds: int):
+    """Entrada de caché con valor, tiempo de expiración y tags opcionales"""
+    __slots__ = ('value', 'expiry', 'tags', 'size')
+
+    def __init__(self, value: Any, ttl_seconds: int, tags: Optional[Iterable[str]] = None, size: int = 0):
         self.value = value
-        self.expiry = datetime.now() + timedelta(seconds=ttl_seconds)
+        self.expiry = time.monotonic() + ttl_seconds
+        self.tags = frozenset(tags or ())
+        self.size = size
     
-    def is_expired(self) -> bool:
+    def is_expired(self, ahora: Optional[float] = None) -> bool:
         """Verifica si la entrada ha expirado"""
-        return datetime.now() > self.expiry
+        return (time.monotonic() if ahora is None else ahora) > self.expiry
+
+class SimpleCache(BaseCache):
+    """
+    Caché en memoria con TTL, invalidación por tags y límite de tamaño.
+    - LRU: al superar max_entries o max_bytes se descartan las entradas menos usadas.
+    - Expiración: además de la perezosa en get(), las escrituras barren las vencidas
+      cada CACHE_SWEEP_INTERVAL segundos usando un heap por fecha de vencimiento.
+    - Thread-safe: todas las operaciones toman el mismo lock (workers con threads).
+    - bus (opcional): publica las invalidaciones y aplica las de los otros workers
+      antes de cada lectura.
+    """
+    backend = 'memory'
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES, bus=None):
+        super().__init__()
+        self.bus = bus
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._cache = OrderedDict()  # clave -> CacheEntry, de menos a más recientemente usada
+        self._tags = {}  # tag -> set de claves que lo llevan
+        self._vencimientos = []  # heap de (expiry, n, clave, entry); las entradas reemplazadas quedan huérfanas
+        self._secuencia = itertools.count()  # desempate del heap
+        self._bytes = 0
+        self._ultimo_barrido = time.monotonic()
+        self._generaciones = {}  # namespace -> generación vigente
+        self._lock = RLock()
 
-class SimpleCache:
-    """Sistema de caché simple en memoria con TTL"""
-    def __init__(self):
-        self._cache = {}
+    def _sincronizar(self):
+        """Aplica las invalidaciones publicadas por otros workers"""
+        if self.bus is None:
+            return
+        try:
+            eventos = self.bus.poll()
+        except Exception as e:
+            logger.warning(f"Bus de invalidación no disponible: {e}")
+            return
+        if not eventos:
+            return
+        with self._lock:
+            for tipo, *datos in eventos:
+                if tipo == 'bump':
+                    self._generaciones[datos[0]] = self._generaciones.get(datos[0], 0) + 1
+                elif tipo == 'tags':
+                    self._invalidar_tags(datos[0])
+                elif tipo == 'delete':
+                    self._remove(datos[0])
+                elif tipo == 'pattern':
+                    self._clear_pattern(datos[0])
+                elif tipo == 'clear':
+                    self._clear()
+        _notificar_invalidacion()
+
+    def _publicar(self, *evento):
+        if self.bus is None:
+            return
+        try:
+            self.bus.publish(evento)
+        except Exception as e:
+            logger.warning(f"No se pudo publicar la invalidación {evento[0]}: {e}")
     
     def get(self, key: str) -> Optional[Any]:
         """Obtiene un valor del caché si existe y no ha expirado"""
-        if key in self._cache:
-            entry = self._cache[key]
-            if not entry.is_expired():
-                return entry.value
-            else:
+        self._sincronizar()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                if not entry.is_expired():
+                    self._cache.move_to_end(key)
+                    self._contar(key, 'hits')
+                    return entry.value
                 # Eliminar entrada expirada
-                del self._cache[key]
-        return None
+                self._remove(key)
+                self._contar(key, 'expirations')
+            self._contar(key, 'misses')
+            return None
     
-    def set(self, key: str, value: Any, ttl_seconds: int = 300):
-        """Guarda un valor en el caché con TTL (default 5 minutos)"""
-        self._cache[key] = CacheEntry(value, ttl_seconds)
+    def set(self, key: str, value: Any, ttl_seconds: int = 300, tags: Optional[Iterable[str]] = None):
+        """Guarda un valor en el caché con TTL (default 5 minutos) y tags opcionales"""
+        size = len(key) + _estimar_tamanio(value)
+        if size > self.max_bytes:
+            # Nunca entraría: no vaciar el caché para intentarlo, pero sí descartar el valor
+            # anterior de la clave (ya no es el vigente)
+            with self._lock:
+                self._remove(key)
+            return
+        entry = CacheEntry(value, ttl_seconds, tags, size)
+        with self._lock:
+            self._remove(key)
+            self._cache[key] = entry
+            self._bytes += size
+            for tag in entry.tags:
+                self._tags.setdefault(tag, set()).add(key)
+            heapq.heappush(self._vencimientos, (entry.expiry, next(self._secuencia), key, entry))
+
+            ahora = time.monotonic()
+            if ahora - self._ultimo_barrido >= CACHE_SWEEP_INTERVAL:
+                self._barrer(ahora)
+            self._desalojar()
     
     def delete(self, key: str):
         """Elimina una entrada del caché"""
-        if key in self._cache:
-            del self._cache[key]
+        with self._lock:
+            self._remove(key)
+        self._publicar('delete', key)
+
+    def _remove(self, key: str) -> Optional[CacheEntry]:
+        entry = self._cache.pop(key, None)
+        if entry is None:
+            return None
+        self._bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+        return entry
+
+    def _barrer(self, ahora: float):
+        """Elimina las entradas vencidas (en orden de vencimiento) y compacta el heap"""
+        self._ultimo_barrido = ahora
+        heap = self._vencimientos
+        while heap and heap[0][0] < ahora:
+            _, _, key, entry = heapq.heappop(heap)
+            if self._cache.get(key) is entry:
+                self._remove(key)
+                self._contar(key, 'expirations')
+        # Las entradas reemplazadas o borradas dejan huérfanos en el heap
+        if len(heap) > 2 * len(self._cache) + 64:
+            self._vencimientos = [item for item in heap if self._cache.get(item[2]) is item[3]]
+            heapq.heapify(self._vencimientos)
+
+    def _desalojar(self):
+        """Descarta las entradas menos usadas hasta volver al presupuesto"""
+        while self._cache and (len(self._cache) > self.max_entries or self._bytes > self.max_bytes):
+            key = next(iter(self._cache))
+            self._remove(key)
+            self._contar(key, 'evictions')
     
     def clear(self):
         """Limpia todo el caché"""
-        self._cache.clear()
+        self._clear()
+        self._publicar('clear')
+
+    def _clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._tags.clear()
+            self._vencimientos = []
+            self._bytes = 0
     
     def clear_pattern(self, pattern: str):
         """Elimina todas las entradas que contengan el patrón"""
-        keys_to_delete = [key for key in self._cache.keys() if pattern in key]
-        for key in keys_to_delete:
-            del self._cache[key]
+        self._clear_pattern(pattern)
+        self._publicar('pattern', pattern)
+
+    def _clear_pattern(self, pattern: str):
+        with self._lock:
+            keys_to_delete = [key for key in self._cache.keys() if pattern in key]
+            for key in keys_to_delete:
+                self._remove(key)
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """Elimina todas las entradas que lleven alguno de los tags. Retorna cuántas eliminó"""
+        tags = list(tags)
+        eliminadas = self._invalidar_tags(tags)
+        self._publicar('tags', tags)
+        return eliminadas
+
+    def _invalidar_tags(self, tags: Iterable[str]) -> int:
+        with self._lock:
+            keys_to_delete = set()
+            for tag in tags:
+                keys_to_delete.update(self._tags.get(tag, ()))
+            for key in keys_to_delete:
+                self._remove(key)
+            return len(keys_to_delete)
+
+    def generation(self, namespace: str) -> int:
+        """Generación vigente del namespace (forma parte de sus claves)"""
+        self._sincronizar()
+        return self._generaciones.get(namespace, 0)
+
+    def bump(self, namespace: str) -> int:
+        """
+        Invalida todo el namespace en O(1): las claves nuevas llevan la siguiente generación
+        y las viejas quedan inaccesibles hasta que las descarten el LRU o su TTL.
+        """
+        with self._lock:
+            generacion = self._generaciones.get(namespace, 0) + 1
+            self._generaciones[namespace] = generacion
+        self._publicar('bump', namespace)
+        return generacion
+
+    def _ocupacion_por_namespace(self) -> dict:
+        with self._lock:
+            ocupacion = {}
+            for key, entry in self._cache.items():
+                entradas, bytes_ = ocupacion.get(namespace_de(key), (0, 0))
+                ocupacion[namespace_de(key)] = (entradas + 1, bytes_ + entry.size)
+            return ocupacion
+
+    def stats(self) -> dict:
+        """Contadores de uso y ocupación actual"""
+        with self._lock:
+            return {
+                'entries': len(self._cache),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'tags': len(self._tags),
+                **self._contadores()
+            }
+
+def _ruta_sqlite(url: Optional[str]) -> str:
+    if url:
+        return url
+    carpeta = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+    os.makedirs(carpeta, exist_ok=True)
+    return os.path.join(carpeta, 'cache.db')
+
+def crear_cache(backend: str = CACHE_BACKEND, bus: str = CACHE_BUS, url: Optional[str] = CACHE_URL):
+    """
+    Crea el caché según la configuración (variables CACHE_BACKEND, CACHE_BUS, CACHE_URL).
+    - memory: un caché por worker; con bus sqlite/redis las invalidaciones llegan a todos.
+    - sqlite: un archivo compartido por los workers del host (default instance/cache.db).
+    - redis: servidor compartido (CACHE_URL=redis://...).
+    """
+    if backend == 'sqlite':
+        return SQLiteCache(_ruta_sqlite(url), CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_SWEEP_INTERVAL)
+    if backend == 'redis':
+        return RedisCache(url)
+    if backend != 'memory':
+        raise ValueError(f"CACHE_BACKEND desconocido: {backend}")
+
+    if bus == 'sqlite':
+        return SimpleCache(bus=SQLiteBus(_ruta_sqlite(url)))
+    if bus == 'redis':
+        return SimpleCache(bus=RedisBus(url))
+    return SimpleCache()
 
 # Instancia global del caché
-cache = SimpleCache()
+cache = crear_cache()
+
+_TIPOS_SIMPLES = (str, int, float, bool, type(None))
+# Claves más largas se resumen con un hash
+_MAX_LARGO_CLAVE = 200
 
 def make_cache_key(func_name: str, *args, **kwargs) -> str:
-    """Generar una clave de caché basada en nombre de función, argumentos y parámetros de búsqueda de Flask"""
+    """
+    Generar una clave de caché basada en nombre de función, argumentos y parámetros de búsqueda de Flask.
+    La clave pertenece al namespace func_name (lleva su generación), así que
+    invalidate_cache(namespace=func_name) la descarta.
+    """
     from flask import request, has_request_context
-    
-    # Capturar argumentos de la función
-    data = {
-        'args': args,
-        'kwargs': {k: v for k, v in kwargs.items() if k != 'self'}
-    }
-    
+
+    kwargs = {k: v for k, v in kwargs.items() if k != 'self'}
+    if all(isinstance(a, _TIPOS_SIMPLES) for a in args) and all(isinstance(v, _TIPOS_SIMPLES) for v in kwargs.values()):
+        # Caso habitual (ids, strings): armar la clave directamente
+        firma = ','.join([repr(a) for a in args] + [f'{k}={v!r}' for k, v in sorted(kwargs.items())])
+    else:
+        firma = json.dumps({'args': args, 'kwargs': kwargs}, sort_keys=True, default=str)
+
     # Si hay un contexto de petición de Flask, incluir los parámetros de búsqueda (query params)
+    if has_request_context() and request.args:
+        firma += '?' + urlencode(sorted(request.args.items(multi=True)))
+
+    if len(firma) > _MAX_LARGO_CLAVE:
+        # Generar hash para acortar la clave
+        firma = hashlib.md5(firma.encode()).hexdigest()
+    return f"{func_name}@{cache.generation(func_name)}:{firma}"
+
+# Funciones a llamar después de cada invalidación (p. ej. el calentador del caché)
+_al_invalidar = []
+
+def on_invalidate(callback: Callable):
+    """Registra callback() para después de cada invalidate_cache (o una recibida por el bus)"""
+    _al_invalidar.append(callback)
+
+def _notificar_invalidacion():
+    for callback in list(_al_invalidar):
+        try:
+            callback()
+        except Exception as e:
+            logger.warning(f"Error en callback de invalidación: {e}")
+
+def is_refresh_request() -> bool:
+    """True si el request actual pide recalcular aunque haya caché (g.cache_refresh, ver CacheWarmerService)"""
+    from flask import g, has_request_context
+    return has_request_context() and g.get('cache_refresh', False)
+
+# Cálculos en curso por clave (single-flight dentro del proceso)
+_vuelos = {}
+_vuelos_lock = Lock()
+
+def _lock_de(key: str) -> Lock:
+    with _vuelos_lock:
+        lock = _vuelos.get(key)
+        if lock is None:
+            lock = _vuelos[key] = Lock()
+        return lock
+
+def _soltar(key: str, lock: Lock):
+    lock.release()
+    with _vuelos_lock:
+        if _vuelos.get(key) is lock and not lock.locked():
+            del _vuelos[key]
+
+def _calcular_y_guardar(key: str, compute: Callable, ttl_seconds: int, stale_seconds: int, jitter: float):
+    inicio = time.perf_counter()
+    value = compute()
+    cache.registrar_calculo(key, time.perf_counter() - inicio)
+    if value is not None:
+        ttl = ttl_seconds * (1 - jitter * random.random())
+        # Se guarda con la fecha hasta la que es fresco; con stale_seconds se sirve ese tiempo
+        # más (el redondeo hacia arriba del TTL lo cubre get_or_compute con fresco_hasta)
+        cache.set(key, (value, time.time() + ttl), ttl_seconds=math.ceil(ttl + max(0, stale_seconds)))
+    return value
+
+def _con_contexto(func: Callable) -> Callable:
+    """Envuelve func para ejecutarla en otro thread con el contexto de Flask actual"""
+    from flask import has_request_context, has_app_context, copy_current_request_context, current_app
+    if has_request_context():
+        return copy_current_request_context(func)
+    if has_app_context():
+        app = current_app._get_current_object()
+        def en_app(*args, **kwargs):
+            with app.app_context():
+                return func(*args, **kwargs)
+        return en_app
+    return func
+
+def _refrescar_en_segundo_plano(key: str, compute: Callable, ttl_seconds: int, stale_seconds: int, jitter: float):
+    lock = _lock_de(key)
+    if not lock.acquire(blocking=False):
+        # Ya hay un refresco (o un cálculo) en curso
+        return
+
+    def refrescar():
+        try:
+            _calcular_y_guardar(key, compute, ttl_seconds, stale_seconds, jitter)
+        except Exception as e:
+            logger.warning(f"Error refrescando la clave de caché {key}: {e}")
+        finally:
+            _soltar(key, lock)
+
     try:
-        if has_request_context():
-            data['query_params'] = dict(request.args)
+        Thread(target=_con_contexto(refrescar), daemon=True, name='cache-refresh').start()
     except Exception:
-        # En caso de cualquier error accediendo al request
-        pass
-        
-    args_str = json.dumps(data, sort_keys=True, default=str)
-    
-    # Generar hash para acortar la clave
-    args_hash = hashlib.md5(args_str.encode()).hexdigest()[:12]
-    return f"{func_name}:{args_hash}"
+        _soltar(key, lock)
+        raise
+
+def get_or_compute(key: str, compute: Callable, ttl_seconds: int = 300, stale_seconds: int = 0,
+                   jitter: float = CACHE_TTL_JITTER):
+    """
+    Valor cacheado de key, o compute() si no está.
+    - Single-flight: si varios requests no lo encuentran a la vez, uno solo lo calcula y
+      los demás esperan su resultado (hasta SINGLE_FLIGHT_TIMEOUT).
+    - stale_seconds: vencido el TTL, el valor anterior se sirve esa cantidad de segundos más
+      mientras un thread lo recalcula. Con 0 (default) un valor vencido nunca se sirve.
+    - jitter: el TTL se acorta al azar hasta esa fracción, para no vencer todo junto.
+    Las invalidaciones (delete, tags, namespaces) descartan también el valor stale.
+    """
+    if is_refresh_request():
+        return _calcular_y_guardar(key, compute, ttl_seconds, stale_seconds, jitter)
 
-def cached(ttl_seconds: int = 300):
+    guardado = cache.get(key)
+    if guardado is not None:
+        value, fresco_hasta = guardado
+        if time.time() < fresco_hasta:
+            return value
+        if stale_seconds > 0:
+            _refrescar_en_segundo_plano(key, compute, ttl_seconds, stale_seconds, jitter)
+            return value
+        # Sin ventana stale un valor vencido es un miss: se recalcula acá (single-flight)
+
+    lock = _lock_de(key)
+    esperado = False
+    if not lock.acquire(blocking=False):
+        esperado = True
+        if not lock.acquire(timeout=SINGLE_FLIGHT_TIMEOUT):
+            logger.warning(f"Timeout esperando el cálculo de {key}; se calcula de nuevo")
+            return compute()
+    try:
+        if esperado:
+            # Otro request lo calculó mientras esperábamos
+            guardado = cache.get(key)
+            if guardado is not None and (stale_seconds > 0 or time.time() < guardado[1]):
+                return guardado[0]
+        return _calcular_y_guardar(key, compute, ttl_seconds, stale_seconds, jitter)
+    finally:
+        _soltar(key, lock)
+
+def cached(ttl_seconds: int = 300, stale_seconds: int = 0, jitter: float = CACHE_TTL_JITTER):
     """
-    Decorador para cachear el resultado de una función
+    Decorador para cachear el resultado de una función (ver get_or_compute)
     
     Args:
         ttl_seconds: Tiempo de vida del caché en segundos (default: 300 = 5 minutos)
+        stale_seconds: Ventana en que se sirve el valor vencido mientras se recalcula
+        jitter: Fracción máxima en que se acorta el TTL al azar
     
     Uso:
         @cached(ttl_seconds=600)
@@ -96,40 +477,244 @@ def cached(ttl_seconds: int = 300):
         def wrapper(*args, **kwargs):
             # Generar clave de caché
             cache_key = make_cache_key(func.__name__, *args, **kwargs)
-            
-            # Intentar obtener del caché
-            cached_value = cache.get(cache_key)
-            if cached_value is not None:
-                return cached_value
-            
-            # Si no está en caché, ejecutar función
-            result = func(*args, **kwargs)
-            
-            # Guardar en caché
-            cache.set(cache_key, result, ttl_seconds)
-            
-            return result
+            return get_or_compute(cache_key, lambda: func(*args, **kwargs), ttl_seconds, stale_seconds, jitter)
         return wrapper
     return decorator
 
-def invalidate_cache(pattern: Optional[str] = None, key: Optional[str] = None):
+# Variantes que se precomprimen al guardar (las demás las comprime Flask-Compress en cada respuesta)
+ALGORITMOS_PRECOMPRIMIDOS = ('br', 'gzip')
+
+def _preferencias_encoding(accept_encoding: str) -> dict:
+    """{algoritmo: q} del header Accept-Encoding (q=1 si no se indica)"""
+    preferencias = {}
+    for parte in accept_encoding.split(','):
+        nombre, _, parametros = parte.partition(';')
+        nombre = nombre.strip().lower()
+        if not nombre:
+            continue
+        q = 1.0
+        for parametro in parametros.split(';'):
+            clave, _, valor = parametro.partition('=')
+            if clave.strip().lower() == 'q':
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        preferencias[nombre] = q
+    return preferencias
+
+def elegir_encoding(accept_encoding: str, algoritmos: Iterable[str]) -> Optional[str]:
+    """
+    Algoritmo de `algoritmos` (en orden de preferencia del servidor) que el cliente acepta
+    con mayor q, o None si no acepta ninguno. '*' vale para los no nombrados y q=0 excluye.
+    """
+    preferencias = _preferencias_encoding(accept_encoding or '')
+    comodin = preferencias.get('*', 0.0)
+    mejor, mejor_q = None, 0.0
+    for algoritmo in algoritmos:
+        q = preferencias.get(algoritmo, comodin)
+        if q > mejor_q:
+            mejor, mejor_q = algoritmo, q
+    return mejor
+
+class CachedBody:
+    """
+    Cuerpo final de una respuesta, listo para servir sin serializar ni comprimir:
+    los bytes originales más sus variantes br/gzip (con los niveles de COMPRESS_*).
+    Cada hit arma un Response nuevo con la variante que acepta el cliente.
+    """
+    __slots__ = ('status', 'mimetype', 'etag', 'variantes')
+
+    def __init__(self, body: bytes, status: int = 200, mimetype: str = 'application/json'):
+        from flask import current_app
+        from extensions import compress
+
+        self.status = status
+        self.mimetype = mimetype
+        self.etag = hashlib.md5(body).hexdigest()
+        self.variantes = {None: body}
+
+        app = current_app._get_current_object()
+        if mimetype in app.config['COMPRESS_MIMETYPES'] and len(body) >= app.config['COMPRESS_MIN_SIZE']:
+            original = app.response_class(body, mimetype=mimetype)
+            for algoritmo in ALGORITMOS_PRECOMPRIMIDOS:
+                if algoritmo in compress.enabled_algorithms:
+                    self.variantes[algoritmo] = compress.compress(app, original, algoritmo)
+
+    @classmethod
+    def from_response(cls, response) -> 'CachedBody':
+        return cls(response.get_data(), response.status_code, response.mimetype)
+
+    @classmethod
+    def from_json(cls, data: Any, status: int = 200) -> 'CachedBody':
+        from flask import jsonify
+        response = jsonify(data)
+        response.status_code = status
+        return cls.from_response(response)
+
+    def response(self):
+        """Response nuevo con la variante que corresponde al Accept-Encoding del request"""
+        from flask import current_app, request
+        from extensions import compress
+
+        algoritmo = elegir_encoding(request.headers.get('Accept-Encoding', ''), compress.enabled_algorithms)
+        if algoritmo not in self.variantes:
+            # Sin compresión, o un algoritmo no precomprimido (lo resuelve Flask-Compress)
+            algoritmo = None
+        response = current_app.response_class(self.variantes[algoritmo], status=self.status, mimetype=self.mimetype)
+        response.vary.add('Accept-Encoding')
+        if algoritmo:
+            # Flask-Compress no toca las respuestas que ya traen Content-Encoding
+            response.headers['Content-Encoding'] = algoritmo
+            response.set_etag(f'{self.etag}:{algoritmo}')
+        else:
+            response.set_etag(self.etag)
+        return response
+
+def cached_response(ttl_seconds: int = 300, stale_seconds: int = 0, jitter: float = CACHE_TTL_JITTER):
+    """
+    Como @cached, para vistas: guarda el cuerpo final (CachedBody) en lugar del Response.
+    Solo se cachean las respuestas 200; un hit no pasa por jsonify ni por la compresión.
+
+    Uso:
+        @cached_response(ttl_seconds=3600)
+        def get_talles():
+            return jsonify([...]), 200
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            from flask import make_response
+
+            cache_key = make_cache_key(func.__name__, *args, **kwargs)
+            no_cacheable = []
+
+            def calcular():
+                response = make_response(func(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    no_cacheable.append(response)
+                    return None
+                return CachedBody.from_response(response)
+
+            body = get_or_compute(cache_key, calcular, ttl_seconds, stale_seconds, jitter)
+            if body is None:
+                return no_cacheable[0]
+            return body.response()
+        return wrapper
+    return decorator
+
+def _etag_coincide(etag: str):
+    """
+    Retorna el ETag enviado por el cliente si corresponde a `etag`, o None.
+    Flask-Compress agrega el algoritmo al ETag de las respuestas comprimidas ("v:gzip"),
+    así que se compara sin ese sufijo.
+    """
+    from flask import request
+    if not request.if_none_match:
+        return None
+    if request.if_none_match.star_tag:
+        return etag
+    for candidato in request.if_none_match.as_set(include_weak=True):
+        if candidato == etag or candidato.split(':', 1)[0] == etag:
+            return candidato
+    return None
+
+def _not_modified(etag: str, last_modified=None):
+    from flask import make_response
+    response = make_response('', 304)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+def conditional(version_fn: Optional[Callable] = None, ttl_seconds: int = 300):
+    """
+    Decorador de GET condicional (ETag / Last-Modified -> 304 Not Modified).
+
+    Args:
+        version_fn: función (mismos argumentos que la vista) que retorna un sello barato
+            del recurso: (version, last_modified | None), o None si no aplica. Se evalúa
+            antes de la vista, así un 304 no toca el ORM ni el serializador.
+            Sin version_fn, el ETag es el hash del cuerpo y se recuerda ttl_seconds
+            (pensado para combinar con @cached_response con el mismo TTL).
+
+    Uso:
+        @conditional(lambda: (CategoryService.get_graph().version, None))
+        def get_categorias_tree(): ...
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            from flask import request, make_response
+
+            etag_key = None
+            last_modified = None
+            if version_fn is not None:
+                sello = version_fn(*args, **kwargs)
+                if sello is None:
+                    return func(*args, **kwargs)
+                version, last_modified = sello
+                etag = hashlib.md5(str(version).encode()).hexdigest()
+            else:
+                etag_key = 'etag:' + make_cache_key(func.__name__, *args, **kwargs)
+                etag = cache.get(etag_key)
+
+            if etag:
+                enviado = _etag_coincide(etag)
+                if enviado:
+                    return _not_modified(enviado, last_modified)
+                if (last_modified and not request.if_none_match and request.if_modified_since
+                        and last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)):
+                    return _not_modified(etag, last_modified)
+
+            response = make_response(func(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+            if etag_key is not None:
+                # Si la respuesta ya trae ETag (CachedBody), usarlo sin el sufijo de compresión
+                propio = response.get_etag()[0]
+                etag = propio.split(':', 1)[0] if propio else hashlib.md5(response.get_data()).hexdigest()
+                cache.set(etag_key, etag, ttl_seconds)
+            if not response.headers.get('ETag'):
+                response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            # El navegador puede guardar la respuesta pero debe revalidarla siempre
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+def invalidate_cache(pattern: Optional[str] = None, key: Optional[str] = None, tags: Optional[Iterable[str]] = None,
+                     namespace: Optional[str] = None):
     """
     Invalida el caché
     
     Args:
-        pattern: Patrón para eliminar entradas que lo contengan
+        pattern: Patrón para eliminar entradas que lo contengan (recorre todas las claves)
         key: Clave específica para eliminar
+        tags: Tags cuyas entradas se eliminan (solo las que los llevan)
+        namespace: Namespace a invalidar en O(1) (nombre de la función para @cached)
     
     Uso:
-        # Eliminar todo el caché de productos
-        invalidate_cache(pattern='get_productos')
+        # Eliminar todo el caché de una función decorada con @cached
+        invalidate_cache(namespace='get_talles')
         
         # Eliminar una clave específica
         invalidate_cache(key='get_producto:abc123')
+
+        # Eliminar las entradas que contienen al producto 42
+        invalidate_cache(tags=['producto:42'])
     """
-    if pattern:
+    if namespace:
+        cache.bump(namespace)
+    elif pattern:
         cache.clear_pattern(pattern)
     elif key:
         cache.delete(key)
+    elif tags is not None:
+        cache.invalidate_tags(tags)
     else:
         cache.clear()
+    _notificar_invalidacion()
@@ -2,6 +2,7 @@
 # Uso: gunicorn -c gunicorn_config.py "app:app"
 
 import multiprocessing
+import os
 
 # Server socket
 bind = "0.0.0.0:5000"
@@ -11,6 +12,10 @@ backlog = 2048
 workers = 2  # Fixed to 2 for Render Free Tier to avoid resource exhaustion
 worker_class = 'sync'
 worker_connections = 1000
+
+# Cada worker tiene su caché en memoria: propagar las invalidaciones entre ellos
+# (ver crear_cache en cache_utils; CACHE_BACKEND=sqlite|redis comparte el caché completo)
+os.environ.setdefault('CACHE_BUS', 'sqlite')
 timeout = 30
 keepalive = 2
 
@@ -31,6 +36,13 @@ user = None
 group = None
 tmp_upload_dir = None
 
+# Server hooks
+def post_fork(server, worker):
+    """Cada worker calienta en segundo plano las páginas de entrada (y tras cada invalidación)"""
+    from app import app
+    from services.cache_warmer_service import CacheWarmerService
+    CacheWarmerService.iniciar(app)
+
 # SSL (descomentar si usas HTTPS)
 # keyfile = '/path/to/keyfile.pem'
 # certfile = '/path/to/certfile.pem'
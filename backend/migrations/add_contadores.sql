@@ -0,0 +1,11 @@
+-- Migración: Contadores para numeración de pedidos
+-- Fecha: 2026-10-18
+-- Descripción: Reemplaza el sondeo de numero_pedido libres por un contador que cada worker
+-- reserva en bloques (ver OrderNumberService). La fila 'numero_pedido' se crea sola al
+-- primer pedido, continuando desde el mayor número existente.
+
+CREATE TABLE IF NOT EXISTS contadores (
+    nombre VARCHAR(50) PRIMARY KEY,
+    valor BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
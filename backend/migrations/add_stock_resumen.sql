@@ -0,0 +1,22 @@
+-- Migración: Resumen de stock desnormalizado por producto
+-- Fecha: 2026-10-18
+-- Descripción: Reemplaza las subconsultas sobre stock_talles del catálogo por columnas
+-- mantenidas en productos (ver actualizar_resumen_stock en models.py)
+
+ALTER TABLE productos ADD COLUMN IF NOT EXISTS stock_total INTEGER DEFAULT 0;
+ALTER TABLE productos ADD COLUMN IF NOT EXISTS stock_max_talle INTEGER DEFAULT 0;
+ALTER TABLE productos ADD COLUMN IF NOT EXISTS estado_stock VARCHAR(20);
+
+-- Completar el resumen para los productos existentes
+UPDATE productos p SET
+    stock_total = COALESCE((SELECT SUM(st.cantidad) FROM stock_talles st WHERE st.producto_id = p.id), 0),
+    stock_max_talle = COALESCE((SELECT MAX(st.cantidad) FROM stock_talles st WHERE st.producto_id = p.id), 0);
+
+UPDATE productos SET estado_stock = CASE
+    WHEN stock_max_talle >= 4 THEN 'disponible'
+    WHEN stock_max_talle >= 1 THEN 'bajo'
+    ELSE 'agotado'
+END;
+
+-- Índice para filtrar y ordenar el catálogo por estado de stock
+CREATE INDEX IF NOT EXISTS idx_producto_activo_estado_stock ON productos(activo, estado_stock);
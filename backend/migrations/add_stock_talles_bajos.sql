@@ -0,0 +1,11 @@
+-- Migración: Cantidad de talles con stock bajo por producto
+-- Fecha: 2026-10-18
+-- Descripción: Parte del resumen mantenido por actualizar_resumen_stock (models.py); permite
+-- resolver Producto.tiene_stock_bajo sin recorrer stock_talles
+
+ALTER TABLE productos ADD COLUMN IF NOT EXISTS stock_talles_bajos INTEGER DEFAULT 0;
+
+-- Completar el resumen para los productos existentes
+UPDATE productos p SET
+    stock_talles_bajos = (SELECT COUNT(*) FROM stock_talles st
+                          WHERE st.producto_id = p.id AND st.cantidad >= 1 AND st.cantidad < 4);
@@ -0,0 +1,6 @@
+-- Migración: Versión de stock por producto
+-- Fecha: 2026-10-18
+-- Descripción: Contador que actualizar_resumen_stock incrementa en cada recálculo; forma parte
+-- del sello de versión de la caché de fragmentos de productos (ver FragmentCacheService)
+
+ALTER TABLE productos ADD COLUMN IF NOT EXISTS stock_version INTEGER DEFAULT 0;
@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
 
 # db se inicializarÃ¡ en app.py
 db = SQLAlchemy()
@@ -58,8 +60,17 @@ class Categoria(db.Model):
         db.Index('idx_categoria_orden', 'orden'),
     )
     
+    def _grafo(self):
+        """Grafo de categorías en memoria, o None si esta categoría aún no figura en él"""
+        from services.category_service import CategoryService
+        grafo = CategoryService.get_graph()
+        return grafo if self.id is not None and grafo.contiene(self.id) else None
+
     def get_nivel(self):
         """Retorna el nivel jerárquico de la categoría (1, 2, o 3)"""
+        grafo = self._grafo()
+        if grafo and grafo.padre(self.id) == self.categoria_padre_id:
+            return grafo.nivel(self.id)
         if self.categoria_padre_id is None:
             return 1  # Categoría padre
         elif self.categoria_padre and self.categoria_padre.categoria_padre_id is None:
@@ -69,10 +80,7 @@ class Categoria(db.Model):
     
     def get_arbol_completo(self):
         """Retorna la estructura jerárquica completa de esta categoría"""
-        result = self.to_dict()
-        if self.subcategorias:
-            result['subcategorias'] = [sub.get_arbol_completo() for sub in sorted(self.subcategorias, key=lambda x: x.nombre)]
-        return result
+        return self.to_dict(include_subcategorias=True)
     
     def to_dict(self, include_subcategorias=False):
         data = {
@@ -87,8 +95,15 @@ class Categoria(db.Model):
             'nivel': self.get_nivel(),
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
-        if include_subcategorias and self.subcategorias:
-            data['subcategorias'] = [sub.to_dict(include_subcategorias=True) for sub in sorted(self.subcategorias, key=lambda x: x.nombre)]
+        if include_subcategorias:
+            grafo = self._grafo()
+            if grafo:
+                # Subárbol desde el grafo en memoria (sin lazy-loads recursivos)
+                hijos = grafo.hijos(self.id)
+                if hijos:
+                    data['subcategorias'] = [grafo.to_dict(h, include_subcategorias=True) for h in hijos]
+            elif self.subcategorias:
+                data['subcategorias'] = [sub.to_dict(include_subcategorias=True) for sub in sorted(self.subcategorias, key=lambda x: x.nombre)]
         return data
 
 
@@ -118,6 +133,12 @@ class Producto(db.Model):
     version = db.Column(db.String(50), nullable=True)  # Ej: "Hincha", "Jugador"
     producto_relacionado_id = db.Column(db.Integer, db.ForeignKey('productos.id'), nullable=True)  # Producto relacionado (mismo diseÃ±o, diferente color)
     ventas_count = db.Column(db.Integer, default=0)  # Contador de ventas para ordenamiento
+    # Resumen de stock desnormalizado (mantenido por actualizar_resumen_stock)
+    stock_total = db.Column(db.Integer, default=0)  # Suma de unidades de todos los talles
+    stock_max_talle = db.Column(db.Integer, default=0)  # Mayor cantidad en un mismo talle
+    stock_talles_bajos = db.Column(db.Integer, default=0)  # Talles con stock bajo (1 a 3 unidades)
+    estado_stock = db.Column(db.String(20), default='agotado')  # 'disponible', 'bajo', 'agotado'
+    stock_version = db.Column(db.Integer, default=0)  # Se incrementa con cada recálculo del resumen (caché de fragmentos)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -142,6 +163,7 @@ class Producto(db.Model):
         db.Index('idx_producto_categoria', 'categoria_id'),
         db.Index('idx_producto_activo', 'activo'),
         db.Index('idx_producto_destacado_activo', 'destacado', 'activo'),
+        db.Index('idx_producto_activo_estado_stock', 'activo', 'estado_stock'),
     )
     
     def get_precio_actual(self):
@@ -149,48 +171,78 @@ class Producto(db.Model):
         return self.precio_descuento if self.precio_descuento else self.precio_base
     
     def tiene_stock(self):
-        """Verifica si el producto tiene stock disponible (>= 4)"""
-        return any(st.cantidad >= 4 for st in self.stock_talles)
+        """Verifica si el producto tiene stock disponible (algún talle >= 4), desde el resumen"""
+        return (self.stock_max_talle or 0) >= UMBRAL_STOCK_DISPONIBLE
 
     def tiene_stock_bajo(self):
-        """Verifica si el producto tiene stock bajo (entre 1 y 3)"""
-        return any(0 < st.cantidad <= 3 for st in self.stock_talles)
+        """Verifica si el producto tiene stock bajo (algún talle entre 1 y 3), desde el resumen"""
+        return (self.stock_talles_bajos or 0) > 0
 
     def esta_agotado(self):
-        """Verifica si el producto está agotado (stock <= 0 en todos los talles)"""
-        if not self.stock_talles:
-            return True
-        return all(st.cantidad <= 0 for st in self.stock_talles)
-    
-    def get_promociones_activas(self):
-        """Retorna las promociones activas para este producto"""
-        from datetime import datetime
-        ahora = datetime.utcnow()
-        
-        # Promociones directas, por categoría o globales
-        promociones = [p for p in self.promociones if p.esta_activa()]
-        
-        # También buscar promociones por categoría
-        promociones_cat = PromocionProducto.query.filter(
-            PromocionProducto.activa == True,
-            PromocionProducto.fecha_inicio <= ahora,
-            PromocionProducto.fecha_fin >= ahora,
-            PromocionProducto.categorias.any(id=self.categoria_id)
-        ).all()
-        
-        # También buscar promociones globales
-        promociones_global = PromocionProducto.query.filter(
-            PromocionProducto.alcance == 'tienda',
-            PromocionProducto.activa == True,
-            PromocionProducto.fecha_inicio <= ahora,
-            PromocionProducto.fecha_fin >= ahora
-        ).all()
-        
-        # Combinar y evitar duplicados
-        todas = {p.id: p for p in (promociones + promociones_cat + promociones_global)}
-        return list(todas.values())
+        """Verifica si el producto está agotado (stock <= 0 en todos los talles), desde el resumen"""
+        return (self.stock_max_talle or 0) <= 0
+    
+    def get_promociones_activas_dict(self):
+        """Promociones activas ya serializadas, resueltas desde el índice en memoria (sin queries)"""
+        from services.promotion_service import PromotionService
+        return PromotionService.get_index().para_producto(self.id, self.categoria_id)
+    
+    def _nombres_categoria(self):
+        """(categoria_nombre, categoria_principal, subcategoria) usando el grafo de categorías en memoria"""
+        from services.category_service import CategoryService
+        grafo = CategoryService.get_graph()
+        if self.categoria_id is not None and grafo.contiene(self.categoria_id):
+            nombre = grafo.nombre(self.categoria_id)
+            padre_id = grafo.padre(self.categoria_id)
+            if padre_id is not None and grafo.contiene(padre_id):
+                return nombre, grafo.nombre(padre_id), nombre
+            return nombre, nombre, "-"
+
+        # Categoría que todavía no está en el grafo: resolver por ORM
+        if not self.categoria:
+            return None, None, "-"
+        if self.categoria.categoria_padre:
+            return self.categoria.nombre, self.categoria.categoria_padre.nombre, self.categoria.nombre
+        return self.categoria.nombre, self.categoria.nombre, "-"
+    
+    def to_card_dict(self):
+        """
+        Versión compacta para tarjetas de listado: sin descripción, stock por talle ni
+        relacionados; el stock sale del resumen desnormalizado y las promociones van sin
+        listas de productos/categorías. No dispara lazy loads fuera de imagenes.
+        """
+        from services.promotion_service import PromotionService
+        categoria_nombre, categoria_principal, subcategoria = self._nombres_categoria()
+        return {
+            'id': self.id,
+            'nombre': self.nombre,
+            'precio_base': self.precio_base,
+            'precio_descuento': self.precio_descuento,
+            'precio_actual': self.get_precio_actual(),
+            'categoria_id': self.categoria_id,
+            'categoria_nombre': categoria_nombre,
+            'categoria_principal': categoria_principal,
+            'subcategoria': subcategoria,
+            'activo': self.activo,
+            'destacado': self.destacado,
+            'color': self.color,
+            'color_hex': self.color_hex,
+            'dorsal': self.dorsal,
+            'numero': self.numero,
+            'version': self.version,
+            'producto_relacionado_id': self.producto_relacionado_id,
+            'ventas_count': self.ventas_count,
+            'estado_stock': self.estado_stock,
+            'tiene_stock': self.tiene_stock(),
+            'esta_agotado': self.esta_agotado(),
+            'imagenes': [img.to_dict() for img in self.imagenes],
+            'promociones': PromotionService.get_index().para_producto_card(self.id, self.categoria_id),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
     
     def to_dict(self, include_stock=True):
+        categoria_nombre, categoria_principal, subcategoria = self._nombres_categoria()
         data = {
             'id': self.id,
             'nombre': self.nombre,
@@ -199,10 +251,10 @@ class Producto(db.Model):
             'precio_descuento': self.precio_descuento,
             'precio_actual': self.get_precio_actual(),
             'categoria_id': self.categoria_id,
-            'categoria_nombre': self.categoria.nombre if self.categoria else None,
+            'categoria_nombre': categoria_nombre,
             # Lógica para columnas de tabla
-            'categoria_principal': self.categoria.categoria_padre.nombre if (self.categoria and self.categoria.categoria_padre) else (self.categoria.nombre if self.categoria else None),
-            'subcategoria': self.categoria.nombre if (self.categoria and self.categoria.categoria_padre) else "-",
+            'categoria_principal': categoria_principal,
+            'subcategoria': subcategoria,
             'activo': self.activo,
             'destacado': self.destacado,
             'color': self.color,
@@ -212,11 +264,12 @@ class Producto(db.Model):
             'version': self.version,
             'producto_relacionado_id': self.producto_relacionado_id,
             'ventas_count': self.ventas_count,
+            'estado_stock': self.estado_stock,
             'tiene_stock': self.tiene_stock(),
             'tiene_stock_bajo': self.tiene_stock_bajo(),
             'esta_agotado': self.esta_agotado(),
             'imagenes': [img.to_dict() for img in self.imagenes],
-            'promociones': [p.to_dict() for p in self.get_promociones_activas()],
+            'promociones': self.get_promociones_activas_dict(),
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -322,6 +375,111 @@ class StockTalle(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+# ==================== RESUMEN DE STOCK POR PRODUCTO ====================
+# Umbral a partir del cual un talle se considera "disponible" (misma regla que Producto.tiene_stock)
+UMBRAL_STOCK_DISPONIBLE = 4
+
+def _expresiones_resumen_stock():
+    """(suma, máximo, estado, talles bajos) calculados desde stock_talles, correlacionados con productos.id"""
+    productos_t = Producto.__table__
+    stock_t = StockTalle.__table__
+
+    suma = db.select(db.func.coalesce(db.func.sum(stock_t.c.cantidad), 0)).where(
+        stock_t.c.producto_id == productos_t.c.id
+    ).scalar_subquery()
+    maximo = db.select(db.func.coalesce(db.func.max(stock_t.c.cantidad), 0)).where(
+        stock_t.c.producto_id == productos_t.c.id
+    ).scalar_subquery()
+    estado = db.case(
+        (maximo >= UMBRAL_STOCK_DISPONIBLE, 'disponible'),
+        (maximo >= 1, 'bajo'),
+        else_='agotado'
+    )
+    bajos = db.select(db.func.count()).where(
+        stock_t.c.producto_id == productos_t.c.id,
+        stock_t.c.cantidad >= 1,
+        stock_t.c.cantidad < UMBRAL_STOCK_DISPONIBLE
+    ).scalar_subquery()
+    return suma, maximo, estado, bajos
+
+def cambios_estado_stock(producto_ids, connection=None):
+    """
+    {producto_id: categoria_id} de los productos cuyo estado_stock va a cambiar al
+    recalcular el resumen (comparar antes de llamar a actualizar_resumen_stock).
+    """
+    producto_ids = [int(pid) for pid in set(producto_ids) if pid is not None]
+    if not producto_ids:
+        return {}
+    productos_t = Producto.__table__
+    _, _, estado, _ = _expresiones_resumen_stock()
+    filas = (connection or db.session).execute(
+        db.select(productos_t.c.id, productos_t.c.categoria_id, productos_t.c.estado_stock, estado)
+        .where(productos_t.c.id.in_(producto_ids))
+    ).all()
+    return {pid: cat_id for pid, cat_id, actual, nuevo in filas if actual != nuevo}
+
+def actualizar_resumen_stock(producto_ids=None, connection=None):
+    """
+    Recalcula stock_total, stock_max_talle, estado_stock y stock_talles_bajos de los productos indicados
+    con un único UPDATE set-based e incrementa su stock_version. Si producto_ids es None
+    recalcula todo el catálogo.
+    """
+    if producto_ids is not None:
+        producto_ids = [int(pid) for pid in set(producto_ids) if pid is not None]
+        if not producto_ids:
+            return
+
+    productos_t = Producto.__table__
+    suma, maximo, estado, bajos = _expresiones_resumen_stock()
+
+    stmt = db.update(productos_t).values(
+        stock_total=suma,
+        stock_max_talle=maximo,
+        estado_stock=estado,
+        stock_talles_bajos=bajos,
+        stock_version=db.func.coalesce(productos_t.c.stock_version, 0) + 1,
+        # No tocar updated_at: el resumen no es una edición del producto
+        updated_at=productos_t.c.updated_at
+    )
+    if producto_ids is not None:
+        stmt = stmt.where(productos_t.c.id.in_(producto_ids))
+
+    (connection or db.session).execute(stmt)
+
+_RESUMEN_STOCK_ATTRS = ['stock_total', 'stock_max_talle', 'estado_stock', 'stock_talles_bajos', 'stock_version']
+
+@event.listens_for(Session, 'after_flush')
+def _resumen_stock_after_flush(session, flush_context):
+    """Detecta cambios en StockTalle durante el flush y actualiza el resumen de sus productos"""
+    producto_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, StockTalle):
+            continue
+        producto_ids.add(obj.producto_id)
+        # Si el registro cambió de producto, recalcular también el anterior
+        hist = inspect(obj).attrs.producto_id.history
+        producto_ids.update(hist.deleted or [])
+
+    producto_ids.discard(None)
+    if producto_ids:
+        connection = session.connection()
+        # Productos que cambian de estado (afecta filtros y orden del catálogo cacheado)
+        cambios = cambios_estado_stock(producto_ids, connection=connection)
+        if cambios:
+            session.info.setdefault('estado_stock_cambios', {}).update(cambios)
+        actualizar_resumen_stock(producto_ids, connection=connection)
+        session.info.setdefault('_resumen_stock_ids', set()).update(producto_ids)
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _resumen_stock_expirar(session, flush_context):
+    """Expira los atributos de resumen en memoria para que se relean del UPDATE"""
+    producto_ids = session.info.pop('_resumen_stock_ids', None)
+    if not producto_ids:
+        return
+    for obj in session.identity_map.values():
+        if isinstance(obj, Producto) and obj.id in producto_ids:
+            session.expire(obj, _RESUMEN_STOCK_ATTRS)
+
 class ImagenProducto(db.Model):
     """Modelo para imÃ¡genes de productos"""
     __tablename__ = 'imagenes_productos'
@@ -399,36 +557,20 @@ class PromocionProducto(db.Model):
         return self.activa and self.fecha_inicio <= ahora <= self.fecha_fin
     
     def calcular_descuento(self, cantidad, precio_unitario):
-        """Calcula el descuento segÃºn el tipo de promociÃ³n"""
+        """Calcula el descuento segÃºn el tipo de promociÃ³n (mismas reglas que el checkout, para una sola línea)"""
+        from services.pricing_service import PricingService, tipo_regla
         if not self.esta_activa():
             return 0
-        
-        tipo = self.tipo_promocion.nombre
-        
-        if tipo == 'descuento_porcentaje':
-            return (precio_unitario * cantidad * self.valor) / 100
-        elif tipo == 'descuento_fijo':
-            return self.valor * cantidad
-        elif tipo == '2x1':
-            # Llevas 2, pagas 1
-            unidades_gratis = cantidad // 2
-            return precio_unitario * unidades_gratis
-        elif tipo == '3x2':
-            # Llevas 3, pagas 2
-            unidades_gratis = cantidad // 3
-            return precio_unitario * unidades_gratis
-        elif tipo.startswith('llevas_'):
-            # Formato: "llevas_X_paga_Y"
-            partes = tipo.split('_')
-            if len(partes) >= 4:
-                lleva = int(partes[1])
-                paga = int(partes[3])
-                unidades_gratis = (cantidad // lleva) * (lleva - paga)
-                return precio_unitario * unidades_gratis
-        
-        return 0
-    
-    def to_dict(self):
+        return PricingService.descuento_linea(
+            tipo_regla(self.tipo_promocion.nombre), self.valor or 0, cantidad, precio_unitario
+        )
+    
+    def to_dict(self, productos=None, categorias=None):
+        """productos / categorias: listas opcionales de (id, nombre) ya cargadas (evita lazy loads)"""
+        if productos is None:
+            productos = [(p.id, p.nombre) for p in self.productos]
+        if categorias is None:
+            categorias = [(c.id, c.nombre) for c in self.categorias]
         return {
             'id': self.id,
             'alcance': self.alcance,
@@ -439,10 +581,10 @@ class PromocionProducto(db.Model):
             'esta_activa': self.esta_activa(),
             'fecha_inicio': self.fecha_inicio.isoformat() if self.fecha_inicio else None,
             'fecha_fin': self.fecha_fin.isoformat() if self.fecha_fin else None,
-            'productos_ids': [p.id for p in self.productos],
-            'productos_nombres': [p.nombre for p in self.productos],
-            'categorias_ids': [c.id for c in self.categorias],
-            'categorias_nombres': [c.nombre for c in self.categorias],
+            'productos_ids': [p_id for p_id, _ in productos],
+            'productos_nombres': [nombre for _, nombre in productos],
+            'categorias_ids': [c_id for c_id, _ in categorias],
+            'categorias_nombres': [nombre for _, nombre in categorias],
             'es_cupon': self.es_cupon,
             'codigo': self.codigo,
             'envio_gratis': self.envio_gratis,
@@ -812,3 +954,11 @@ class ItemCarrito(db.Model):
             'talle': self.talle.to_dict() if self.talle else None,
             'cantidad': self.cantidad
         }
+
+class Contador(db.Model):
+    """Contadores con nombre (numeración de pedidos); se reservan en bloques con un UPDATE atómico"""
+    __tablename__ = 'contadores'
+    
+    nombre = db.Column(db.String(50), primary_key=True)
+    valor = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,65 @@
+from cache_utils import cache, invalidate_cache
+from services.cache_warmer_service import CacheWarmerService
+import os
+import re
+
+_NAMESPACE_VALIDO = re.compile(r'^[\w.-]{1,100}$')
+
+# Métricas exportadas en formato Prometheus: (nombre, campo de stats_by_namespace, tipo, ayuda)
+_METRICAS = (
+    ('elvestuario_cache_hits_total', 'hits', 'counter', 'Lecturas encontradas en caché'),
+    ('elvestuario_cache_misses_total', 'misses', 'counter', 'Lecturas no encontradas en caché'),
+    ('elvestuario_cache_evictions_total', 'evictions', 'counter', 'Entradas descartadas por el límite de tamaño'),
+    ('elvestuario_cache_expirations_total', 'expirations', 'counter', 'Entradas descartadas por TTL'),
+    ('elvestuario_cache_recomputes_total', 'recomputes', 'counter', 'Valores calculados por @cached / get_or_compute'),
+    ('elvestuario_cache_recompute_seconds_total', 'recompute_seconds_total', 'counter', 'Tiempo total de cálculo'),
+    ('elvestuario_cache_entries', 'entries', 'gauge', 'Entradas actuales'),
+    ('elvestuario_cache_bytes', 'bytes', 'gauge', 'Tamaño aproximado de las entradas actuales'),
+)
+
+class CacheStatsService:
+    """
+    Observabilidad del caché. Los contadores son del worker que atiende el request
+    (cada proceso de gunicorn tiene los suyos); con un backend compartido la ocupación
+    (entries / bytes) es la del almacén completo.
+    """
+
+    @staticmethod
+    def resumen() -> dict:
+        return {
+            'pid': os.getpid(),
+            'global': cache.stats(),
+            'namespaces': cache.stats_by_namespace(),
+            'warmer': CacheWarmerService.ultimo_resultado
+        }
+
+    @staticmethod
+    def prometheus() -> str:
+        """Exposición en formato de texto de Prometheus, con labels namespace y pid"""
+        namespaces = cache.stats_by_namespace()
+        pid = os.getpid()
+        lineas = []
+        for nombre, campo, tipo, ayuda in _METRICAS:
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} {tipo}')
+            for ns in namespaces:
+                if ns[campo] is None:
+                    continue
+                etiqueta = ns['namespace'].replace('\\', '\\\\').replace('"', '\\"')
+                lineas.append(f'{nombre}{{namespace="{etiqueta}",pid="{pid}"}} {ns[campo]}')
+        return '\n'.join(lineas) + '\n'
+
+    @staticmethod
+    def flush(namespace: str):
+        """
+        Invalida un namespace: las claves con generación (@cached, CacheNamespace) con un
+        bump y las de prefijo fijo (catalogo:, facetas:, etag:) por patrón.
+        """
+        if not _NAMESPACE_VALIDO.match(namespace or ''):
+            raise ValueError('Namespace inválido')
+        cache.bump(namespace)
+        invalidate_cache(pattern=f'{namespace}:')
+
+    @staticmethod
+    def flush_todo():
+        invalidate_cache()
@@ -0,0 +1,121 @@
+from flask import g
+from cache_utils import on_invalidate
+from threading import Condition, Thread
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Páginas de entrada que nunca deberían servirse en frío (mismos query params que el frontend)
+CACHE_WARM_URLS_DEFAULT = (
+    '/api/categorias/tree',
+    '/api/productos',
+    '/api/productos?destacados=true&view=card',
+    '/api/productos?ofertas=true&view=card',
+    '/api/productos?ordenar_por=destacado&page=1&page_size=20&view=card',
+    '/api/talles',
+    '/api/metodos-pago',
+    '/api/promociones',
+)
+# Espera tras una invalidación, para agrupar las de una misma escritura del admin
+CACHE_WARM_DEBOUNCE = 2
+# Recalentado periódico en segundos (0 = desactivado: solo al iniciar y tras invalidaciones).
+# Si se activa, usar un valor menor que CATALOGO_CACHE_TTL para reemplazar las páginas antes de que venzan
+CACHE_WARM_INTERVAL = int(os.environ.get('CACHE_WARM_INTERVAL', 0))
+
+def _urls_configuradas():
+    """CACHE_WARM_URLS: URLs separadas por espacios ('' desactiva el warmer)"""
+    valor = os.environ.get('CACHE_WARM_URLS')
+    if valor is None:
+        return list(CACHE_WARM_URLS_DEFAULT)
+    return valor.split()
+
+class CacheWarmerService:
+    """
+    Recalcula en segundo plano las respuestas más pedidas: al iniciar el worker, después de
+    cada invalidación (agrupadas por CACHE_WARM_DEBOUNCE) y, si CACHE_WARM_INTERVAL > 0, cada
+    esa cantidad de segundos. Lo inicia cada worker de gunicorn (post_fork en gunicorn_config.py),
+    no la importación de app: scripts, benchmarks y tests no lo arrancan.
+    Cada URL se resuelve llamando directamente a su vista en un request simulado con
+    g.cache_refresh, que hace que los cachés recalculen aunque tengan la entrada.
+    """
+    _app = None
+    _urls = []
+    _pendiente = Condition()
+    _proximo = None  # momento (monotonic) del próximo calentamiento
+    ultimo_resultado = []
+
+    @staticmethod
+    def iniciar(app, urls=None):
+        if CacheWarmerService._app is not None:
+            return
+        urls = _urls_configuradas() if urls is None else list(urls)
+        if not urls:
+            return
+        CacheWarmerService._app = app
+        CacheWarmerService._urls = urls
+        on_invalidate(CacheWarmerService.programar)
+        CacheWarmerService.programar(0)
+        Thread(target=CacheWarmerService._bucle, daemon=True, name='cache-warmer').start()
+
+    @staticmethod
+    def programar(demora: float = CACHE_WARM_DEBOUNCE):
+        """Agenda un calentamiento dentro de `demora` segundos (no posterga uno más cercano)"""
+        with CacheWarmerService._pendiente:
+            momento = time.monotonic() + demora
+            if CacheWarmerService._proximo is None or momento < CacheWarmerService._proximo:
+                CacheWarmerService._proximo = momento
+            CacheWarmerService._pendiente.notify()
+
+    @staticmethod
+    def _bucle():
+        while True:
+            periodico = False
+            with CacheWarmerService._pendiente:
+                while True:
+                    ahora = time.monotonic()
+                    proximo = CacheWarmerService._proximo
+                    if proximo is not None and proximo <= ahora:
+                        CacheWarmerService._proximo = None
+                        break
+                    espera = None if proximo is None else proximo - ahora
+                    if CACHE_WARM_INTERVAL > 0:
+                        espera = CACHE_WARM_INTERVAL if espera is None else min(espera, CACHE_WARM_INTERVAL)
+                    if not CacheWarmerService._pendiente.wait(espera) and proximo is None:
+                        # Venció el intervalo periódico sin invalidaciones
+                        periodico = True
+                        break
+            try:
+                CacheWarmerService.calentar(periodico=periodico)
+            except Exception as e:
+                logger.error(f"Error calentando el caché: {e}")
+
+    @staticmethod
+    def calentar(urls=None, periodico: bool = False) -> list:
+        """Recalcula cada URL y retorna [{url, status, ms}]"""
+        app = CacheWarmerService._app
+        resultado = []
+        for url in urls or CacheWarmerService._urls:
+            inicio = time.perf_counter()
+            try:
+                with app.test_request_context(url):
+                    g.cache_refresh = True
+                    regla, args = app.url_map.bind('localhost').match(url.split('?', 1)[0], method='GET')
+                    response = app.make_response(app.view_functions[regla](**args))
+                    status = response.status_code
+            except Exception as e:
+                logger.warning(f"No se pudo calentar {url}: {e}")
+                status = None
+            resultado.append({
+                'url': url,
+                'status': status,
+                'ms': round((time.perf_counter() - inicio) * 1000, 2)
+            })
+        total = sum(r['ms'] for r in resultado)
+        detalle = ', '.join(f"{r['url']}={r['ms']}ms" for r in resultado)
+        # El recalentado periódico solo se registra en debug para no llenar el log
+        log = logger.debug if periodico else logger.info
+        log(f"Caché calentado: {len(resultado)} URLs en {total:.0f} ms ({detalle})")
+        CacheWarmerService.ultimo_resultado = resultado
+        return resultado
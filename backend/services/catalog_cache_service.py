@@ -0,0 +1,150 @@
+from cache_utils import cache, invalidate_cache, is_refresh_request, CachedBody
+from models import db
+from services.category_service import CategoryService
+from services.promotion_service import PromotionService
+from datetime import datetime
+from urllib.parse import urlencode
+
+# TTL de las páginas del catálogo. Las escrituras invalidan por tags en el worker que las
+# atiende; este límite acota lo que puede tardar en enterarse otro worker.
+CATALOGO_CACHE_TTL = 60
+
+TAG_CATALOGO = 'catalogo'          # todas las páginas
+TAG_LISTADO_GLOBAL = 'listado:*'   # páginas sin filtro de categoría
+TAG_OFERTAS = 'ofertas'            # páginas cuyo contenido depende de qué productos tienen promoción
+
+class CatalogCacheService:
+    """
+    Caché de respuestas de /api/productos con invalidación por tags. Se guarda el cuerpo
+    final (CachedBody: JSON y sus variantes comprimidas), así un hit no serializa ni comprime.
+    Cada página se guarda con:
+    - producto:<id>   productos mostrados y sus relacionados (contenido de la página)
+    - categoria:<id>  categoría de cada producto y su padre (nombres y promos por categoría)
+    - promocion:<id>  promociones mostradas
+    - listado:<id>    categorías que abarca el filtro (listado:* sin filtro): qué productos
+                      entran en la página y en qué orden
+    - ofertas         si filtra u ordena por ofertas
+    Los cambios de contenido invalidan solo las páginas que muestran al producto; los que
+    pueden mover productos entre páginas (alta/baja, edición, cambio de estado de stock)
+    invalidan además los listados que abarcan su categoría.
+    """
+
+    @staticmethod
+    def make_key(args, prefijo: str = 'catalogo') -> str:
+        """Clave estable para los query params (independiente del orden en la URL)"""
+        return f'{prefijo}:' + urlencode(sorted(args.items(multi=True)))
+
+    @staticmethod
+    def get(key: str):
+        """CachedBody guardado (servir con .response()) o None"""
+        if is_refresh_request():
+            return None
+        return cache.get(key)
+
+    @staticmethod
+    def set(key: str, result: dict, filters: dict, productos) -> CachedBody:
+        """
+        Guarda la página con sus tags y retorna el cuerpo para responder. productos: objetos
+        Producto de la página (en el mismo orden que result['items']); promociones y
+        relacionados se toman de los items serializados, ya que según la vista / fields
+        pueden no estar presentes.
+        """
+        grafo = CategoryService.get_graph()
+        tags = {TAG_CATALOGO}
+
+        categoria_id = filters.get('categoria_id')
+        if categoria_id:
+            tags.update(f'listado:{c}' for c in grafo.descendientes(int(categoria_id)))
+        else:
+            tags.add(TAG_LISTADO_GLOBAL)
+
+        if filters.get('ofertas') == 'true' or filters.get('ordenar_por') == 'destacado':
+            tags.add(TAG_OFERTAS)
+
+        for producto, item in zip(productos, result['items']):
+            tags.add(f'producto:{producto.id}')
+            if producto.categoria_id is not None:
+                tags.add(f'categoria:{producto.categoria_id}')
+                padre_id = grafo.padre(producto.categoria_id)
+                if padre_id is not None:
+                    tags.add(f'categoria:{padre_id}')
+            for rel in item.get('relacionados', ()):
+                tags.add(f"producto:{rel['id']}")
+            for promo in item.get('promociones', ()):
+                tags.add(f"promocion:{promo['id']}")
+
+        return CatalogCacheService._guardar(key, result, tags)
+
+    @staticmethod
+    def set_facetas(key: str, result: dict, filters: dict) -> CachedBody:
+        """
+        Guarda los conteos de /api/productos/facets. Cada faceta se calcula sin su propio
+        filtro (incluido el de categoría), así que dependen de todo el catálogo: cualquier
+        cambio de membresía (listado:*) o de nombre de categoría las invalida.
+        """
+        tags = {TAG_CATALOGO, TAG_LISTADO_GLOBAL}
+        tags.update(f"categoria:{c['id']}" for c in result['categorias'])
+        if filters.get('ofertas') == 'true':
+            tags.add(TAG_OFERTAS)
+        return CatalogCacheService._guardar(key, result, tags)
+
+    @staticmethod
+    def _guardar(key: str, result: dict, tags) -> CachedBody:
+        body = CachedBody.from_json(result)
+        # No cachear más allá del próximo inicio/fin de una promoción
+        ttl = CATALOGO_CACHE_TTL
+        valido_hasta = PromotionService.get_index().valido_hasta
+        if valido_hasta is not None:
+            ttl = min(ttl, int((valido_hasta - datetime.utcnow()).total_seconds()))
+        if ttl > 0:
+            cache.set(key, body, ttl_seconds=ttl, tags=tags)
+        return body
+
+    @staticmethod
+    def invalidar_productos(producto_ids, categoria_ids=(), membresia=False):
+        """
+        Invalida las páginas que muestran a los productos. Con membresia=True también los
+        listados que abarcan sus categorías (alta, baja o cambios que alteran filtros/orden).
+        """
+        tags = {f'producto:{pid}' for pid in producto_ids if pid is not None}
+        if membresia:
+            tags.add(TAG_LISTADO_GLOBAL)
+            tags.update(f'listado:{cid}' for cid in categoria_ids if cid is not None)
+        invalidate_cache(tags=tags)
+
+    @staticmethod
+    def invalidar_stock(producto_ids):
+        """
+        Llamar después del commit que modificó stock. Los productos cuyo estado_stock cambió
+        (registrados por el listener del resumen de stock) invalidan también sus listados.
+        """
+        cambios = db.session.info.pop('estado_stock_cambios', {})
+        tags = {f'producto:{pid}' for pid in producto_ids if pid is not None}
+        if cambios:
+            tags.update(f'producto:{pid}' for pid in cambios)
+            tags.add(TAG_LISTADO_GLOBAL)
+            tags.update(f'listado:{cid}' for cid in cambios.values() if cid is not None)
+        invalidate_cache(tags=tags)
+
+    @staticmethod
+    def invalidar_promocion(promocion_id, producto_ids=(), categoria_ids=(), alcance_tienda=False):
+        """producto_ids / categoria_ids: vínculos de la promoción antes y después del cambio"""
+        if alcance_tienda:
+            # Afecta a todos los productos
+            invalidate_cache(tags=[TAG_CATALOGO])
+            return
+        tags = {f'promocion:{promocion_id}', TAG_OFERTAS}
+        tags.update(f'producto:{pid}' for pid in producto_ids)
+        tags.update(f'categoria:{cid}' for cid in categoria_ids)
+        invalidate_cache(tags=tags)
+
+    @staticmethod
+    def invalidar_categoria(categoria_id, nuevo_padre_id=None):
+        """
+        Páginas que muestran productos de la categoría (o de sus hijas) y listados que la
+        abarcan. Si cambió de padre, también los listados de la nueva rama.
+        """
+        tags = {f'categoria:{categoria_id}', f'listado:{categoria_id}'}
+        if nuevo_padre_id is not None:
+            tags.add(f'listado:{nuevo_padre_id}')
+        invalidate_cache(tags=tags)
@@ -0,0 +1,189 @@
+from flask import g, has_request_context
+from cache_utils import cache
+from models import db, Categoria
+from threading import Lock
+from datetime import datetime
+import hashlib
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Antigüedad máxima del grafo en memoria (red de seguridad si el bus de invalidación falla)
+CATEGORY_GRAPH_MAX_AGE = 300
+# Namespace del caché cuya generación versiona el grafo: invalidate() la incrementa y el
+# backend compartido o el bus la hace llegar a todos los workers
+CATEGORY_GRAPH_NAMESPACE = 'grafo_categorias'
+
+class CategoryGraph:
+    """
+    Snapshot inmutable de la jerarquía de categorías: mapa de padres, hijos ordenados
+    por nombre, ancestros, descendientes y profundidad. Se arma con una sola query y
+    todas las consultas posteriores son búsquedas en diccionarios.
+    """
+    def __init__(self, filas):
+        self._nodos = {}
+        self._padre = {}
+        hijos = {}
+        for f in filas:
+            self._nodos[f.id] = {
+                'id': f.id,
+                'nombre': f.nombre,
+                'descripcion': f.descripcion,
+                'imagen': f.imagen,
+                'orden': f.orden,
+                'categoria_padre_id': f.categoria_padre_id,
+                'activa': f.activa,
+                'slug': f.slug,
+                'created_at': f.created_at.isoformat() if f.created_at else None
+            }
+            self._padre[f.id] = f.categoria_padre_id
+
+        for cat_id, padre_id in self._padre.items():
+            hijos.setdefault(padre_id, []).append(cat_id)
+
+        # Hijos ordenados por nombre (mismo criterio que get_arbol_completo)
+        self._hijos = {
+            padre_id: tuple(sorted(ids, key=lambda i: self._nodos[i]['nombre'] or ''))
+            for padre_id, ids in hijos.items() if padre_id is not None
+        }
+        # Raíces ordenadas por 'orden' (mismo criterio que /api/categorias/tree)
+        self._raices = tuple(sorted(
+            (i for i, p in self._padre.items() if p is None),
+            key=lambda i: (self._nodos[i]['orden'] or 0, i)
+        ))
+
+        # Sello del contenido (igual en todos los workers para los mismos datos): ETag del árbol
+        self.version = hashlib.md5(
+            json.dumps(sorted(self._nodos.items()), sort_keys=True, default=str).encode()
+        ).hexdigest()
+        self.construido = datetime.utcnow()
+
+        self._ancestros = {cat_id: self._calcular_ancestros(cat_id) for cat_id in self._nodos}
+        self._descendientes = {}
+        for cat_id in self._nodos:
+            self._descendientes[cat_id] = frozenset(self._calcular_descendientes(cat_id))
+
+    def _calcular_ancestros(self, cat_id):
+        ancestros = []
+        visitados = {cat_id}
+        actual = self._padre.get(cat_id)
+        while actual is not None and actual in self._nodos and actual not in visitados:
+            ancestros.append(actual)
+            visitados.add(actual)
+            actual = self._padre.get(actual)
+        return tuple(ancestros)
+
+    def _calcular_descendientes(self, cat_id):
+        resultado = {cat_id}
+        pendientes = [cat_id]
+        while pendientes:
+            for hijo in self._hijos.get(pendientes.pop(), ()):
+                if hijo not in resultado:
+                    resultado.add(hijo)
+                    pendientes.append(hijo)
+        return resultado
+
+    def contiene(self, cat_id):
+        return cat_id in self._nodos
+
+    def nombre(self, cat_id):
+        nodo = self._nodos.get(cat_id)
+        return nodo['nombre'] if nodo else None
+
+    def padre(self, cat_id):
+        return self._padre.get(cat_id)
+
+    def hijos(self, cat_id):
+        return self._hijos.get(cat_id, ())
+
+    def raices(self):
+        return self._raices
+
+    def ancestros(self, cat_id):
+        """Ancestros desde el padre directo hasta la raíz"""
+        return self._ancestros.get(cat_id, ())
+
+    def descendientes(self, cat_id):
+        """IDs de la categoría y todas sus subcategorías (a cualquier profundidad)"""
+        return self._descendientes.get(cat_id, frozenset([cat_id]))
+
+    def es_descendiente(self, cat_id, ancestro_id):
+        """True si cat_id es ancestro_id o cuelga de él"""
+        return cat_id == ancestro_id or ancestro_id in self._ancestros.get(cat_id, ())
+
+    def profundidad(self, cat_id):
+        """1 para raíces, 2 para subcategorías, etc."""
+        return len(self._ancestros.get(cat_id, ())) + 1
+
+    def nivel(self, cat_id):
+        """Nivel jerárquico tal como lo expone la API (1, 2 o 3)"""
+        return min(self.profundidad(cat_id), 3)
+
+    def to_dict(self, cat_id, include_subcategorias=False):
+        """Equivalente a Categoria.to_dict, armado desde el snapshot (dicts nuevos en cada llamada)"""
+        data = dict(self._nodos[cat_id])
+        data['nivel'] = self.nivel(cat_id)
+        if include_subcategorias:
+            hijos = self.hijos(cat_id)
+            if hijos:
+                data['subcategorias'] = [self.to_dict(h, include_subcategorias=True) for h in hijos]
+        return data
+
+    def arbol(self):
+        """Árbol completo desde las raíces"""
+        return [self.to_dict(r, include_subcategorias=True) for r in self._raices]
+
+
+class CategoryService:
+    _graph = None
+    _built_at = 0
+    _lock = Lock()
+
+    @staticmethod
+    def get_graph():
+        """
+        Grafo de categorías del proceso (se construye bajo demanda). Se valida contra la
+        generación compartida una vez por request; dentro de la request se reutiliza.
+        """
+        if has_request_context() and 'grafo_categorias' in g:
+            return g.grafo_categorias
+        graph = CategoryService._graph
+        if (graph is None
+                or time.time() - CategoryService._built_at > CATEGORY_GRAPH_MAX_AGE
+                or graph.generacion != cache.generation(CATEGORY_GRAPH_NAMESPACE)):
+            graph = CategoryService.rebuild()
+        if has_request_context():
+            g.grafo_categorias = graph
+        return graph
+
+    @staticmethod
+    def rebuild():
+        """Reconstruye el grafo con una sola query y lo publica de forma atómica"""
+        with CategoryService._lock:
+            # Leer la generación antes que las filas: una invalidación concurrente fuerza otro rebuild
+            generacion = cache.generation(CATEGORY_GRAPH_NAMESPACE)
+            # no_autoflush: no forzar el flush de cambios pendientes de la request actual
+            with db.session.no_autoflush:
+                filas = db.session.query(
+                    Categoria.id, Categoria.nombre, Categoria.descripcion, Categoria.imagen,
+                    Categoria.orden, Categoria.categoria_padre_id, Categoria.activa,
+                    Categoria.slug, Categoria.created_at
+                ).all()
+            graph = CategoryGraph(filas)
+            graph.generacion = generacion
+            CategoryService._graph = graph
+            CategoryService._built_at = time.time()
+            return graph
+
+    @staticmethod
+    def invalidate():
+        """
+        Descarta el grafo en todos los workers: el próximo acceso lo reconstruye.
+        Llamar después del commit y antes de invalidar las páginas que dependen del grafo.
+        """
+        CategoryService._graph = None
+        cache.bump(CATEGORY_GRAPH_NAMESPACE)
+        if has_request_context():
+            g.pop('grafo_categorias', None)
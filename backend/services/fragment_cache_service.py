@@ -0,0 +1,66 @@
+from cache_utils import cache, is_refresh_request
+from services.category_service import CategoryService
+from services.promotion_service import PromotionService
+
+# TTL de cada fragmento. Las claves llevan el sello de versión del producto, así que una
+# edición nunca sirve un fragmento viejo: el TTL solo acota cuánto viven las versiones en desuso.
+FRAGMENTO_CACHE_TTL = 600
+
+class FragmentCacheService:
+    """
+    Caché del dict serializado de cada producto, por vista ('card' / 'full'). La clave es
+    fragmento@<gen>:<vista>:<id>:<sello>, con un sello que cambia cuando cambia algo de lo
+    que sale en el dict:
+    - Producto.updated_at   datos propios, imágenes y relacionados (el admin lo actualiza)
+    - Producto.stock_version   stock por talle y resumen (actualizar_resumen_stock)
+    - versión del índice de promociones y del grafo de categorías (precio y nombres)
+    - en la vista full, updated_at de cada relacionado (nombre y color del selector)
+    Un listado arma su respuesta con los fragmentos y serializa solo los productos que
+    cambiaron. Los cambios de talles y colores (nombres en stock_talles) llaman a invalidar().
+    """
+    _fragmentos = cache.namespace('fragmento')
+
+    @staticmethod
+    def _sello_global() -> str:
+        return f"{PromotionService.get_index().version[:8]}{CategoryService.get_graph().version[:8]}"
+
+    @staticmethod
+    def sello(producto, view: str, sello_global: str = None) -> str:
+        """Sello de versión del producto en la vista (usa solo atributos ya cargados)"""
+        partes = [
+            f"{producto.updated_at.timestamp():.6f}" if producto.updated_at else '-',
+            str(producto.stock_version or 0),
+            sello_global or FragmentCacheService._sello_global()
+        ]
+        if view == 'full':
+            partes.extend(
+                f"{rel.id}.{rel.updated_at.timestamp():.6f}" if rel.updated_at else str(rel.id)
+                for rel in producto.relacionados
+            )
+        return '-'.join(partes)
+
+    @staticmethod
+    def serialize(productos, view: str = 'full') -> list:
+        """
+        Dicts de los productos en el orden recibido: los fragmentos vigentes se toman del caché
+        y el resto se serializa (to_card_dict / to_dict) y se guarda. Cada dict retornado es una
+        copia superficial: se pueden agregar o quitar claves, no modificar las listas internas.
+        """
+        sello_global = FragmentCacheService._sello_global()
+        refrescar = is_refresh_request()
+        # Prefijo con la generación del namespace, leída una vez por listado
+        prefijo = FragmentCacheService._fragmentos.key(view)
+        items = []
+        for producto in productos:
+            clave = f"{prefijo}:{producto.id}:{FragmentCacheService.sello(producto, view, sello_global)}"
+            fragmento = None if refrescar else cache.get(clave)
+            if fragmento is None:
+                fragmento = producto.to_card_dict() if view == 'card' else producto.to_dict()
+                cache.set(clave, fragmento, FRAGMENTO_CACHE_TTL)
+            items.append(dict(fragmento))
+        return items
+
+    @staticmethod
+    def invalidar() -> int:
+        """Descarta todos los fragmentos (nueva generación del namespace)"""
+        return FragmentCacheService._fragmentos.invalidate()
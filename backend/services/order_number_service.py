@@ -0,0 +1,104 @@
+from models import db, Contador, Pedido
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from threading import Lock
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Números que cada worker reserva por UPDATE (los no usados se pierden al reiniciar: quedan huecos)
+ORDER_NUMBER_BLOCK = int(os.environ.get('ORDER_NUMBER_BLOCK', 20))
+
+CONTADOR_PEDIDOS = 'numero_pedido'
+# Formato AA0000: dos letras y cuatro dígitos; AA9999 sigue con AB0000
+_LETRAS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_POR_PREFIJO = 10000
+_MAXIMO = len(_LETRAS) * len(_LETRAS) * _POR_PREFIJO
+# Prefijo de los números de emergencia del generador anterior (no son parte de la secuencia)
+_PREFIJO_FALLBACK = 'ER'
+
+
+class OrderNumberService:
+    """
+    Numeración de pedidos sin colisiones. El último número reservado vive en la fila
+    'numero_pedido' de contadores; cada worker reserva un bloque de ORDER_NUMBER_BLOCK con un
+    UPDATE atómico en su propia transacción (no retiene el lock durante el checkout) y
+    entrega los números del bloque en memoria. Los números son únicos entre workers, pero
+    no estrictamente correlativos en el tiempo.
+    """
+    _lock = Lock()
+    _siguiente = 0
+    _fin = 0      # primer número fuera del bloque actual
+    _pid = None   # el bloque no se hereda en un fork (gunicorn --preload)
+
+    @staticmethod
+    def siguiente() -> str:
+        """Próximo numero_pedido (O(1); una query cada ORDER_NUMBER_BLOCK pedidos)"""
+        with OrderNumberService._lock:
+            if OrderNumberService._pid != os.getpid() or OrderNumberService._siguiente >= OrderNumberService._fin:
+                ultimo = OrderNumberService._reservar(ORDER_NUMBER_BLOCK)
+                OrderNumberService._siguiente = ultimo - ORDER_NUMBER_BLOCK + 1
+                OrderNumberService._fin = ultimo + 1
+                OrderNumberService._pid = os.getpid()
+            numero = OrderNumberService._siguiente
+            OrderNumberService._siguiente += 1
+        return OrderNumberService.codigo(numero)
+
+    @staticmethod
+    def codigo(numero: int) -> str:
+        """Ordinal -> 'AA0000'"""
+        if not 0 <= numero < _MAXIMO:
+            raise ValueError("Numeración de pedidos agotada")
+        prefijo, resto = divmod(numero, _POR_PREFIJO)
+        primera, segunda = divmod(prefijo, len(_LETRAS))
+        return f"{_LETRAS[primera]}{_LETRAS[segunda]}{resto:04d}"
+
+    @staticmethod
+    def ordinal(codigo: str):
+        """'AA0000' -> ordinal, o None si no tiene el formato"""
+        if (not codigo or len(codigo) != 6 or codigo[0] not in _LETRAS or codigo[1] not in _LETRAS
+                or not codigo[2:].isdigit()):
+            return None
+        prefijo = _LETRAS.index(codigo[0]) * len(_LETRAS) + _LETRAS.index(codigo[1])
+        return prefijo * _POR_PREFIJO + int(codigo[2:])
+
+    @staticmethod
+    def _reservar(cantidad: int) -> int:
+        """Incrementa el contador en `cantidad` y retorna el último número reservado"""
+        contadores = Contador.__table__
+        for _ in range(3):
+            with db.engine.begin() as conn:
+                filas = conn.execute(
+                    contadores.update()
+                    .where(contadores.c.nombre == CONTADOR_PEDIDOS)
+                    .values(valor=contadores.c.valor + cantidad)
+                ).rowcount
+                if filas:
+                    # Misma transacción que el UPDATE: la fila sigue bloqueada para los demás
+                    return conn.execute(
+                        db.select(contadores.c.valor).where(contadores.c.nombre == CONTADOR_PEDIDOS)
+                    ).scalar_one()
+            OrderNumberService._inicializar()
+        raise RuntimeError("No se pudo reservar un bloque de números de pedido")
+
+    @staticmethod
+    def _inicializar():
+        """Crea el contador continuando desde el mayor numero_pedido existente"""
+        with db.engine.begin() as conn:
+            # En el formato AA0000 el orden alfabético coincide con el de la secuencia
+            candidatos = conn.execute(
+                db.select(Pedido.numero_pedido).where(
+                    Pedido.numero_pedido.between('AA0000', 'ZZ9999'),
+                    func.length(Pedido.numero_pedido) == 6,
+                    ~Pedido.numero_pedido.like(f'{_PREFIJO_FALLBACK}%')
+                ).order_by(Pedido.numero_pedido.desc()).limit(50)
+            ).scalars()
+            inicio = next((n for n in map(OrderNumberService.ordinal, candidatos) if n is not None), 0)
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(Contador.__table__.insert().values(nombre=CONTADOR_PEDIDOS, valor=inicio))
+            logger.info(f"Contador de pedidos inicializado en {OrderNumberService.codigo(inicio)}")
+        except IntegrityError:
+            # Otro worker lo creó al mismo tiempo
+            pass
@@ -1,15 +1,308 @@
-from models import db, Pedido, ItemPedido, Producto, Talle, StockTalle, PromocionProducto, MetodoPago
+from models import (db, Pedido, ItemPedido, Producto, Talle, StockTalle, PromocionProducto, MetodoPago,
+                    promocion_productos_link, promocion_categorias_link)
+from sqlalchemy.orm import joinedload, lazyload, selectinload
 from datetime import datetime, timedelta
+from services.category_service import CategoryService
+from services.pricing_service import PricingService
+from services.order_number_service import OrderNumberService
+from services.promotion_service import PromotionService
+from services.stock_service import StockService, StockInsuficiente
+from cache_utils import cache, get_or_compute
+import hashlib
+import json
 import uuid
 
+# Categoría de Shorts: recibe 10% (en lugar de 15%) de descuento por transferencia/efectivo
+CATEGORIA_SHORTS_ID = 8
+
+# TTL de las cotizaciones del checkout. La clave lleva las versiones de promociones, categorías,
+# stock y precio de los productos del carrito y los usos del cupón: cualquier cambio la recalcula.
+COTIZACION_CACHE_TTL = 20
+
+_cotizaciones = cache.namespace('cotizacion')
+
+# Aprobación en lote: máximo de pedidos por request e intentos si el stock cambia en el medio
+APROBAR_LOTE_MAX = 200
+APROBAR_LOTE_REINTENTOS = 3
+
+class ConflictoAprobacion(Exception):
+    """El stock o los pedidos del lote cambiaron en cada intento de aprobarlo (el cliente puede reintentar)"""
+
 class OrderService:
     @staticmethod
     def create_order(data: dict):
         """
         Lógica de creación de pedido con validación de stock, promociones automáticas y cupones.
         """
+        # 1. Método de pago, validación de stock e items
+        metodo_pago_id, metodo, items_procesados = OrderService._preparar(data)
+
+        # 2. Precios: cantidad, promociones automáticas, cupón y método de pago (motor de precios)
+        cotizacion, cupon = OrderService.cotizar_items(
+            items_procesados, data.get('codigo_cupon'), metodo, data.get('costo_envio', 0)
+        )
+
+        # 3. Crear Pedido Base con sus Items. Los items referencian los productos y talles ya
+        # cargados: el pedido los mantiene en la sesión y se serializa sin releerlos
+        numero_pedido = OrderNumberService.siguiente()
+        items_pedido = [
+            ItemPedido(
+                producto=item['producto'],
+                talle=item['talle'],
+                cantidad=item['cantidad'],
+                precio_unitario=item['precio_unitario'],
+                descuento_aplicado=float(linea['descuento_aplicado']),
+                subtotal=float(linea['subtotal'] - linea['descuento_aplicado'])
+            )
+            for item, linea in zip(items_procesados, cotizacion['lineas'])
+        ]
+        pedido = Pedido(
+            numero_pedido=numero_pedido,
+            cliente_nombre=data.get('cliente_nombre'),
+            cliente_email=data.get('cliente_email', '').lower().strip(), # Normalize email
+            cliente_telefono=data.get('cliente_telefono', ''),
+            cliente_direccion=data.get('calle', '') + ' ' + str(data.get('altura', '')),
+            cliente_codigo_postal=data.get('codigo_postal'),
+            cliente_localidad=data.get('ciudad'),
+            cliente_provincia=data.get('provincia'),
+            cliente_dni=data.get('dni'),
+            metodo_pago_id=metodo_pago_id,
+            metodo_envio=data.get('metodo_envio', 'correo_argentino'),
+            costo_envio=cotizacion['costo_envio'],
+            estado='pendiente_aprobacion',
+            aprobado=False,
+            subtotal=cotizacion['subtotal'],
+            # Promociones + cupón + método de pago (este último solo sobre productos, no sobre el envío)
+            descuento=cotizacion['descuento'],
+            total=cotizacion['total'],
+            fecha_expiracion=datetime.now() + timedelta(days=5),
+            items=items_pedido
+        )
+        
+        # 4. Guardar Pedido e Items
+        db.session.add(pedido)
+        db.session.flush() # ID
+
+        # 5. Registrar el uso del cupón
+        if cupon:
+            cupon.usos_actuales += 1
+        
+        # Enviar notificación de confirmación
+        try:
+            from services.notification_service import NotificationService
+            NotificationService.send_order_confirmation(pedido)
+        except Exception as e:
+            print(f"Error enviando notificación de pedido: {e}")
+
+        # Asegurar que el método de pago esté cargado para la respuesta
+        if metodo:
+            pedido.metodo_pago = metodo
+
+        return pedido
+
+    @staticmethod
+    def quote(data: dict) -> dict:
+        """
+        Cotización del checkout sin efectos: misma validación y precios que create_order más
+        las opciones de envío, sin crear filas, notificar ni consumir el cupón. Se cachea por
+        COTIZACION_CACHE_TTL con una clave derivada de lo que pide (carrito normalizado, cupón,
+        método de pago y envío) y del sello de los datos vivos que valida (stock, precios,
+        usos del cupón), así un hit nunca repite una validación vieja. Lanza Exception como
+        create_order.
+        """
+        normalizado = OrderService._normalizar_cotizacion(data)
+        firma = hashlib.md5(json.dumps(normalizado, sort_keys=True).encode()).hexdigest()
+        key = _cotizaciones.key(f"{OrderService._sello_cotizacion(normalizado)}:{firma}")
+        return get_or_compute(key, lambda: OrderService._cotizar(normalizado), ttl_seconds=COTIZACION_CACHE_TTL)
+
+    @staticmethod
+    def aprobar_lote(pedido_ids, admin_id=None) -> dict:
+        """
+        Aprueba varios pedidos en una transacción (hace commit). El stock de todos se valida
+        con una query y se reparte en el orden recibido: un pedido que no entra queda
+        rechazado sin afectar a los demás. Los aprobados se marcan y descuentan con UPDATE
+        set-based condicionales; si otra aprobación o venta externa se llevó el stock (o el
+        mismo pedido) en el medio, se reintenta con los datos nuevos y después de
+        APROBAR_LOTE_REINTENTOS intentos lanza ConflictoAprobacion.
+        Retorna {'resultados': [{id, numero_pedido, estado, faltantes?}], 'aprobados': [ids],
+        'producto_ids': set}; estado es aprobado, ya_aprobado, expirado, no_encontrado o
+        stock_insuficiente.
+        """
+        pedido_ids = list(dict.fromkeys(pedido_ids))
+        for _ in range(APROBAR_LOTE_REINTENTOS):
+            try:
+                resultado = OrderService._aprobar_lote(pedido_ids, admin_id)
+                db.session.commit()
+                return resultado
+            except (StockInsuficiente, ConflictoAprobacion):
+                db.session.rollback()
+        raise ConflictoAprobacion("El stock o los pedidos cambiaron durante la aprobación, reintentar")
+
+    @staticmethod
+    def _aprobar_lote(pedido_ids, admin_id) -> dict:
+        pedidos = {
+            pedido.id: pedido for pedido in
+            Pedido.query.options(selectinload(Pedido.items)).filter(Pedido.id.in_(pedido_ids)).all()
+        }
+        ahora = datetime.utcnow()
+
+        # Unidades por (producto, talle) de cada pedido candidato
+        necesidades = {}
+        for pedido in pedidos.values():
+            if pedido.aprobado or (pedido.fecha_expiracion and pedido.fecha_expiracion < ahora):
+                continue
+            por_par = necesidades[pedido.id] = {}
+            for item in pedido.items:
+                par = (item.producto_id, item.talle_id)
+                por_par[par] = por_par.get(par, 0) + item.cantidad
+
+        # Una query para el stock de todos los pedidos, repartido en el orden recibido
+        restante = StockService.disponibles(par for por_par in necesidades.values() for par in por_par)
+        resultados = []
+        aprobados = []
+        for pedido_id in pedido_ids:
+            pedido = pedidos.get(pedido_id)
+            if pedido is None:
+                resultados.append({'id': pedido_id, 'numero_pedido': None, 'estado': 'no_encontrado'})
+                continue
+            resultado = {'id': pedido.id, 'numero_pedido': pedido.numero_pedido}
+            resultados.append(resultado)
+            if pedido.aprobado:
+                resultado['estado'] = 'ya_aprobado'
+                continue
+            if pedido.id not in necesidades:
+                resultado['estado'] = 'expirado'
+                continue
+            faltantes = [
+                {'producto_id': p, 'talle_id': t, 'solicitado': cantidad, 'disponible': restante.get((p, t), 0)}
+                for (p, t), cantidad in necesidades[pedido.id].items()
+                if restante.get((p, t), 0) < cantidad
+            ]
+            if faltantes:
+                resultado['estado'] = 'stock_insuficiente'
+                resultado['faltantes'] = faltantes
+                continue
+            for par, cantidad in necesidades[pedido.id].items():
+                restante[par] -= cantidad
+            resultado['estado'] = 'aprobado'
+            aprobados.append(pedido.id)
+
+        producto_ids = set()
+        if aprobados:
+            # Condicional: si otro admin aprobó alguno en el medio no se descuenta dos veces
+            pedidos_t = Pedido.__table__
+            marcados = db.session.execute(
+                pedidos_t.update()
+                .where(pedidos_t.c.id.in_(aprobados), pedidos_t.c.aprobado.is_(False))
+                .values(aprobado=True, estado='confirmado', fecha_aprobacion=ahora, admin_aprobador_id=admin_id)
+            ).rowcount
+            if marcados != len(aprobados):
+                raise ConflictoAprobacion()
+            producto_ids = StockService.descontar(
+                (p, t, cantidad) for pedido_id in aprobados for (p, t), cantidad in necesidades[pedido_id].items()
+            )
+            for pedido_id in aprobados:
+                db.session.expire(pedidos[pedido_id])
+
+        return {'resultados': resultados, 'aprobados': aprobados, 'producto_ids': producto_ids}
+
+    @staticmethod
+    def _normalizar_cotizacion(data: dict) -> dict:
+        """Campos del pedido que afectan a la cotización, con las líneas ordenadas"""
+        items = sorted(
+            (
+                {
+                    'producto_id': OrderService._id(item.get('producto_id')),
+                    'talle_id': OrderService._id(item.get('talle_id')),
+                    'cantidad': int(item.get('cantidad', 1))
+                }
+                for item in data.get('items', [])
+            ),
+            key=lambda item: (item['producto_id'] or 0, item['talle_id'] or 0, item['cantidad'])
+        )
+        return {
+            'items': items,
+            'metodo_pago': data.get('metodo_pago') or data.get('metodo_pago_id'),
+            'codigo_cupon': (data.get('codigo_cupon') or '').strip() or None,
+            'codigo_postal': str(data.get('codigo_postal') or '').strip() or None,
+            'metodo_envio': data.get('metodo_envio'),
+            'costo_envio': float(data.get('costo_envio') or 0)
+        }
+
+    @staticmethod
+    def _sello_cotizacion(normalizado: dict) -> str:
+        """
+        Versión de los datos que usa la cotización: índice de promociones, grafo de categorías,
+        stock_version y updated_at de los productos del carrito y usos del cupón. Una query
+        liviana por productos y otra por el cupón (si hay).
+        """
+        producto_ids = sorted({item['producto_id'] for item in normalizado['items'] if item['producto_id']})
+        productos = db.session.execute(
+            db.select(Producto.id, Producto.stock_version, Producto.updated_at)
+            .where(Producto.id.in_(producto_ids)).order_by(Producto.id)
+        ).all() if producto_ids else []
+        cupon = None
+        if normalizado['codigo_cupon']:
+            cupon = db.session.execute(
+                db.select(PromocionProducto.id, PromocionProducto.usos_actuales)
+                .where(PromocionProducto.codigo == normalizado['codigo_cupon'])
+            ).first()
+        datos = [
+            PromotionService.get_index().version,
+            CategoryService.get_graph().version,
+            [list(fila) for fila in productos],
+            list(cupon) if cupon else None
+        ]
+        return hashlib.md5(json.dumps(datos, default=str).encode()).hexdigest()
+
+    @staticmethod
+    def _cotizar(normalizado: dict) -> dict:
+        from services.shipping_service import ShippingService
+        metodo_pago_id, metodo, items_procesados = OrderService._preparar(normalizado)
+
+        # Envío: opciones para el código postal; el costo es el de la opción elegida (con la
+        # bonificación de envío gratis) o, si no hay, el informado como en create_order
+        opciones = []
+        seleccionada = None
+        costo_envio = normalizado['costo_envio']
+        if normalizado['codigo_postal']:
+            opciones = ShippingService.calculate_cost(normalizado['codigo_postal'], items=[{
+                'producto_id': item['producto'].id,
+                'producto': {'id': item['producto'].id, 'nombre': item['producto'].nombre},
+                'cantidad': item['cantidad']
+            } for item in items_procesados])
+            metodo_envio = normalizado['metodo_envio']
+            if metodo_envio:
+                seleccionada = next((o for o in opciones if o['id'].startswith(metodo_envio)), None)
+            if seleccionada:
+                costo_envio = max(0, seleccionada['costo'] - seleccionada.get('descuento', 0))
+
+        cotizacion, cupon = OrderService.cotizar_items(
+            items_procesados, normalizado['codigo_cupon'], metodo, costo_envio
+        )
+        for item, linea in zip(items_procesados, cotizacion['lineas']):
+            linea['talle_id'] = item['talle'].id
+            linea['producto_nombre'] = item['producto'].nombre
+            linea['talle_nombre'] = item['talle'].nombre
+        cotizacion.update({
+            'metodo_pago_id': metodo_pago_id,
+            'metodo_pago_nombre': metodo.nombre if metodo else None,
+            'cupon': cupon.codigo if cupon else None,
+            'envio': {'opciones': opciones, 'seleccionada': seleccionada},
+            'cotizado_en': datetime.utcnow().isoformat()
+        })
+        return cotizacion
+
+    @staticmethod
+    def _preparar(data: dict):
+        """
+        Método de pago y validación de stock de los items del pedido (común a create_order y
+        quote). Retorna (metodo_pago_id, metodo, items_procesados) con items_procesados:
+        [{producto, talle, cantidad, precio_unitario}]. Lanza Exception si falta stock.
+        """
         metodo_pago_val = data.get('metodo_pago') or data.get('metodo_pago_id')
         metodo_pago_id = None
+        metodo = None
         
         if isinstance(metodo_pago_val, str) and not metodo_pago_val.isdigit():
             # Buscar ID por nombre
@@ -21,294 +314,164 @@ class OrderService:
                 metodo_pago_id = 1
         else:
             metodo_pago_id = int(metodo_pago_val) if metodo_pago_val else 1
+        if metodo is None:
+            metodo = db.session.get(MetodoPago, metodo_pago_id)
 
-        # 1. Validar Stock y Preparar Items
+        # 1. Validar Stock y Preparar Items (productos, talles y stock del carrito en 3 queries)
+        items_data = data.get('items', [])
+        productos, talles, stock = OrderService._cargar_carrito(items_data)
         items_procesados = []
         
-        for item_data in data.get('items', []):
-            producto = Producto.query.get(item_data['producto_id'])
-            talle = Talle.query.get(item_data['talle_id'])
+        for item_data in items_data:
+            producto = productos.get(OrderService._id(item_data['producto_id']))
+            talle = talles.get(OrderService._id(item_data['talle_id']))
             cantidad = int(item_data['cantidad'])
             
             if not producto or not talle:
                 continue
 
-            stock_talle = StockTalle.query.filter_by(producto_id=producto.id, talle_id=talle.id).first()
+            stock_talle = stock.get((producto.id, talle.id))
             if not stock_talle or stock_talle.cantidad < cantidad:
                 raise Exception(f"Stock insuficiente: {producto.nombre} ({talle.nombre})")
             
-            # Usar precio actual
-            precio_unitario = producto.get_precio_actual()
-            
             items_procesados.append({
                 'producto': producto,
                 'talle': talle,
                 'cantidad': cantidad,
-                'precio_unitario': precio_unitario,
-                'descuento_aplicado': 0, # Se calculará globalmente
+                'precio_unitario': producto.get_precio_actual(), # Usar precio actual
             })
 
-        # 1.5 Calcular Promoción por CANTIDAD (NUEVO)
-        # "Llevando 2 unidades, se aplica un 10%. Llevando 3 unidades, se aplica un 15%."
-        total_qty = sum(item['cantidad'] for item in items_procesados)
-        qty_discount_percent = 0
-        
-        if total_qty >= 3:
-            qty_discount_percent = 15
-        elif total_qty == 2:
-            qty_discount_percent = 10
-            
-        if qty_discount_percent > 0:
-            for item in items_procesados:
-                # Aplica sobre el precio unitario * cantidad
-                # Se suma a 'descuento_aplicado'
-                amount = (item['precio_unitario'] * item['cantidad'] * qty_discount_percent) / 100
-                item['descuento_aplicado'] += amount
-
-        # 2. Calcular Promociones AUTOMÁTICAS (Globalmente)
-        promos_auto = PromocionProducto.query.filter_by(activa=True, es_cupon=False).all()
-        
-        # Agrupar items por promoción aplicable para casos 2x1, 3x2, etc.
-        # Nota: Un item podría tener múltiples promociones. 
-        # Simplificación: Iteramos promociones y buscamos items que apliquen.
-        
-        for promo in promos_auto:
-            if not promo.esta_activa():
-                continue
-                
-            items_aplicables = [item for item in items_procesados if OrderService._is_promo_applicable(promo, item['producto'])]
-            
-            if not items_aplicables:
-                continue
-                
-            tipo = promo.tipo_promocion.nombre.lower()
-            valor = promo.valor or 0
-            
-            if 'porcentaje' in tipo:
-                for item in items_aplicables:
-                    descuento = (item['precio_unitario'] * item['cantidad'] * valor) / 100
-                    item['descuento_aplicado'] += descuento
-                    
-            elif 'fijo' in tipo:
-                for item in items_aplicables:
-                    # Descuento fijo por unidad? O total? Asumimos por unidad si es 'descuento_fijo'
-                    descuento = valor * item['cantidad']
-                    # No descontar más que el precio
-                    max_desc = item['precio_unitario'] * item['cantidad']
-                    item['descuento_aplicado'] += min(descuento, max_desc)
-                    
-            elif '2x1' in tipo or '3x2' in tipo:
-                # Expandir a unidades individuales para "Mix & Match"
-                unidades = []
-                for item in items_aplicables:
-                    for _ in range(item['cantidad']):
-                        unidades.append({'precio': item['precio_unitario'], 'ref_item': item})
-                
-                # Ordenar por precio descendente (pagas los caros, gratis los baratos)
-                unidades.sort(key=lambda x: x['precio'], reverse=True)
-                
-                n = 2 if '2x1' in tipo else 3
-                
-                for i, unidad in enumerate(unidades):
-                    # Si es slot gratuito (cada n-ésimo item, indices 0-based: 2x1 -> paga 0, gratis 1. 3x2 -> paga 0,1, gratis 2)
-                    # wait, logic: 2x1 -> Buy 2, items index 0, 1. Pay 0. Free 1.
-                    # if (i + 1) % n == 0: -> Free
-                    if (i + 1) % n == 0:
-                        unidad['ref_item']['descuento_aplicado'] += unidad['precio']
-
-        # Calcular Subtotal y Descuento Total acumulado
-        subtotal_calculado = 0
-        descuento_total = 0
-        
-        for item in items_procesados:
-            line_total = item['precio_unitario'] * item['cantidad']
-            subtotal_calculado += line_total
-            descuento_total += item['descuento_aplicado']
+        return metodo_pago_id, metodo, items_procesados
 
-        # 3. Crear Pedido Base
-        numero_pedido = OrderService._generate_next_order_id()
-        pedido = Pedido(
-            numero_pedido=numero_pedido,
-            cliente_nombre=data.get('cliente_nombre'),
-            cliente_email=data.get('cliente_email', '').lower().strip(), # Normalize email
-            cliente_telefono=data.get('cliente_telefono', ''),
-            cliente_direccion=data.get('calle', '') + ' ' + str(data.get('altura', '')),
-            cliente_codigo_postal=data.get('codigo_postal'),
-            cliente_localidad=data.get('ciudad'),
-            cliente_provincia=data.get('provincia'),
-            cliente_dni=data.get('dni'),
-            metodo_pago_id=metodo_pago_id,
-            metodo_envio=data.get('metodo_envio', 'correo_argentino'),
-            costo_envio=float(data.get('costo_envio', 0)),
-            estado='pendiente_aprobacion',
-            aprobado=False,
-            subtotal=subtotal_calculado, 
-            descuento=descuento_total,
-            total=0, # Se calcula al final
-            fecha_expiracion=datetime.now() + timedelta(days=5)
+    @staticmethod
+    def cotizar_items(items_procesados, codigo_cupon=None, metodo=None, costo_envio=0):
+        """
+        Precio de los items validados ({producto, talle, cantidad, precio_unitario}) con el
+        motor de precios. Carga las promociones automáticas vigentes (vínculos limitados a los
+        productos del carrito) y el cupón. Retorna (cotizacion, cupon): cupon es la
+        PromocionProducto aplicada o None. No modifica nada (ni los usos del cupón).
+        """
+        promos_auto = [
+            promo for promo in PromocionProducto.query.options(
+                joinedload(PromocionProducto.tipo_promocion)
+            ).filter_by(activa=True, es_cupon=False).all()
+            if promo.esta_activa()
+        ]
+        enlaces = OrderService._cargar_enlaces_promos(
+            [promo.id for promo in promos_auto],
+            [item['producto'] for item in items_procesados]
         )
-        
-        db.session.add(pedido)
-        db.session.flush() # ID
-        
-        # 4. Guardar Items
-        for item in items_procesados:
-            item_pedido = ItemPedido(
-                pedido_id=pedido.id,
-                producto_id=item['producto'].id,
-                talle_id=item['talle'].id,
-                cantidad=item['cantidad'],
-                precio_unitario=item['precio_unitario'],
-                descuento_aplicado=item['descuento_aplicado'],
-                subtotal=(item['precio_unitario'] * item['cantidad']) - item['descuento_aplicado']
-            )
-            db.session.add(item_pedido)
-            
-        # 5. Procesar Cupón (si existe) -> Puede ser adicional
-        codigo_cupon = data.get('codigo_cupon')
-        descuento_cupon = 0
-        if codigo_cupon:
-            cupon = PromocionProducto.query.filter_by(codigo=codigo_cupon, activa=True, es_cupon=True).first()
-            if cupon and cupon.esta_activa():
-                # Validaciones simples de cupón
-                if cupon.max_usos and cupon.usos_actuales >= cupon.max_usos:
-                    raise Exception("Cupón agotado")
-                if subtotal_calculado < cupon.compra_minima:
-                    raise Exception(f"Monto mínimo: ${cupon.compra_minima}")
-                
-                 # Aplicar cupón
-                # Simplificación: Aplicar sobre el total restante o recalcular?
-                # Aplicamos directo al descuento total del pedido
-                if cupon.tipo_promocion.nombre == 'descuento_porcentaje':
-                     # Sobre el total descontado o sobre el subtotal? Usualmente sobre el total previo
-                     base = subtotal_calculado - descuento_total
-                     desc = base * (cupon.valor / 100)
-                     descuento_cupon += desc
-                elif cupon.tipo_promocion.nombre == 'descuento_fijo':
-                    descuento_cupon += cupon.valor
-                
-                if cupon.envio_gratis:
-                    pedido.costo_envio = 0
-                    
-                cupon.usos_actuales += 1
-                
-        pedido.descuento += descuento_cupon
-
-        # 6. Descuento Método de Pago (15%)
-        # CRITICAL FIX: Apply ONLY on products, NOT on shipping
-        # The 15% discount should apply on (subtotal - product_discounts), NOT including shipping cost
-        
-        base_pago = pedido.subtotal - pedido.descuento  # Product total after discounts
-        base_pago = max(0, base_pago)
-        
-        descuento_pago = 0
-        metodo = MetodoPago.query.get(metodo_pago_id)
-        if metodo:
-            nombre = metodo.nombre.lower()
-            if 'transferencia' in nombre or 'efectivo' in nombre:
-                # Nuevo Logic: 10% para Shorts (Cat 8), 15% para el resto
-                # Se calcula sobre el neto (Total item - descuentos previos)
-                
-                for item in items_procesados:
-                    item_total = item['precio_unitario'] * item['cantidad']
-                    item_net = item_total - item['descuento_aplicado']
-                    if item_net < 0: item_net = 0
-                    
-                    percentage = 0.15 # Default (Remeras, etc)
-                    
-                    # Verificar si es Short (ID 8) o descendiente
-                    es_short = False
-                    cat_cursor = item['producto'].categoria
-                    # Recorrer hacia arriba hasta encontrar root o id 8
-                    # Limite de seguridad para evitar loops infinitos (aunque no deberia haber)
-                    for _ in range(5): 
-                        if not cat_cursor: break
-                        if cat_cursor.id == 8:
-                            es_short = True
-                            break
-                        cat_cursor = cat_cursor.categoria_padre
-                    
-                    if es_short: # Shorts y derivados
-                        percentage = 0.10
-                        
-                    descuento_pago += item_net * percentage
-        
-        pedido.descuento += descuento_pago
-        
-        # 7. Total Final = Products (with discounts) + Shipping
-        total_final = (pedido.subtotal + pedido.costo_envio) - pedido.descuento
-        pedido.total = max(0, total_final)
-        
-        # Enviar notificación de confirmación
-        try:
-            from services.notification_service import NotificationService
-            NotificationService.send_order_confirmation(pedido)
-        except Exception as e:
-            print(f"Error enviando notificación de pedido: {e}")
+        reglas = PricingService.compilar({
+            'id': promo.id,
+            'alcance': promo.alcance,
+            'tipo': promo.tipo_promocion.nombre if promo.tipo_promocion else None,
+            'valor': promo.valor,
+            'productos': enlaces[promo.id]['productos'],
+            'categorias': enlaces[promo.id]['categorias']
+        } for promo in promos_auto)
 
-        # Asegurar que el método de pago esté cargado para la respuesta
-        if not pedido.metodo_pago:
-            pedido.metodo_pago = MetodoPago.query.get(pedido.metodo_pago_id)
+        cupon = None
+        if codigo_cupon:
+            cupon = PromocionProducto.query.options(
+                joinedload(PromocionProducto.tipo_promocion)
+            ).filter_by(codigo=codigo_cupon, activa=True, es_cupon=True).first()
+            if cupon and not cupon.esta_activa():
+                cupon = None
 
-        return pedido
+        cotizacion = PricingService.cotizar(
+            [{
+                'producto_id': item['producto'].id,
+                'categoria_id': item['producto'].categoria_id,
+                'precio_unitario': item['precio_unitario'],
+                'cantidad': item['cantidad']
+            } for item in items_procesados],
+            reglas,
+            cupon=OrderService._cupon_dict(cupon) if cupon else None,
+            metodo_pago=metodo.nombre if metodo else None,
+            costo_envio=costo_envio,
+            # Shorts y sus subcategorías reciben 10% (en lugar de 15%) por transferencia/efectivo
+            categorias_reducidas=CategoryService.get_graph().descendientes(CATEGORIA_SHORTS_ID)
+        )
+        return cotizacion, cupon
 
     @staticmethod
-    def _is_promo_applicable(promo, producto):
-        if promo.alcance == 'tienda': return True
-        if promo.alcance == 'producto' and any(p.id == producto.id for p in promo.productos): return True
-        if promo.alcance == 'categoria' and any(c.id == producto.categoria_id for c in promo.categorias): return True
-        return False
+    def _cupon_dict(cupon):
+        return {
+            'codigo': cupon.codigo,
+            'tipo': cupon.tipo_promocion.nombre if cupon.tipo_promocion else None,
+            'valor': cupon.valor,
+            'compra_minima': cupon.compra_minima,
+            'max_usos': cupon.max_usos,
+            'usos_actuales': cupon.usos_actuales,
+            'envio_gratis': cupon.envio_gratis
+        }
 
     @staticmethod
-    def _generate_next_order_id():
-        # Obtener el último pedido para calcular la secuencia
+    def _id(valor):
+        """Id de un item del carrito (int o string numérico); None si no es válido"""
         try:
-            # Buscar el último pedido creado por ID para tener referencia base
-            last_order = Pedido.query.order_by(Pedido.id.desc()).first()
-            
-            start_code = 'AA0000'
-            if last_order and last_order.numero_pedido:
-                start_code = last_order.numero_pedido
+            return int(valor)
+        except (TypeError, ValueError):
+            return None
 
-            # Lógica de incremento y validación de colisiones
-            current_code = start_code
-            
-            for _ in range(10): # Intentar 10 veces encontrar un hueco libre
-                # Parsear
-                if len(current_code) != 6 or not current_code[:2].isalpha() or not current_code[2:].isdigit():
-                    current_code = 'AA0000'
-
-                letters = current_code[:2]
-                number = int(current_code[2:])
-                
-                number += 1
-                if number > 9999:
-                    number = 0
-                    first_char = letters[0]
-                    second_char = letters[1]
-                    if second_char == 'Z':
-                        second_char = 'A'
-                        if first_char == 'Z':
-                             return 'AAA001' 
-                        else:
-                            first_char = chr(ord(first_char) + 1)
-                    else:
-                        second_char = chr(ord(second_char) + 1)
-                    letters = f"{first_char}{second_char}"
-                
-                candidate = f"{letters}{number:04d}"
-                
-                # Verificar si existe
-                exists = Pedido.query.filter_by(numero_pedido=candidate).first()
-                if not exists:
-                    return candidate
-                
-                # Si existe, usamos este candidato como base para el siguiente loop
-                current_code = candidate
-            
-            # Fallback random si falla loop
-            return f"ER{datetime.now().strftime('%M%S')}"
-            
-        except Exception as e:
-            print(f"Error generando ID pedido: {e}")
-            return f"ER{datetime.now().strftime('%M%S')}"
+    @staticmethod
+    def _cargar_carrito(items_data):
+        """
+        Carga de una vez los productos, talles y registros de stock de las líneas del carrito.
+        Retorna ({id: Producto}, {id: Talle}, {(producto_id, talle_id): StockTalle}); si hay
+        varios registros para el par (uno por color) se usa el primero, como filter_by().first().
+        """
+        producto_ids = {OrderService._id(i.get('producto_id')) for i in items_data} - {None}
+        talle_ids = {OrderService._id(i.get('talle_id')) for i in items_data} - {None}
+        if not producto_ids or not talle_ids:
+            return {}, {}, {}
+
+        # Para validar y tarifar solo se usan columnas del producto: sin imágenes, stock ni relacionados
+        productos = Producto.query.options(
+            lazyload(Producto.imagenes),
+            lazyload(Producto.stock_talles),
+            lazyload(Producto.relacionados)
+        ).filter(Producto.id.in_(producto_ids)).all()
+        talles = Talle.query.filter(Talle.id.in_(talle_ids)).all()
+        registros = StockTalle.query.options(
+            lazyload(StockTalle.talle),
+            lazyload(StockTalle.color)
+        ).filter(
+            StockTalle.producto_id.in_(producto_ids),
+            StockTalle.talle_id.in_(talle_ids)
+        ).order_by(StockTalle.id).all()
+
+        stock = {}
+        for registro in registros:
+            stock.setdefault((registro.producto_id, registro.talle_id), registro)
+        return {p.id: p for p in productos}, {t.id: t for t in talles}, stock
+
+    @staticmethod
+    def _cargar_enlaces_promos(promo_ids, productos):
+        """
+        Productos y categorías vinculados a cada promoción, limitados a los del carrito, con una
+        query por tabla de enlace. Retorna {promo_id: {'productos': set, 'categorias': set}}.
+        """
+        enlaces = {promo_id: {'productos': set(), 'categorias': set()} for promo_id in promo_ids}
+        if not enlaces or not productos:
+            return enlaces
+        producto_ids = {p.id for p in productos}
+        categoria_ids = {p.categoria_id for p in productos if p.categoria_id is not None}
+
+        filas = db.session.execute(
+            db.select(promocion_productos_link.c.promocion_id, promocion_productos_link.c.producto_id)
+            .where(promocion_productos_link.c.promocion_id.in_(enlaces))
+            .where(promocion_productos_link.c.producto_id.in_(producto_ids))
+        )
+        for promo_id, producto_id in filas:
+            enlaces[promo_id]['productos'].add(producto_id)
+
+        if categoria_ids:
+            filas = db.session.execute(
+                db.select(promocion_categorias_link.c.promocion_id, promocion_categorias_link.c.categoria_id)
+                .where(promocion_categorias_link.c.promocion_id.in_(enlaces))
+                .where(promocion_categorias_link.c.categoria_id.in_(categoria_ids))
+            )
+            for promo_id, categoria_id in filas:
+                enlaces[promo_id]['categorias'].add(categoria_id)
+        return enlaces
@@ -0,0 +1,247 @@
+import re
+
+# Descuento por cantidad total de unidades del carrito: (mínimo de unidades, porcentaje)
+DESCUENTOS_POR_CANTIDAD = ((3, 15), (2, 10))
+# Métodos de pago con descuento (por nombre) y porcentajes (general / categorías reducidas)
+METODOS_CON_DESCUENTO = ('transferencia', 'efectivo')
+DESCUENTO_PAGO = 0.15
+DESCUENTO_PAGO_REDUCIDO = 0.10
+
+_LLEVAS_PAGA = re.compile(r'^llevas_(\d+)_paga_(\d+)')
+
+
+def tipo_regla(nombre_tipo: str):
+    """
+    Traduce el nombre de un TipoPromocion a la regla que aplica el motor:
+    ('porcentaje',), ('fijo',), ('nxm', lleva, paga) o None si el tipo no descuenta.
+    """
+    tipo = (nombre_tipo or '').lower()
+    if 'porcentaje' in tipo:
+        return ('porcentaje',)
+    if 'fijo' in tipo:
+        return ('fijo',)
+    if '2x1' in tipo:
+        return ('nxm', 2, 1)
+    if '3x2' in tipo:
+        return ('nxm', 3, 2)
+    match = _LLEVAS_PAGA.match(tipo)
+    if match:
+        lleva, paga = int(match.group(1)), int(match.group(2))
+        if lleva > paga >= 0:
+            return ('nxm', lleva, paga)
+    return None
+
+
+def _gratis_hasta(posicion: int, lleva: int, paga: int) -> int:
+    """Unidades gratis entre las primeras `posicion` de grupos completos de `lleva` (en cada grupo se pagan las `paga` primeras)"""
+    return (posicion // lleva) * (lleva - paga) + max(0, posicion % lleva - paga)
+
+
+class ReglaPromocion:
+    __slots__ = ('id', 'alcance', 'regla', 'valor', 'productos', 'categorias')
+
+    def __init__(self, id, alcance, regla, valor, productos, categorias):
+        self.id = id
+        self.alcance = alcance
+        self.regla = regla
+        self.valor = valor
+        self.productos = productos
+        self.categorias = categorias
+
+
+class ReglasPrecio:
+    """
+    Promociones automáticas compiladas: las de alcance 'tienda' aplican a todo y las demás se
+    indexan por producto y por categoría (categoría exacta del producto, como en el checkout).
+    promos: iterable de dicts {id, alcance, tipo, valor, productos, categorias}, con tipo el
+    nombre del TipoPromocion y productos / categorias iterables de ids.
+    """
+    def __init__(self, promos=()):
+        self.promos = []
+        self.globales = []
+        self.por_producto = {}
+        self.por_categoria = {}
+        for promo in promos:
+            regla = tipo_regla(promo.get('tipo'))
+            if regla is None:
+                continue
+            compilada = ReglaPromocion(
+                promo['id'], promo.get('alcance'), regla, promo.get('valor') or 0,
+                frozenset(promo.get('productos') or ()), frozenset(promo.get('categorias') or ())
+            )
+            indice = len(self.promos)
+            self.promos.append(compilada)
+            if compilada.alcance == 'tienda':
+                self.globales.append(indice)
+            elif compilada.alcance == 'producto':
+                for producto_id in compilada.productos:
+                    self.por_producto.setdefault(producto_id, []).append(indice)
+            elif compilada.alcance == 'categoria':
+                for categoria_id in compilada.categorias:
+                    self.por_categoria.setdefault(categoria_id, []).append(indice)
+
+    def aplicables(self, producto_id, categoria_id):
+        """Índices de las promociones que aplican a un producto (sin orden)"""
+        directas = self.por_producto.get(producto_id)
+        de_categoria = self.por_categoria.get(categoria_id)
+        if not directas and not de_categoria:
+            return self.globales
+        return set(self.globales).union(directas or (), de_categoria or ())
+
+
+class PricingService:
+    """
+    Motor de precios del checkout: descuento por cantidad, promociones automáticas, cupón y
+    descuento por método de pago. Es puro (no usa la base ni el request): recibe líneas,
+    promociones y cupón como datos planos, así lo comparten la creación del pedido y la
+    cotización. Las promociones se compilan una vez (compilar) y cotizar es O(n log n) en
+    la cantidad de líneas, sin expandir unidades.
+    """
+    @staticmethod
+    def compilar(promos) -> ReglasPrecio:
+        return ReglasPrecio(promos)
+
+    @staticmethod
+    def descuento_linea(regla, valor, cantidad: int, precio_unitario: float) -> float:
+        """Descuento de una promoción sobre una sola línea (sin combinar unidades con otras líneas)"""
+        if regla is None:
+            return 0
+        if regla[0] == 'porcentaje':
+            return (precio_unitario * cantidad * valor) / 100
+        if regla[0] == 'fijo':
+            return min(valor * cantidad, precio_unitario * cantidad)
+        _, lleva, paga = regla
+        return precio_unitario * _gratis_hasta((cantidad // lleva) * lleva, lleva, paga)
+
+    @staticmethod
+    def cotizar(lineas, reglas: ReglasPrecio = None, cupon: dict = None, metodo_pago: str = None,
+                costo_envio: float = 0, categorias_reducidas=frozenset()) -> dict:
+        """
+        Calcula el precio de un carrito. lineas: dicts {producto_id, categoria_id,
+        precio_unitario, cantidad}. cupon: dict {codigo, tipo, valor, compra_minima, max_usos,
+        usos_actuales, envio_gratis} o None. categorias_reducidas: categorías con el descuento
+        de pago reducido (Shorts y sus subcategorías).
+
+        Lanza ValueError si el cupón está agotado o no llega al monto mínimo. Retorna el
+        desglose por línea y los totales del pedido (mismas reglas que el checkout):
+        - descuento por cantidad total de unidades, sobre cada línea
+        - promociones automáticas: porcentaje y fijo por línea; NxM combinando las unidades
+          de todas las líneas alcanzadas, de la más cara a la más barata
+        - cupón sobre el total con descuentos (porcentaje) o fijo
+        - descuento por método de pago sobre el neto de cada línea (sin envío ni cupón)
+        """
+        reglas = reglas or ReglasPrecio()
+        items = []
+        for linea in lineas:
+            cantidad = int(linea['cantidad'])
+            precio = linea['precio_unitario']
+            items.append({
+                'producto_id': linea['producto_id'],
+                'categoria_id': linea.get('categoria_id'),
+                'cantidad': cantidad,
+                'precio_unitario': precio,
+                'subtotal': precio * cantidad,
+                'descuento_cantidad': 0,
+                'descuento_promociones': 0,
+                'promociones': [],
+                'descuento_aplicado': 0,
+                'descuento_pago': 0,
+                'total': 0,
+            })
+
+        # 1. Descuento por cantidad
+        total_unidades = sum(item['cantidad'] for item in items)
+        porcentaje_cantidad = next((p for minimo, p in DESCUENTOS_POR_CANTIDAD if total_unidades >= minimo), 0)
+        if porcentaje_cantidad:
+            for item in items:
+                descuento = (item['precio_unitario'] * item['cantidad'] * porcentaje_cantidad) / 100
+                item['descuento_cantidad'] = descuento
+                item['descuento_aplicado'] += descuento
+
+        # 2. Promociones automáticas: agrupar las líneas alcanzadas por cada promoción
+        alcanzadas = {}
+        for item in items:
+            for indice in reglas.aplicables(item['producto_id'], item['categoria_id']):
+                alcanzadas.setdefault(indice, []).append(item)
+
+        for indice in sorted(alcanzadas):
+            promo = reglas.promos[indice]
+            grupo = alcanzadas[indice]
+            if promo.regla[0] == 'nxm':
+                _, lleva, paga = promo.regla
+                # Unidades ordenadas de la más cara a la más barata (estable: orden del carrito);
+                # cada línea ocupa un rango de posiciones y se cuentan las gratis dentro del rango
+                ordenadas = sorted(grupo, key=lambda item: item['precio_unitario'], reverse=True)
+                limite = (sum(item['cantidad'] for item in ordenadas) // lleva) * lleva
+                posicion = 0
+                gratis_previas = 0
+                for item in ordenadas:
+                    if posicion >= limite:
+                        break  # el resto de las unidades no completa un grupo
+                    posicion += item['cantidad']
+                    gratis_hasta_aca = _gratis_hasta(min(posicion, limite), lleva, paga)
+                    if gratis_hasta_aca > gratis_previas:
+                        PricingService._aplicar(item, promo.id, item['precio_unitario'] * (gratis_hasta_aca - gratis_previas))
+                    gratis_previas = gratis_hasta_aca
+            else:
+                for item in grupo:
+                    descuento = PricingService.descuento_linea(
+                        promo.regla, promo.valor, item['cantidad'], item['precio_unitario']
+                    )
+                    PricingService._aplicar(item, promo.id, descuento)
+
+        subtotal = 0
+        descuento = 0
+        for item in items:
+            subtotal += item['subtotal']
+            descuento += item['descuento_aplicado']
+
+        # 3. Cupón
+        descuento_cupon = 0
+        envio_gratis = False
+        if cupon:
+            if cupon.get('max_usos') and (cupon.get('usos_actuales') or 0) >= cupon['max_usos']:
+                raise ValueError("Cupón agotado")
+            if subtotal < (cupon.get('compra_minima') or 0):
+                raise ValueError(f"Monto mínimo: ${cupon['compra_minima']}")
+            if cupon.get('tipo') == 'descuento_porcentaje':
+                descuento_cupon = (subtotal - descuento) * (cupon['valor'] / 100)
+            elif cupon.get('tipo') == 'descuento_fijo':
+                descuento_cupon = cupon['valor']
+            envio_gratis = bool(cupon.get('envio_gratis'))
+
+        # 4. Descuento por método de pago, sobre el neto de cada línea
+        descuento_pago = 0
+        nombre_metodo = (metodo_pago or '').lower()
+        con_descuento = any(m in nombre_metodo for m in METODOS_CON_DESCUENTO)
+        for item in items:
+            neto = max(0, item['subtotal'] - item['descuento_aplicado'])
+            if con_descuento:
+                porcentaje = DESCUENTO_PAGO_REDUCIDO if item['categoria_id'] in categorias_reducidas else DESCUENTO_PAGO
+                item['descuento_pago'] = neto * porcentaje
+                descuento_pago += item['descuento_pago']
+            item['total'] = neto - item['descuento_pago']
+
+        costo_envio = 0 if envio_gratis else float(costo_envio or 0)
+        descuento_total = descuento + descuento_cupon + descuento_pago
+        return {
+            'lineas': items,
+            'cantidad_unidades': total_unidades,
+            'subtotal': subtotal,
+            'descuento_cantidad_porcentaje': porcentaje_cantidad,
+            'descuento_promociones': descuento,
+            'descuento_cupon': descuento_cupon,
+            'descuento_pago': descuento_pago,
+            'descuento': descuento_total,
+            'envio_gratis': envio_gratis,
+            'costo_envio': costo_envio,
+            'total': max(0, subtotal + costo_envio - descuento_total),
+        }
+
+    @staticmethod
+    def _aplicar(item, promo_id, descuento):
+        if not descuento:
+            return
+        item['descuento_promociones'] += descuento
+        item['descuento_aplicado'] += descuento
+        item['promociones'].append(promo_id)  # cada promoción se aplica una sola vez por línea
@@ -1,13 +1,254 @@
-from models import Producto, Categoria, Color, StockTalle, db
-from sqlalchemy import or_, case, select, exists, and_
+from models import Producto, Color
+from sqlalchemy import or_, case, select, exists, and_, func
+from sqlalchemy.orm import defer, lazyload, selectinload
 from extensions import limiter
+from services.search_service import SearchService
+from services.category_service import CategoryService
+from services.promotion_service import PromotionService
+from services.fragment_cache_service import FragmentCacheService
+from datetime import datetime
+import base64
+import json
+
+# Fecha usada para ordenar productos sin created_at (evita NULLs en las claves del cursor)
+_FECHA_ORDEN_DEFAULT = datetime(2000, 1, 1)
+
+# Bandas de precio por defecto para /api/productos/facets (la última queda abierta)
+RANGOS_PRECIO_DEFAULT = (0, 25000, 50000, 75000, 100000)
+# Filtros que son a la vez facetas: cada faceta se cuenta sin su propio filtro
+_FILTROS_FACETA = ('categoria_id', 'version', 'estado_stock', 'precio_min', 'precio_max')
+_ESTADOS_FACETA = {'disponible': 'disponible', 'bajo': 'bajo', 'no_disponible': 'agotado'}
+
+# Máximo de productos por pedido a /api/productos/batch
+BATCH_MAX_IDS = 50
+
+# Vistas de serialización del catálogo (?view=)
+VISTAS_CATALOGO = ('full', 'card')
+# Campos que puede devolver la vista card; si ?fields= pide solo estos se usa esa vista
+CAMPOS_CARD = frozenset((
+    'id', 'nombre', 'precio_base', 'precio_descuento', 'precio_actual', 'categoria_id',
+    'categoria_nombre', 'categoria_principal', 'subcategoria', 'activo', 'destacado', 'color',
+    'color_hex', 'dorsal', 'numero', 'version', 'producto_relacionado_id', 'ventas_count',
+    'estado_stock', 'tiene_stock', 'esta_agotado', 'imagenes', 'promociones', 'created_at',
+    'updated_at'
+))
 
 class ProductService:
     @staticmethod
-    def get_catalog(filters: dict, page: int = 1, page_size: int = 12):
+    def parse_projection(args):
+        """
+        Lee ?view= y ?fields= del request. Retorna (vista, campos) donde campos es None
+        (todos) o una tupla con los campos pedidos. Si todos los campos pedidos están en
+        la vista card se usa esa vista aunque no se haya pedido. Lanza ValueError si la
+        vista no existe.
+        """
+        view = args.get('view', 'full')
+        if view not in VISTAS_CATALOGO:
+            raise ValueError(f'Vista inválida: {view}')
+
+        fields = None
+        if args.get('fields'):
+            fields = tuple(dict.fromkeys(f.strip() for f in args['fields'].split(',') if f.strip()))
+            if fields and CAMPOS_CARD.issuperset(fields):
+                view = 'card'
+        return view, fields or None
+
+    @staticmethod
+    def serialize(productos, view: str = 'full', fields=None):
+        """
+        Serializa productos de un listado en la vista indicada, opcionalmente proyectando campos.
+        Cada producto sale de su fragmento cacheado (solo se serializan los que cambiaron).
+        """
+        items = FragmentCacheService.serialize(productos, view)
+        if fields:
+            items = [{k: item[k] for k in fields if k in item} for item in items]
+        return items
+
+    @staticmethod
+    def _load_options(view: str):
+        """Opciones de carga según la vista: la card no usa descripción, stock por talle ni relacionados"""
+        if view == 'card':
+            return [
+                defer(Producto.descripcion),
+                lazyload(Producto.stock_talles),
+                lazyload(Producto.relacionados)
+            ]
+        # De los relacionados solo se serializan id, nombre y color: no cargar en cadena
+        # sus imágenes, stock y relacionados (la relación es autorreferencial)
+        return [
+            selectinload(Producto.relacionados).options(
+                lazyload(Producto.relacionados),
+                lazyload(Producto.imagenes),
+                lazyload(Producto.stock_talles)
+            )
+        ]
+
+    @staticmethod
+    def get_catalog(filters: dict, page: int = 1, page_size: int = 12, view: str = 'full'):
         """
         Lógica centralizada para obtener productos con filtros complejos.
         """
+        query, sort_keys = ProductService._build_catalog_query(filters)
+        query = query.options(*ProductService._load_options(view))
+        query = query.order_by(*ProductService._order_clauses(sort_keys))
+        return query.paginate(page=page, per_page=page_size, error_out=False)
+
+    @staticmethod
+    def get_catalog_cursor(filters: dict, cursor: str = None, page_size: int = 12, incluir_total: bool = False,
+                           view: str = 'full'):
+        """
+        Paginación por cursor (keyset) del catálogo: mismos filtros y orden que get_catalog,
+        pero sin OFFSET. El cursor codifica la tupla de claves de orden del último item.
+        Retorna (items, next_cursor, total). total es None salvo que se pida explícitamente.
+        """
+        query, sort_keys = ProductService._build_catalog_query(filters)
+        orden = filters.get('ordenar_por', 'nuevo')
+
+        total = query.order_by(None).count() if incluir_total else None
+
+        if cursor:
+            valores = ProductService._decode_cursor(cursor, orden, len(sort_keys))
+            query = query.filter(ProductService._keyset_condition(sort_keys, valores))
+
+        query = query.options(*ProductService._load_options(view))
+        # Traer las claves de orden junto al producto para armar el siguiente cursor
+        query = query.add_columns(*[expr for expr, _ in sort_keys])
+        query = query.order_by(*ProductService._order_clauses(sort_keys))
+        rows = query.limit(page_size + 1).all()
+
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = ProductService._encode_cursor(orden, list(rows[-1][1:]))
+
+        return [row[0] for row in rows], next_cursor, total
+
+    @staticmethod
+    def get_facets(filters: dict, rangos_precio=None):
+        """
+        Conteos por categoría, versión, banda de precio y estado de stock para los mismos
+        filtros que get_catalog, con dos queries agrupadas (una para la banda de precio y otra
+        con precio_min/precio_max aplicados para el resto). Cada faceta se cuenta con todos los
+        filtros salvo el suyo (para poder cambiar de valor dentro de la faceta).
+        """
+        rangos_precio = sorted(rangos_precio or RANGOS_PRECIO_DEFAULT)
+        base = {k: v for k, v in filters.items() if k not in _FILTROS_FACETA}
+        query, _ = ProductService._build_catalog_query(base)
+        query = query.order_by(None)
+        claves = (Producto.categoria_id, Producto.version, Producto.estado_stock)
+
+        # Banda de precio calculada en SQL: una fila por combinación de valores de faceta
+        banda = case(
+            *[(Producto.precio_base >= desde, i) for i, desde in reversed(list(enumerate(rangos_precio)))],
+            else_=None
+        ).label('banda')
+        filas_precio = query.with_entities(*claves, banda, func.count(Producto.id)).group_by(*claves, banda).all()
+
+        # Resto de las facetas: el rango de precio pedido va en el WHERE
+        filtros_precio = {k: filters[k] for k in ('precio_min', 'precio_max') if filters.get(k)}
+        if filtros_precio:
+            query, _ = ProductService._build_catalog_query({**base, **filtros_precio})
+            query = query.order_by(None)
+        filas = query.with_entities(*claves, func.count(Producto.id)).group_by(*claves).all()
+
+        grafo = CategoryService.get_graph()
+        categoria_id = filters.get('categoria_id')
+        cat_ids = grafo.descendientes(int(categoria_id)) if categoria_id else None
+        version = filters.get('version') or None
+        # Un estado_stock desconocido no filtra (igual que en _build_catalog_query)
+        estado = _ESTADOS_FACETA.get(filters.get('estado_stock'))
+
+        def pasa(cat, ver, est, excepto):
+            if excepto != 'categoria' and cat_ids is not None and cat not in cat_ids:
+                return False
+            if excepto != 'version' and version is not None and ver != version:
+                return False
+            if excepto != 'estado' and estado is not None and est != estado:
+                return False
+            return True
+
+        # Categorías: cada producto cuenta en su categoría y en todos sus ancestros
+        por_categoria = {}
+        por_version = {}
+        por_estado = {clave: 0 for clave in _ESTADOS_FACETA}
+        por_rango = [0] * len(rangos_precio)
+        total = 0
+        estado_a_clave = {v: k for k, v in _ESTADOS_FACETA.items()}
+
+        for cat, ver, est, cantidad in filas:
+            if pasa(cat, ver, est, None):
+                total += cantidad
+            if pasa(cat, ver, est, 'categoria') and cat is not None:
+                for c in (cat,) + grafo.ancestros(cat):
+                    por_categoria[c] = por_categoria.get(c, 0) + cantidad
+            if pasa(cat, ver, est, 'version') and ver:
+                por_version[ver] = por_version.get(ver, 0) + cantidad
+            if pasa(cat, ver, est, 'estado') and est in estado_a_clave:
+                por_estado[estado_a_clave[est]] += cantidad
+
+        for cat, ver, est, i, cantidad in filas_precio:
+            if i is not None and pasa(cat, ver, est, None):
+                por_rango[i] += cantidad
+
+        return {
+            'total': total,
+            'categorias': [
+                {'id': c, 'nombre': grafo.nombre(c), 'categoria_padre_id': grafo.padre(c), 'count': n}
+                for c, n in sorted(por_categoria.items()) if grafo.contiene(c)
+            ],
+            'versiones': [{'valor': v, 'count': n} for v, n in sorted(por_version.items())],
+            'precios': [
+                {
+                    'desde': desde,
+                    'hasta': rangos_precio[i + 1] if i + 1 < len(rangos_precio) else None,
+                    'count': por_rango[i]
+                }
+                for i, desde in enumerate(rangos_precio)
+            ],
+            'estado_stock': por_estado
+        }
+
+    @staticmethod
+    def _order_clauses(sort_keys):
+        return [expr.asc() if direction == 'asc' else expr.desc() for expr, direction in sort_keys]
+
+    @staticmethod
+    def _keyset_condition(sort_keys, valores):
+        """(k1, k2, ...) "después de" (v1, v2, ...) respetando la dirección de cada clave"""
+        condiciones = []
+        for i, (expr, direction) in enumerate(sort_keys):
+            iguales = [sort_keys[j][0] == valores[j] for j in range(i)]
+            siguiente = expr > valores[i] if direction == 'asc' else expr < valores[i]
+            condiciones.append(and_(*iguales, siguiente))
+        return or_(*condiciones)
+
+    @staticmethod
+    def _encode_cursor(orden: str, valores: list) -> str:
+        serializados = [{'dt': v.isoformat()} if isinstance(v, datetime) else v for v in valores]
+        raw = json.dumps({'o': orden, 'k': serializados}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def _decode_cursor(cursor: str, orden: str, n_claves: int) -> list:
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            data = json.loads(base64.urlsafe_b64decode(cursor + padding).decode())
+            valores = [
+                datetime.fromisoformat(v['dt']) if isinstance(v, dict) else v
+                for v in data['k']
+            ]
+        except Exception:
+            raise ValueError('Cursor inválido')
+        if data.get('o') != orden or len(valores) != n_claves:
+            raise ValueError('El cursor no corresponde al orden solicitado')
+        return valores
+
+    @staticmethod
+    def _build_catalog_query(filters: dict):
+        """
+        Construye la query filtrada del catálogo y su lista de claves de orden
+        [(expresion, 'asc'|'desc'), ...]. La última clave siempre es Producto.id (desempate).
+        """
         query = Producto.query
         
         # Filtro de activos por defecto
@@ -15,24 +256,24 @@ class ProductService:
             query = query.filter_by(activo=True)
             
         # Búsqueda textual
+        # Usa el índice full-text (FTS5 / tsvector) si está disponible; si no, ILIKE
         busqueda = filters.get('busqueda')
-        if busqueda:
+        busqueda_fts = SearchService.build_search(busqueda) if busqueda else None
+        if busqueda_fts:
+            aplicar_busqueda, _, _ = busqueda_fts
+            query = aplicar_busqueda(query)
+        elif busqueda:
             search_term = f"%{busqueda}%"
             query = query.filter(or_(
                 Producto.nombre.ilike(search_term),
                 Producto.descripcion.ilike(search_term)
             ))
             
-        # Categorías (Recursivo)
+        # Categorías (incluye todas las subcategorías, resueltas desde el grafo en memoria)
         categoria_id = filters.get('categoria_id')
         if categoria_id:
-            def get_cat_ids(cat_id):
-                ids = [int(cat_id)]
-                subs = Categoria.query.filter_by(categoria_padre_id=cat_id).all()
-                for s in subs:
-                    ids.extend(get_cat_ids(s.id))
-                return ids
-            query = query.filter(Producto.categoria_id.in_(get_cat_ids(categoria_id)))
+            cat_ids = CategoryService.get_graph().descendientes(int(categoria_id))
+            query = query.filter(Producto.categoria_id.in_(sorted(cat_ids)))
             
         # Otros filtros...
         if filters.get('destacados') == 'true':
@@ -40,157 +281,118 @@ class ProductService:
         
         # Filtro de ofertas: productos con precio_descuento O con promociones activas
         if filters.get('ofertas') == 'true':
-            from datetime import datetime
-            from models import PromocionProducto, promocion_productos_link, promocion_categorias_link
-            ahora = datetime.utcnow()
-            
-            # Opción 1: Productos con precio_descuento
-            tiene_descuento = (
-                (Producto.precio_descuento.isnot(None)) &
-                (Producto.precio_descuento > 0)
-            )
-            
-            # Opción 2: Productos con promociones activas (directas)
-            tiene_promo_directa = Producto.id.in_(
-                db.session.query(promocion_productos_link.c.producto_id).join(
-                    PromocionProducto,
-                    PromocionProducto.id == promocion_productos_link.c.promocion_id
-                ).filter(
-                    PromocionProducto.activa == True,
-                    PromocionProducto.fecha_inicio <= ahora,
-                    PromocionProducto.fecha_fin >= ahora
-                )
-            )
-            
-            # Opción 3: Productos cuya categoría tiene promociones activas
-            tiene_promo_categoria = Producto.categoria_id.in_(
-                db.session.query(promocion_categorias_link.c.categoria_id).join(
-                    PromocionProducto,
-                    PromocionProducto.id == promocion_categorias_link.c.promocion_id
-                ).filter(
-                    PromocionProducto.activa == True,
-                    PromocionProducto.fecha_inicio <= ahora,
-                    PromocionProducto.fecha_fin >= ahora
-                )
-            )
-            
-            # Combinar todas las condiciones con OR
-            query = query.filter(or_(tiene_descuento, tiene_promo_directa, tiene_promo_categoria))
+            query = query.filter(ProductService._es_oferta())
             
         if filters.get('precio_min'):
             query = query.filter(Producto.precio_base >= float(filters['precio_min']))
         if filters.get('precio_max'):
             query = query.filter(Producto.precio_base <= float(filters['precio_max']))
 
-        # Filtro de estado de stock
+        # Filtro de estado de stock (usa el resumen desnormalizado en productos.estado_stock)
         estado_stock = filters.get('estado_stock')
         if estado_stock:
             if estado_stock == 'disponible':
                 # Productos con stock >= 4 en al menos un talle
-                query = query.join(StockTalle).filter(StockTalle.cantidad >= 4).distinct()
+                query = query.filter(Producto.estado_stock == 'disponible')
             elif estado_stock == 'bajo':
                 # Productos con stock entre 1 y 3 (y sin stock >= 4)
-                productos_stock_alto = db.session.query(StockTalle.producto_id).filter(
-                    StockTalle.cantidad >= 4
-                ).distinct()
-                query = query.join(StockTalle).filter(
-                    StockTalle.cantidad.between(1, 3),
-                    ~Producto.id.in_(productos_stock_alto)
-                ).distinct()
+                query = query.filter(Producto.estado_stock == 'bajo')
             elif estado_stock == 'no_disponible':
                 # Productos donde TODO el stock es 0
-                productos_con_stock = db.session.query(StockTalle.producto_id).filter(
-                    StockTalle.cantidad > 0
-                ).distinct()
-                query = query.filter(~Producto.id.in_(productos_con_stock))
+                query = query.filter(Producto.estado_stock == 'agotado')
 
         # Filtro de versión
         if filters.get('version'):
             query = query.filter(Producto.version == filters['version'])
 
         # Ordenamiento GLOBAL: Agotados siempre al final (Strict)
-        # Estrategia: Obtener IDs de productos con stock > 0
-        productos_con_stock_query = db.session.query(StockTalle.producto_id).filter(
-            StockTalle.cantidad > 0
-        ).distinct()
-        
-        # This creates a CASE expression: CASE WHEN id IN (...) THEN 1 ELSE 2 END
+        # El estado viene del resumen de stock por producto, sin subconsultas sobre stock_talles
         stock_priority = case(
-            (Producto.id.in_(productos_con_stock_query), 1),
-            else_=2
+            (Producto.estado_stock == 'agotado', 2),
+            else_=1
         )
         
-        query = query.order_by(stock_priority.asc())
+        sort_keys = [(stock_priority, 'asc')]
+        fecha_orden = func.coalesce(Producto.created_at, _FECHA_ORDEN_DEFAULT)
 
         # Ordenamiento secundario (usuario)
         orden = filters.get('ordenar_por', 'nuevo')
         
         # Si hay búsqueda, priorizar por relevancia
         if busqueda and orden == 'nuevo':
-            search_term = f"%{busqueda}%"
-            query = query.order_by(
-                case(
-                    (Producto.nombre.ilike(search_term), 1),
-                    (Producto.descripcion.ilike(search_term), 2),
-                    else_=3
-                ).asc(),
-                Producto.created_at.desc()
-            )
+            if busqueda_fts:
+                # Ranking calculado por el índice (bm25 / ts_rank_cd)
+                _, rank_expr, rank_direction = busqueda_fts
+                if rank_expr is not None:
+                    sort_keys.append((rank_expr, rank_direction))
+            else:
+                search_term = f"%{busqueda}%"
+                sort_keys.append((
+                    case(
+                        (Producto.nombre.ilike(search_term), 1),
+                        (Producto.descripcion.ilike(search_term), 2),
+                        else_=3
+                    ),
+                    'asc'
+                ))
+            sort_keys.append((fecha_orden, 'desc'))
         elif orden == 'precio_asc':
-            query = query.order_by(Producto.precio_base.asc())
+            sort_keys.append((Producto.precio_base, 'asc'))
         elif orden == 'precio_desc':
-            query = query.order_by(Producto.precio_base.desc())
+            sort_keys.append((Producto.precio_base, 'desc'))
         elif orden == 'nombre_asc':
-            query = query.order_by(Producto.nombre.asc())
+            sort_keys.append((Producto.nombre, 'asc'))
         elif orden == 'nombre_desc':
-            query = query.order_by(Producto.nombre.desc())
+            sort_keys.append((Producto.nombre, 'desc'))
         elif orden == 'destacado':
             # Implementamos el orden de prioridad: 1. Destacados, 2. Ofertas, 3. Otros
-            # Definimos qué es una "oferta" para el ordenamiento (misma lógica que el filtro de ofertas)
-            from datetime import datetime
-            from models import PromocionProducto, promocion_productos_link, promocion_categorias_link
-            ahora = datetime.utcnow()
-            
-            # Opción 1: Productos con precio_descuento
-            tiene_descuento = (Producto.precio_descuento > 0)
-            
-            # Opción 2: Productos con promociones activas (directas)
-            tiene_promo_directa = Producto.id.in_(
-                db.session.query(promocion_productos_link.c.producto_id).join(
-                    PromocionProducto, PromocionProducto.id == promocion_productos_link.c.promocion_id
-                ).filter(
-                    PromocionProducto.activa == True,
-                    PromocionProducto.fecha_inicio <= ahora,
-                    PromocionProducto.fecha_fin >= ahora
-                )
-            )
-            
-            # Opción 3: Productos con promociones por categoría
-            tiene_promo_categoria = Producto.categoria_id.in_(
-                db.session.query(promocion_categorias_link.c.categoria_id).join(
-                    PromocionProducto, PromocionProducto.id == promocion_categorias_link.c.promocion_id
-                ).filter(
-                    PromocionProducto.activa == True,
-                    PromocionProducto.fecha_inicio <= ahora,
-                    PromocionProducto.fecha_fin >= ahora
-                )
-            )
-
-            is_offer = or_(tiene_descuento, tiene_promo_directa, tiene_promo_categoria)
+            # (misma definición de "oferta" que el filtro de ofertas)
+            is_offer = ProductService._es_oferta()
 
-            query = query.order_by(
+            sort_keys.append((
                 case(
                     (Producto.destacado == True, 1),
                     (is_offer, 2),
                     else_=3
-                ).asc(),
-                Producto.created_at.desc()
-            )
+                ),
+                'asc'
+            ))
+            sort_keys.append((fecha_orden, 'desc'))
         else:
-            query = query.order_by(Producto.created_at.desc())
+            sort_keys.append((fecha_orden, 'desc'))
+
+        # Desempate estable (necesario para que el cursor no repita ni saltee productos)
+        sort_keys.append((Producto.id, 'desc'))
             
-        return query.paginate(page=page, per_page=page_size, error_out=False)
+        return query, sort_keys
+
+
+    @staticmethod
+    def _es_oferta():
+        """
+        Condición de "oferta": precio_descuento > 0 o promoción activa directa / por categoría.
+        Los IDs salen del índice de promociones en memoria (sin subconsultas sobre promociones).
+        """
+        index = PromotionService.get_index()
+        return or_(
+            Producto.precio_descuento > 0,
+            Producto.id.in_(sorted(index.por_producto)),
+            Producto.categoria_id.in_(sorted(index.por_categoria))
+        )
 
+    @staticmethod
+    def get_batch(ids, solo_activos: bool = True, view: str = 'full'):
+        """
+        Carga varios productos en una sola query (imágenes, stock y relacionados por selectin,
+        promociones y categorías desde los índices en memoria). Retorna {id: Producto}.
+        """
+        ids = list(dict.fromkeys(int(i) for i in ids))
+        if not ids:
+            return {}
+        query = Producto.query.options(*ProductService._load_options(view)).filter(Producto.id.in_(ids))
+        if solo_activos:
+            query = query.filter(Producto.activo == True)
+        return {p.id: p for p in query.all()}
 
     @staticmethod
     def get_by_id(product_id: int):
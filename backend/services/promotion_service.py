@@ -0,0 +1,161 @@
+from flask import g, has_request_context
+from cache_utils import cache
+from models import db, PromocionProducto, Producto, Categoria, promocion_productos_link, promocion_categorias_link
+from sqlalchemy.orm import joinedload
+from datetime import datetime
+from threading import Lock
+import hashlib
+import json
+import time
+
+# Antigüedad máxima del índice (red de seguridad si el bus de invalidación falla)
+PROMOTION_INDEX_MAX_AGE = 300
+# Namespace del caché cuya generación versiona el índice: invalidate() la incrementa y el
+# backend compartido o el bus la hace llegar a todos los workers
+PROMOTION_INDEX_NAMESPACE = 'indice_promociones'
+
+# Campos de la promoción que viajan en la vista compacta (tarjetas de listado)
+CAMPOS_PROMO_CARD = (
+    'id', 'alcance', 'tipo_promocion_nombre', 'valor', 'fecha_fin',
+    'es_cupon', 'envio_gratis', 'compra_minima'
+)
+
+class PromotionIndex:
+    """
+    Snapshot de las promociones vigentes, ya serializadas, indexadas por producto,
+    por categoría y globales (alcance 'tienda'). Vale hasta el próximo cambio de
+    vigencia (fecha_inicio de una promo futura o fecha_fin de una vigente).
+    Los dicts devueltos son compartidos: no modificarlos.
+    """
+    def __init__(self, promos, productos_por_promo, categorias_por_promo, ahora):
+        self.generado = ahora
+        self.por_producto = {}
+        self.por_categoria = {}
+        self.globales = []
+        self.promos = {}
+        self.promos_card = {}
+
+        proximo_cambio = None
+        for promo in promos:
+            if promo.fecha_inicio > ahora:
+                # Todavía no empezó: sólo define cuándo hay que reconstruir
+                proximo_cambio = promo.fecha_inicio if proximo_cambio is None else min(proximo_cambio, promo.fecha_inicio)
+                continue
+            proximo_cambio = promo.fecha_fin if proximo_cambio is None else min(proximo_cambio, promo.fecha_fin)
+
+            productos = productos_por_promo.get(promo.id, [])
+            categorias = categorias_por_promo.get(promo.id, [])
+            data = promo.to_dict(productos=productos, categorias=categorias)
+            self.promos[promo.id] = data
+            self.promos_card[promo.id] = {k: data[k] for k in CAMPOS_PROMO_CARD}
+
+            for producto_id, _ in productos:
+                self.por_producto.setdefault(producto_id, []).append(data)
+            for categoria_id, _ in categorias:
+                self.por_categoria.setdefault(categoria_id, []).append(data)
+            if promo.alcance == 'tienda':
+                self.globales.append(data)
+
+        self.valido_hasta = proximo_cambio
+        # Sello del contenido (igual en todos los workers para los mismos datos): ETag de las promociones
+        self.version = hashlib.md5(
+            json.dumps(sorted(self.promos.items()), sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def vigente(self, ahora):
+        return self.valido_hasta is None or ahora < self.valido_hasta
+
+    def para_producto(self, producto_id, categoria_id):
+        """Promociones activas de un producto: directas, por su categoría y globales (sin duplicados)"""
+        directas = self.por_producto.get(producto_id, ())
+        de_categoria = self.por_categoria.get(categoria_id, ())
+        if not de_categoria and not self.globales:
+            return list(directas)
+
+        vistas = set()
+        resultado = []
+        for data in (*directas, *de_categoria, *self.globales):
+            if data['id'] not in vistas:
+                vistas.add(data['id'])
+                resultado.append(data)
+        return resultado
+
+    def para_producto_card(self, producto_id, categoria_id):
+        """Igual que para_producto, con la versión compacta de cada promoción"""
+        return [self.promos_card[data['id']] for data in self.para_producto(producto_id, categoria_id)]
+
+
+class PromotionService:
+    _index = None
+    _built_at = 0
+    _lock = Lock()
+
+    @staticmethod
+    def get_index():
+        """
+        Índice de promociones vigente (se reconstruye al vencer o tras una invalidación).
+        Se valida contra la generación compartida una vez por request; dentro de la request
+        se reutiliza.
+        """
+        if has_request_context() and 'indice_promociones' in g:
+            return g.indice_promociones
+        index = PromotionService._index
+        if (index is None
+                or not index.vigente(datetime.utcnow())
+                or time.time() - PromotionService._built_at > PROMOTION_INDEX_MAX_AGE
+                or index.generacion != cache.generation(PROMOTION_INDEX_NAMESPACE)):
+            index = PromotionService.rebuild()
+        if has_request_context():
+            g.indice_promociones = index
+        return index
+
+    @staticmethod
+    def rebuild():
+        """Carga todas las promociones vigentes o futuras y sus vínculos en 3 queries"""
+        with PromotionService._lock, db.session.no_autoflush:
+            # Leer la generación antes que las filas: una invalidación concurrente fuerza otro rebuild
+            generacion = cache.generation(PROMOTION_INDEX_NAMESPACE)
+            ahora = datetime.utcnow()
+            promos = PromocionProducto.query.options(
+                joinedload(PromocionProducto.tipo_promocion)
+            ).filter(
+                PromocionProducto.activa == True,
+                PromocionProducto.fecha_fin >= ahora
+            ).all()
+
+            ids = [p.id for p in promos]
+            productos_por_promo = {}
+            categorias_por_promo = {}
+            if ids:
+                filas = db.session.query(
+                    promocion_productos_link.c.promocion_id, Producto.id, Producto.nombre
+                ).join(
+                    Producto, Producto.id == promocion_productos_link.c.producto_id
+                ).filter(promocion_productos_link.c.promocion_id.in_(ids)).all()
+                for promo_id, producto_id, nombre in filas:
+                    productos_por_promo.setdefault(promo_id, []).append((producto_id, nombre))
+
+                filas = db.session.query(
+                    promocion_categorias_link.c.promocion_id, Categoria.id, Categoria.nombre
+                ).join(
+                    Categoria, Categoria.id == promocion_categorias_link.c.categoria_id
+                ).filter(promocion_categorias_link.c.promocion_id.in_(ids)).all()
+                for promo_id, categoria_id, nombre in filas:
+                    categorias_por_promo.setdefault(promo_id, []).append((categoria_id, nombre))
+
+            index = PromotionIndex(promos, productos_por_promo, categorias_por_promo, ahora)
+            index.generacion = generacion
+            PromotionService._index = index
+            PromotionService._built_at = time.time()
+            return index
+
+    @staticmethod
+    def invalidate():
+        """
+        Descarta el índice en todos los workers: el próximo acceso lo reconstruye.
+        Llamar después del commit y antes de invalidar las páginas que dependen del índice.
+        """
+        PromotionService._index = None
+        cache.bump(PROMOTION_INDEX_NAMESPACE)
+        if has_request_context():
+            g.pop('indice_promociones', None)
@@ -0,0 +1,161 @@
+from models import db, Producto
+from sqlalchemy import text, literal_column, func, select, table, column
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Máximo de términos que se envían al índice (evita queries gigantes desde el buscador)
+MAX_TERMINOS = 8
+
+class SearchService:
+    """
+    Índice full-text del catálogo (nombre + descripción de productos).
+    - SQLite: tabla virtual FTS5 'productos_fts' con tokenizer unicode61 sin acentos,
+      sincronizada con triggers sobre 'productos'.
+    - PostgreSQL: columna generada 'search_vector' (tsvector, configuración 'spanish'
+      sin acentos) con índice GIN.
+    Si el índice no pudo crearse, get_catalog vuelve a la búsqueda con ILIKE.
+    El índice matchea palabras por prefijo ("cami" encuentra "camiseta" pero "seta" no):
+    si no devuelve ningún producto se busca por substring con ILIKE, como antes del índice.
+    """
+    _motor = None  # 'sqlite' | 'postgresql' | None (sin índice)
+
+    @staticmethod
+    def ensure_index():
+        """Crea el índice (si no existe) para el motor de base de datos actual"""
+        dialect = db.engine.dialect.name
+        try:
+            if dialect == 'sqlite':
+                SearchService._ensure_sqlite()
+            elif dialect == 'postgresql':
+                SearchService._ensure_postgres()
+            else:
+                SearchService._motor = None
+                return
+            db.session.commit()
+            SearchService._motor = dialect
+            print(f"✓ Índice de búsqueda full-text listo ({dialect})")
+        except Exception as e:
+            db.session.rollback()
+            SearchService._motor = None
+            logger.warning(f"Índice full-text no disponible, se usará ILIKE: {e}")
+
+    @staticmethod
+    def _ensure_sqlite():
+        existe = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'productos_fts'"
+        )).first()
+
+        db.session.execute(text("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS productos_fts USING fts5(
+                nombre, descripcion,
+                content='productos', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS productos_fts_ai AFTER INSERT ON productos BEGIN
+                INSERT INTO productos_fts(rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion);
+            END
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS productos_fts_ad AFTER DELETE ON productos BEGIN
+                INSERT INTO productos_fts(productos_fts, rowid, nombre, descripcion) VALUES ('delete', old.id, old.nombre, old.descripcion);
+            END
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS productos_fts_au AFTER UPDATE OF nombre, descripcion ON productos BEGIN
+                INSERT INTO productos_fts(productos_fts, rowid, nombre, descripcion) VALUES ('delete', old.id, old.nombre, old.descripcion);
+                INSERT INTO productos_fts(rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion);
+            END
+        """))
+
+        if not existe:
+            # Primera vez: indexar productos existentes y dar más peso al nombre en el ranking
+            db.session.execute(text("INSERT INTO productos_fts(productos_fts) VALUES ('rebuild')"))
+            db.session.execute(text("INSERT INTO productos_fts(productos_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')"))
+
+    @staticmethod
+    def _ensure_postgres():
+        # unaccent() no es IMMUTABLE, así que se envuelve para poder usarlo en la columna generada.
+        # Si la extensión no está disponible se usa translate() con los acentos del español.
+        try:
+            with db.session.begin_nested():
+                db.session.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+            cuerpo = "SELECT public.unaccent('public.unaccent', $1)"
+        except Exception as e:
+            logger.warning(f"Extensión unaccent no disponible, usando translate(): {e}")
+            cuerpo = "SELECT translate($1, 'áéíóúüñÁÉÍÓÚÜÑ', 'aeiouunAEIOUUN')"
+
+        db.session.execute(text(f"""
+            CREATE OR REPLACE FUNCTION ev_unaccent(text) RETURNS text
+            AS $$ {cuerpo} $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+        """))
+        db.session.execute(text("""
+            ALTER TABLE productos ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('spanish', ev_unaccent(coalesce(nombre, ''))), 'A') ||
+                setweight(to_tsvector('spanish', ev_unaccent(coalesce(descripcion, ''))), 'B')
+            ) STORED
+        """))
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_producto_search_vector ON productos USING GIN (search_vector)"
+        ))
+
+    @staticmethod
+    def disponible():
+        return SearchService._motor is not None
+
+    @staticmethod
+    def _terminos(busqueda: str):
+        return re.findall(r'\w+', (busqueda or '').lower())[:MAX_TERMINOS]
+
+    @staticmethod
+    def _hay_resultados(stmt) -> bool:
+        """True si el índice tiene al menos una coincidencia (sin el resto de los filtros)"""
+        return db.session.execute(stmt.limit(1)).first() is not None
+
+    @staticmethod
+    def build_search(busqueda: str):
+        """
+        Retorna (query_transform, rank_expr, direction) para aplicar la búsqueda sobre
+        Producto.query, o None si el índice no está disponible o no tiene ningún producto
+        que coincida (el llamador busca entonces por substring con ILIKE).
+        Todos los términos deben aparecer (AND) y cada uno matchea por prefijo.
+        """
+        if not SearchService.disponible():
+            return None
+
+        terminos = SearchService._terminos(busqueda)
+        if not terminos:
+            # Sin términos buscables (solo signos): no hay coincidencias
+            return (lambda query: query.filter(db.false())), None, 'asc'
+
+        if SearchService._motor == 'sqlite':
+            fts_query = ' '.join(f'"{t}"*' for t in terminos)
+            fts = table('productos_fts', column('rowid'), column('rank'))
+            resultados = select(
+                fts.c.rowid.label('producto_id'),
+                fts.c.rank.label('rank')
+            ).where(literal_column('productos_fts').op('MATCH')(fts_query)).subquery('busqueda_fts')
+            if not SearchService._hay_resultados(select(resultados.c.producto_id)):
+                return None
+
+            def aplicar(query):
+                return query.join(resultados, resultados.c.producto_id == Producto.id)
+
+            # bm25: más negativo = más relevante
+            return aplicar, resultados.c.rank, 'asc'
+
+        # PostgreSQL
+        ts_query = func.to_tsquery('spanish', func.ev_unaccent(' & '.join(f'{t}:*' for t in terminos)))
+        search_vector = literal_column('productos.search_vector')
+        rank = func.ts_rank_cd(search_vector, ts_query)
+        if not SearchService._hay_resultados(select(Producto.id).where(search_vector.op('@@')(ts_query))):
+            return None
+
+        def aplicar(query):
+            return query.filter(search_vector.op('@@')(ts_query))
+
+        return aplicar, rank, 'desc'
@@ -112,8 +112,8 @@ class ShippingService:
                         print(f"DEBUG SHIPPING: Item {p_id} ({prod_db.nombre}) Base Price ${price} x {qty} = ${item_total} (Subtotal: {total_cart_value})", flush=True)
                         
                         # Verificar si tiene promo de envío gratis activa
-                        promos = prod_db.get_promociones_activas()
-                        has_free = any(p.envio_gratis for p in promos)
+                        promos = prod_db.get_promociones_activas_dict()
+                        has_free = any(p['envio_gratis'] for p in promos)
                         if not has_free:
                             all_items_free_shipping = False
                     else:
@@ -0,0 +1,188 @@
+from models import (db, Producto, Talle, StockTalle, actualizar_resumen_stock, cambios_estado_stock,
+                    _RESUMEN_STOCK_ATTRS)
+
+
+class StockInsuficiente(Exception):
+    """
+    Alguna línea no tenía stock al momento del UPDATE. faltantes: [{producto_id, talle_id,
+    producto_nombre, talle_nombre, solicitado, disponible}]. Quien la captura debe hacer rollback:
+    las líneas que sí se descontaron quedan en la transacción.
+    """
+    def __init__(self, faltantes):
+        self.faltantes = faltantes
+        primero = faltantes[0]
+        super().__init__(
+            f"Stock insuficiente para {primero['producto_nombre']} talle {primero['talle_nombre']}. "
+            f"Disponible: {primero['disponible']}"
+        )
+
+
+class StockService:
+    """
+    Movimientos de stock atómicos. Cada operación descuenta todas las líneas con un único
+    UPDATE condicional (cantidad = cantidad - n WHERE cantidad >= n) y compara las filas
+    afectadas con las pedidas, así dos aprobaciones o una aprobación y una venta externa
+    simultáneas no pueden vender la misma unidad. No hace commit: queda en la transacción
+    de db.session junto con el resto de los cambios del pedido o la venta.
+
+    Como son UPDATE directos (sin el flush del ORM) recalculan el resumen de stock de los
+    productos y registran sus cambios de estado para CatalogCacheService.invalidar_stock().
+    """
+    @staticmethod
+    def descontar(lineas, contar_ventas: bool = True) -> set:
+        """
+        lineas: iterable de (producto_id, talle_id, cantidad). Descuenta el stock (líneas
+        repetidas se suman) y, con contar_ventas, suma las unidades a Producto.ventas_count.
+        Lanza StockInsuficiente si alguna línea no alcanza. Retorna los producto_ids afectados.
+        """
+        por_par = StockService._agrupar(lineas)
+        if not por_par:
+            return set()
+        registros = StockService._registros(por_par)
+
+        faltan = [par for par in por_par if par not in registros]
+        if not faltan:
+            stock_t = StockTalle.__table__
+            por_id = {registros[par]: cantidad for par, cantidad in por_par.items()}
+            a_descontar = db.case(por_id, value=stock_t.c.id)
+            descontados = set(db.session.execute(
+                stock_t.update()
+                .where(stock_t.c.id.in_(list(por_id)), stock_t.c.cantidad >= a_descontar)
+                .values(cantidad=stock_t.c.cantidad - a_descontar)
+                .returning(stock_t.c.id)
+            ).scalars())
+            faltan = [par for par in por_par if registros[par] not in descontados]
+        if faltan:
+            raise StockInsuficiente(StockService._faltantes(faltan, por_par, registros))
+
+        ventas = {}
+        for (producto_id, _), cantidad in por_par.items():
+            ventas[producto_id] = ventas.get(producto_id, 0) + cantidad
+        if contar_ventas:
+            StockService._sumar_ventas(ventas)
+        StockService._despues_de_mover(ventas.keys(), registros.values())
+        return set(ventas)
+
+    @staticmethod
+    def reponer(lineas, descontar_ventas: bool = True) -> set:
+        """
+        Devuelve unidades al stock (anulación de una venta). Las líneas sin registro de stock
+        se ignoran; con descontar_ventas resta las unidades de ventas_count (sin bajar de 0).
+        Retorna los producto_ids afectados.
+        """
+        por_par = StockService._agrupar(lineas)
+        registros = StockService._registros(por_par)
+        if registros:
+            stock_t = StockTalle.__table__
+            por_id = {registros[par]: cantidad for par, cantidad in por_par.items() if par in registros}
+            db.session.execute(
+                stock_t.update()
+                .where(stock_t.c.id.in_(list(por_id)))
+                .values(cantidad=stock_t.c.cantidad + db.case(por_id, value=stock_t.c.id))
+            )
+
+        ventas = {}
+        for (producto_id, _), cantidad in por_par.items():
+            ventas[producto_id] = ventas.get(producto_id, 0) - cantidad
+        if descontar_ventas and ventas:
+            StockService._sumar_ventas(ventas)
+        StockService._despues_de_mover(ventas.keys(), registros.values())
+        return set(ventas)
+
+    @staticmethod
+    def _agrupar(lineas) -> dict:
+        """{(producto_id, talle_id): cantidad total}"""
+        por_par = {}
+        for producto_id, talle_id, cantidad in lineas:
+            if cantidad and cantidad > 0:
+                par = (int(producto_id), int(talle_id))
+                por_par[par] = por_par.get(par, 0) + int(cantidad)
+        return por_par
+
+    @staticmethod
+    def disponibles(pares) -> dict:
+        """
+        {(producto_id, talle_id): cantidad} del registro de stock que mueven descontar y
+        reponer, para muchos pares en una query (validación previa de lotes). Los pares sin
+        registro no aparecen.
+        """
+        return {par: cantidad for par, (_, cantidad) in StockService._filas(set(pares)).items()}
+
+    @staticmethod
+    def _registros(por_par) -> dict:
+        """{(producto_id, talle_id): id del registro de stock}"""
+        return {par: stock_id for par, (stock_id, _) in StockService._filas(por_par).items()}
+
+    @staticmethod
+    def _filas(pares) -> dict:
+        """
+        {(producto_id, talle_id): (id, cantidad)} en una query. Si hay varios registros para el
+        par (uno por color) se usa el primero, como en el checkout.
+        """
+        if not pares:
+            return {}
+        stock_t = StockTalle.__table__
+        filas = db.session.execute(
+            db.select(stock_t.c.id, stock_t.c.producto_id, stock_t.c.talle_id, stock_t.c.cantidad)
+            .where(
+                stock_t.c.producto_id.in_(list({p for p, _ in pares})),
+                stock_t.c.talle_id.in_(list({t for _, t in pares}))
+            )
+            .order_by(stock_t.c.id)
+        ).all()
+        resultado = {}
+        for stock_id, producto_id, talle_id, cantidad in filas:
+            if (producto_id, talle_id) in pares:
+                resultado.setdefault((producto_id, talle_id), (stock_id, cantidad))
+        return resultado
+
+    @staticmethod
+    def _faltantes(pares, por_par, registros) -> list:
+        """Detalle de las líneas sin stock (solo en el camino de error)"""
+        stock_ids = [registros[par] for par in pares if par in registros]
+        disponibles = dict(db.session.execute(
+            db.select(StockTalle.id, StockTalle.cantidad).where(StockTalle.id.in_(stock_ids))
+        ).all()) if stock_ids else {}
+        nombres_producto = dict(db.session.execute(
+            db.select(Producto.id, Producto.nombre).where(Producto.id.in_(list({p for p, _ in pares})))
+        ).all())
+        nombres_talle = dict(db.session.execute(
+            db.select(Talle.id, Talle.nombre).where(Talle.id.in_(list({t for _, t in pares})))
+        ).all())
+        return [{
+            'producto_id': producto_id,
+            'talle_id': talle_id,
+            'producto_nombre': nombres_producto.get(producto_id),
+            'talle_nombre': nombres_talle.get(talle_id),
+            'solicitado': por_par[(producto_id, talle_id)],
+            'disponible': disponibles.get(registros.get((producto_id, talle_id)), 0),
+        } for producto_id, talle_id in pares]
+
+    @staticmethod
+    def _sumar_ventas(ventas: dict):
+        """ventas_count += unidades (negativas para anular), en un UPDATE y sin bajar de 0"""
+        productos_t = Producto.__table__
+        nuevo = db.func.coalesce(productos_t.c.ventas_count, 0) + db.case(ventas, value=productos_t.c.id)
+        db.session.execute(
+            productos_t.update()
+            .where(productos_t.c.id.in_(list(ventas)))
+            .values(ventas_count=db.case((nuevo > 0, nuevo), else_=0))
+        )
+
+    @staticmethod
+    def _despues_de_mover(producto_ids, stock_ids):
+        """Resumen de stock, cambios de estado y objetos en memoria (lo que hace el listener del flush)"""
+        producto_ids = set(producto_ids)
+        if not producto_ids:
+            return
+        cambios = cambios_estado_stock(producto_ids)
+        if cambios:
+            db.session.info.setdefault('estado_stock_cambios', {}).update(cambios)
+        actualizar_resumen_stock(producto_ids)
+
+        stock_ids = set(stock_ids)
+        for obj in db.session.identity_map.values():
+            if isinstance(obj, Producto) and obj.id in producto_ids:
+                db.session.expire(obj, _RESUMEN_STOCK_ATTRS + ['ventas_count', 'updated_at'])
+            elif isinstance(obj, StockTalle) and obj.id in stock_ids:
+                db.session.expire(obj, ['cantidad', 'updated_at'])
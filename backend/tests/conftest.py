@@ -0,0 +1,82 @@
+"""
+Configuración de pytest: base SQLite temporal, sin rate limit ni calentador, y helpers
+para sembrar productos con stock.
+
+Uso (desde backend/):
+    python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+import itertools
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Antes de importar app: la base y el caché se configuran al importar
+_CARPETA = tempfile.mkdtemp(prefix='elvestuario_tests_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_CARPETA, 'test.db')}"
+os.environ['RATELIMIT_ENABLED'] = 'False'
+os.environ['CACHE_WARM_URLS'] = ''
+os.environ['CACHE_BACKEND'] = 'memory'
+os.environ['CACHE_BUS'] = 'none'
+os.environ.pop('BREVO_API_KEY', None)  # sin emails reales
+sys.path.insert(0, BACKEND)
+
+_secuencia = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app as flask_app
+    return flask_app
+
+
+@pytest.fixture
+def ctx(app):
+    """Contexto de aplicación con la sesión limpia al terminar"""
+    from models import db
+    with app.app_context():
+        yield
+        db.session.rollback()
+        db.session.remove()
+
+
+@pytest.fixture
+def crear_productos(ctx):
+    """
+    crear_productos(n, stock=..., talles=...) -> [(producto, {talle_id: StockTalle})]
+    en una categoría nueva. stock es la cantidad inicial de cada talle.
+    """
+    from models import db, Categoria, Producto, StockTalle, Talle
+
+    def crear(n=1, stock=5, talles=('S', 'M'), precio=10000):
+        sufijo = next(_secuencia)
+        talles_db = []
+        for orden, nombre in enumerate(talles):
+            talle = Talle.query.filter_by(nombre=nombre).first()
+            if not talle:
+                talle = Talle(nombre=nombre, orden=orden)
+                db.session.add(talle)
+            talles_db.append(talle)
+        categoria = Categoria(nombre=f'Test {sufijo}', slug=f'test-{sufijo}')
+        db.session.add(categoria)
+        db.session.flush()
+
+        creados = []
+        for i in range(n):
+            producto = Producto(nombre=f'Test {sufijo} #{i}', precio_base=precio,
+                                categoria_id=categoria.id, ventas_count=0)
+            db.session.add(producto)
+            db.session.flush()
+            stock_por_talle = {}
+            for talle in talles_db:
+                st = StockTalle(producto_id=producto.id, talle_id=talle.id, cantidad=stock)
+                db.session.add(st)
+                stock_por_talle[talle.id] = st
+            creados.append((producto, stock_por_talle))
+        db.session.commit()
+        return creados
+
+    return crear
@@ -0,0 +1,146 @@
+"""
+Bus de invalidación entre workers: lo publicado por una instancia del caché llega a las
+demás, incluidos los índices en memoria de promociones y categorías.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+import cache_utils
+from cache_backends import LocalBus, SQLiteBus
+from cache_utils import SimpleCache
+
+
+@pytest.fixture(params=['local', 'sqlite'])
+def crear_bus(request, tmp_path):
+    """Fábrica de buses conectados entre sí (mismo canal o mismo archivo)"""
+    if request.param == 'local':
+        canal = []
+        return lambda: LocalBus(canal)
+    ruta = str(tmp_path / 'bus.db')
+    return lambda: SQLiteBus(ruta)
+
+
+def test_tags_llegan_a_otra_instancia(crear_bus):
+    cache_a = SimpleCache(bus=crear_bus())
+    cache_b = SimpleCache(bus=crear_bus())
+    cache_b.set('productos:1', 'viejo', tags=['producto:1'])
+    cache_b.set('productos:2', 'otro', tags=['producto:2'])
+
+    cache_a.invalidate_tags(['producto:1'])
+
+    assert cache_b.get('productos:1') is None
+    assert cache_b.get('productos:2') == 'otro'
+
+
+def test_bump_delete_y_clear_llegan_a_otra_instancia(crear_bus):
+    cache_a = SimpleCache(bus=crear_bus())
+    cache_b = SimpleCache(bus=crear_bus())
+    generacion = cache_b.generation('get_talles')
+    cache_b.set('clave', 1)
+    cache_b.set('otra', 2)
+
+    cache_a.bump('get_talles')
+    assert cache_b.generation('get_talles') == generacion + 1
+
+    cache_a.delete('clave')
+    assert cache_b.get('clave') is None
+    assert cache_b.get('otra') == 2
+
+    cache_a.clear()
+    assert cache_b.get('otra') is None
+
+
+def test_eventos_propios_no_se_reaplican(crear_bus):
+    cache_a = SimpleCache(bus=crear_bus())
+    cache_a.bump('ns')
+    assert cache_a.generation('ns') == 1
+
+
+def test_on_invalidate_se_llama_al_recibir_del_bus(crear_bus, monkeypatch):
+    monkeypatch.setattr(cache_utils, '_al_invalidar', [])
+    llamadas = []
+    cache_utils.on_invalidate(lambda: llamadas.append(1))
+    cache_a = SimpleCache(bus=crear_bus())
+    cache_b = SimpleCache(bus=crear_bus())
+
+    cache_b.get('nada')
+    assert llamadas == []
+    cache_a.invalidate_tags(['promocion:1'])
+    cache_b.get('nada')
+    assert llamadas == [1]
+
+
+class Worker:
+    """Simula un worker de gunicorn: su propio caché y su propia copia de los índices en memoria"""
+    ESTADO = {
+        'PromotionService': ('_index', '_built_at'),
+        'CategoryService': ('_graph', '_built_at'),
+    }
+
+    def __init__(self, bus):
+        self.cache = SimpleCache(bus=bus)
+        self.estado = {}
+
+    @contextmanager
+    def activo(self):
+        from services import category_service, promotion_service
+        servicios = {
+            'PromotionService': (promotion_service, promotion_service.PromotionService),
+            'CategoryService': (category_service, category_service.CategoryService),
+        }
+        anterior = {}
+        for nombre, (modulo, clase) in servicios.items():
+            anterior[nombre] = (modulo.cache, {a: getattr(clase, a) for a in self.ESTADO[nombre]})
+            modulo.cache = self.cache
+            for atributo, valor in self.estado.get(nombre, {a: None if a != '_built_at' else 0
+                                                             for a in self.ESTADO[nombre]}).items():
+                setattr(clase, atributo, valor)
+        try:
+            yield
+        finally:
+            for nombre, (modulo, clase) in servicios.items():
+                self.estado[nombre] = {a: getattr(clase, a) for a in self.ESTADO[nombre]}
+                cache_previo, atributos = anterior[nombre]
+                modulo.cache = cache_previo
+                for atributo, valor in atributos.items():
+                    setattr(clase, atributo, valor)
+
+
+def test_indices_se_invalidan_en_todos_los_workers(crear_bus, crear_productos):
+    from models import db, Categoria, PromocionProducto, TipoPromocion
+    from services.category_service import CategoryService
+    from services.promotion_service import PromotionService
+
+    producto, _ = crear_productos(1)[0]
+    categoria_id = producto.categoria_id
+    worker_a, worker_b = Worker(crear_bus()), Worker(crear_bus())
+
+    with worker_b.activo():
+        grafo = CategoryService.get_graph()
+        index = PromotionService.get_index()
+        assert grafo.nombre(categoria_id) != 'Renombrada'
+        assert index.para_producto(producto.id, categoria_id) == []
+        # Sin invalidaciones el worker reutiliza sus índices
+        assert CategoryService.get_graph() is grafo
+        assert PromotionService.get_index() is index
+
+    # El admin edita en el worker A
+    with worker_a.activo():
+        db.session.get(Categoria, categoria_id).nombre = 'Renombrada'
+        tipo = TipoPromocion(nombre='descuento_porcentaje')
+        ahora = datetime.utcnow()
+        promo = PromocionProducto(alcance='producto', tipo_promocion=tipo, valor=10,
+                                  fecha_inicio=ahora - timedelta(days=1), fecha_fin=ahora + timedelta(days=1))
+        promo.productos.append(producto)
+        db.session.add(promo)
+        db.session.commit()
+        CategoryService.invalidate()
+        PromotionService.invalidate()
+
+    # El worker B reconstruye ambos índices en el próximo acceso
+    with worker_b.activo():
+        assert CategoryService.get_graph() is not grafo
+        assert CategoryService.get_graph().nombre(categoria_id) == 'Renombrada'
+        assert [p['id'] for p in PromotionService.get_index().para_producto(producto.id, categoria_id)] == [promo.id]
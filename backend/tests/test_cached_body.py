@@ -0,0 +1,74 @@
+"""
+Cuerpos cacheados con variantes precomprimidas: negociación de Accept-Encoding y que cada
+variante sea el mismo contenido.
+"""
+import gzip
+import json
+
+import pytest
+
+from cache_utils import CachedBody, elegir_encoding
+
+
+@pytest.mark.parametrize('accept_encoding, esperado', [
+    ('', None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('gzip, deflate, br', 'br'),
+    ('br;q=0.5, gzip', 'gzip'),
+    ('br;q=0, gzip;q=0', None),
+    ('*', 'br'),
+    ('*;q=0.2, br;q=0', 'gzip'),
+    ('GZIP; Q=0.8', 'gzip'),
+    ('gzip;q=abc', None),
+])
+def test_elegir_encoding(accept_encoding, esperado):
+    assert elegir_encoding(accept_encoding, ('br', 'gzip', 'deflate')) == esperado
+
+
+def test_elegir_encoding_respeta_el_orden_del_servidor_en_empates():
+    assert elegir_encoding('gzip, br', ('gzip', 'br')) == 'gzip'
+    assert elegir_encoding('gzip, br', ('br', 'gzip')) == 'br'
+
+
+def _cuerpo(app):
+    datos = {'productos': [{'id': i, 'nombre': f'Producto {i}'} for i in range(100)]}
+    with app.test_request_context():
+        return datos, CachedBody.from_json(datos)
+
+
+def test_variantes_precomprimidas(app):
+    datos, cuerpo = _cuerpo(app)
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        respuesta = cuerpo.response()
+    assert respuesta.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in respuesta.vary
+    assert json.loads(gzip.decompress(respuesta.get_data())) == datos
+    assert respuesta.get_etag()[0] == f'{cuerpo.etag}:gzip'
+
+    with app.test_request_context(headers={'Accept-Encoding': 'identity'}):
+        respuesta = cuerpo.response()
+    assert 'Content-Encoding' not in respuesta.headers
+    assert json.loads(respuesta.get_data()) == datos
+    assert respuesta.get_etag()[0] == cuerpo.etag
+
+
+def test_variante_brotli(app):
+    brotli = pytest.importorskip('brotli')
+    datos, cuerpo = _cuerpo(app)
+    if 'br' not in cuerpo.variantes:
+        pytest.skip('brotli no habilitado en Flask-Compress')
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip, br'}):
+        respuesta = cuerpo.response()
+    assert respuesta.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(respuesta.get_data())) == datos
+
+
+def test_endpoint_cacheado_sirve_gzip(app, crear_productos):
+    crear_productos(12)
+    cliente = app.test_client()
+    for _ in range(2):  # el segundo pedido sale del caché de cuerpos
+        respuesta = cliente.get('/api/productos', headers={'Accept-Encoding': 'gzip'})
+        assert respuesta.status_code == 200
+        assert respuesta.headers['Content-Encoding'] == 'gzip'
+        assert json.loads(gzip.decompress(respuesta.get_data()))['total'] > 0
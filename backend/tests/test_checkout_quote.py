@@ -0,0 +1,62 @@
+"""
+POST /api/checkout/quote: las cotizaciones cacheadas no repiten validaciones de stock ni de
+cupón con datos viejos.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def carrito(crear_productos):
+    from models import db, MetodoPago
+    producto, stock = crear_productos(1, stock=2)[0]
+    metodo = MetodoPago.query.filter_by(nombre='Tarjeta').first() or MetodoPago(nombre='Tarjeta')
+    db.session.add(metodo)
+    db.session.commit()
+    talle_id = next(iter(stock))
+    return {
+        'producto_id': producto.id,
+        'talle_id': talle_id,
+        'pedido': {'metodo_pago': metodo.id,
+                   'items': [{'producto_id': producto.id, 'talle_id': talle_id, 'cantidad': 2}]}
+    }
+
+
+def test_cotizacion_ve_el_stock_actual(app, carrito):
+    from models import db
+    from services.stock_service import StockService
+    cliente = app.test_client()
+
+    assert cliente.post('/api/checkout/quote', json=carrito['pedido']).status_code == 200
+
+    # Una venta se lleva una unidad: la misma cotización ya no puede salir del caché
+    StockService.descontar([(carrito['producto_id'], carrito['talle_id'], 1)])
+    db.session.commit()
+    respuesta = cliente.post('/api/checkout/quote', json=carrito['pedido'])
+    assert respuesta.status_code == 400
+    assert 'Stock insuficiente' in respuesta.get_json()['error']
+
+
+def test_cotizacion_ve_los_usos_del_cupon(app, carrito):
+    from models import db, PromocionProducto, TipoPromocion
+    cliente = app.test_client()
+    ahora = datetime.utcnow()
+    cupon = PromocionProducto(alcance='tienda', tipo_promocion=TipoPromocion(nombre='descuento_porcentaje'),
+                              valor=10, es_cupon=True, codigo=f"TEST{carrito['producto_id']}", max_usos=1,
+                              usos_actuales=0, fecha_inicio=ahora - timedelta(days=1),
+                              fecha_fin=ahora + timedelta(days=1))
+    db.session.add(cupon)
+    db.session.commit()
+    pedido = dict(carrito['pedido'], codigo_cupon=cupon.codigo)
+
+    respuesta = cliente.post('/api/checkout/quote', json=pedido)
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['cupon'] == cupon.codigo
+
+    # Otro pedido consume el último uso
+    cupon.usos_actuales = 1
+    db.session.commit()
+    respuesta = cliente.post('/api/checkout/quote', json=pedido)
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['error'] == 'Cupón agotado'
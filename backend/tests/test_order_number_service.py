@@ -0,0 +1,128 @@
+"""
+Numeración de pedidos (services/order_number_service.py): formato AA0000, continuación
+desde el mayor número existente, reserva por bloques y unicidad con concurrencia.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services import order_number_service
+from services.order_number_service import OrderNumberService, CONTADOR_PEDIDOS
+
+
+@pytest.fixture
+def numeracion(ctx):
+    """Sin contador ni pedidos previos, y sin bloque reservado en el proceso"""
+    from models import db, Contador, ItemPedido, Pedido
+    ItemPedido.query.delete()
+    Pedido.query.delete()
+    Contador.query.delete()
+    db.session.commit()
+    OrderNumberService._siguiente = OrderNumberService._fin = 0
+    OrderNumberService._pid = None
+    yield
+    OrderNumberService._siguiente = OrderNumberService._fin = 0
+    OrderNumberService._pid = None
+
+
+def _crear_pedido(numero_pedido):
+    from models import db, MetodoPago, Pedido
+    metodo = MetodoPago.query.first() or MetodoPago(nombre='Transferencia')
+    db.session.add(metodo)
+    db.session.flush()
+    db.session.add(Pedido(
+        numero_pedido=numero_pedido, cliente_nombre='test', cliente_email='test@local.test',
+        cliente_direccion='-', cliente_codigo_postal='5800', cliente_localidad='-',
+        cliente_provincia='-', metodo_pago_id=metodo.id, subtotal=0, total=0
+    ))
+    db.session.commit()
+
+
+def _valor_contador():
+    from models import db, Contador
+    db.session.expire_all()
+    return db.session.get(Contador, CONTADOR_PEDIDOS).valor
+
+
+@pytest.mark.parametrize('numero, codigo', [
+    (0, 'AA0000'),
+    (1, 'AA0001'),
+    (9999, 'AA9999'),
+    (10000, 'AB0000'),
+    (26 * 10000, 'BA0000'),
+    (26 * 26 * 10000 - 1, 'ZZ9999'),
+])
+def test_formato(numero, codigo):
+    assert OrderNumberService.codigo(numero) == codigo
+    assert OrderNumberService.ordinal(codigo) == numero
+
+
+@pytest.mark.parametrize('numero', [-1, 26 * 26 * 10000])
+def test_fuera_de_rango(numero):
+    with pytest.raises(ValueError):
+        OrderNumberService.codigo(numero)
+
+
+@pytest.mark.parametrize('codigo', ['', None, 'A00000', 'aa0000', 'AA000', 'AA00000', 'AA00X0', '12AB34'])
+def test_ordinal_invalido(codigo):
+    assert OrderNumberService.ordinal(codigo) is None
+
+
+def test_empieza_en_aa0001_sin_pedidos(numeracion):
+    assert OrderNumberService.siguiente() == 'AA0001'
+    assert OrderNumberService.siguiente() == 'AA0002'
+
+
+def test_continua_desde_el_mayor_existente(numeracion):
+    _crear_pedido('AA0500')
+    _crear_pedido('AB9998')
+    # Números que no son de la secuencia: de emergencia del generador anterior y otro formato
+    _crear_pedido('ER9999')
+    _crear_pedido('ZZ12345')
+
+    assert OrderNumberService.siguiente() == 'AB9999'
+    # Cambio de prefijo
+    assert OrderNumberService.siguiente() == 'AC0000'
+
+
+def test_reserva_por_bloques(numeracion, monkeypatch):
+    monkeypatch.setattr(order_number_service, 'ORDER_NUMBER_BLOCK', 3)
+    numeros = [OrderNumberService.siguiente() for _ in range(3)]
+    assert numeros == ['AA0001', 'AA0002', 'AA0003']
+    assert _valor_contador() == 3  # un solo UPDATE para el bloque
+
+    # El cuarto número agota el bloque y reserva el siguiente
+    assert OrderNumberService.siguiente() == 'AA0004'
+    assert _valor_contador() == 6
+
+    # Otro worker (otro proceso) reserva su propio bloque a continuación
+    OrderNumberService._pid = None
+    assert OrderNumberService.siguiente() == 'AA0007'
+    assert _valor_contador() == 9
+
+
+def test_threads_no_repiten_numeros(app, numeracion, monkeypatch):
+    monkeypatch.setattr(order_number_service, 'ORDER_NUMBER_BLOCK', 7)
+
+    def pedir(_):
+        with app.app_context():
+            return [OrderNumberService.siguiente() for _ in range(40)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        numeros = [n for lote in pool.map(pedir, range(8)) for n in lote]
+    assert len(numeros) == len(set(numeros)) == 320
+
+
+def test_bloques_concurrentes_no_se_superponen(app, numeracion):
+    """Cada worker reserva con un UPDATE atómico: los rangos reservados son disjuntos"""
+    bloque = 5
+
+    def reservar(_):
+        with app.app_context():
+            return [OrderNumberService._reservar(bloque) for _ in range(20)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        ultimos = [u for lote in pool.map(reservar, range(8)) for u in lote]
+    numeros = [n for ultimo in ultimos for n in range(ultimo - bloque + 1, ultimo + 1)]
+    assert len(numeros) == len(set(numeros)) == 8 * 20 * bloque
+    assert _valor_contador() == max(ultimos) == 8 * 20 * bloque
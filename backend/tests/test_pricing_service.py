@@ -0,0 +1,87 @@
+"""
+Motor de precios del checkout (services/pricing_service.py): equivalencia con el algoritmo
+anterior, NxM sin expandir unidades y promociones llevas_X_paga_Y.
+"""
+import random
+
+import pytest
+
+from benchmarks.bench_pricing import descuentos_legacy, generar_carrito, generar_promos
+from services.pricing_service import PricingService, _gratis_hasta, tipo_regla
+
+
+def _descuentos(lineas, promos):
+    cotizacion = PricingService.cotizar(lineas, PricingService.compilar(promos))
+    return [linea['descuento_aplicado'] for linea in cotizacion['lineas']]
+
+
+def _linea(producto_id, precio, cantidad, categoria_id=1):
+    return {'producto_id': producto_id, 'categoria_id': categoria_id, 'precio_unitario': precio, 'cantidad': cantidad}
+
+
+def _promo(tipo, id=1, alcance='tienda', valor=0, productos=(), categorias=()):
+    return {'id': id, 'alcance': alcance, 'tipo': tipo, 'valor': valor, 'productos': productos, 'categorias': categorias}
+
+
+def test_coincide_con_el_algoritmo_anterior():
+    """Carritos al azar con semilla fija: mismo descuento por línea que el checkout anterior"""
+    rng = random.Random(42)
+    for _ in range(300):
+        promos = generar_promos(rng, 40)
+        lineas = generar_carrito(rng, rng.randint(1, 15), 40, 6)
+        assert _descuentos(lineas, promos) == pytest.approx(descuentos_legacy(lineas, promos))
+
+
+@pytest.mark.parametrize('lleva, paga', [(2, 1), (3, 2), (4, 3), (4, 1), (5, 0)])
+def test_gratis_hasta_cuenta_las_posiciones_gratis(lleva, paga):
+    # En cada grupo de `lleva` posiciones se pagan las `paga` primeras
+    for posicion in range(0, 4 * lleva + 1):
+        esperado = sum(1 for i in range(posicion) if i % lleva >= paga)
+        assert _gratis_hasta(posicion, lleva, paga) == esperado
+
+
+def test_nxm_combina_lineas_de_la_mas_cara_a_la_mas_barata():
+    # 2x1 sobre 100, 50, 50, 50: grupos (100, 50) y (50, 50), gratis dos unidades de 50
+    cotizacion = PricingService.cotizar([_linea(1, 100, 1), _linea(2, 50, 3)], PricingService.compilar([_promo('2x1')]))
+    assert [l['descuento_promociones'] for l in cotizacion['lineas']] == [0, 100]
+    # 3x2 con una unidad suelta: la unidad que no completa grupo no descuenta
+    cotizacion = PricingService.cotizar([_linea(1, 300, 1), _linea(2, 200, 2), _linea(3, 10, 1)],
+                                        PricingService.compilar([_promo('3x2')]))
+    assert [l['descuento_promociones'] for l in cotizacion['lineas']] == [0, 200, 0]
+
+
+def test_nxm_no_expande_unidades():
+    cantidad = 10 ** 7
+    cotizacion = PricingService.cotizar([_linea(1, 100, cantidad)], PricingService.compilar([_promo('2x1')]))
+    assert cotizacion['lineas'][0]['descuento_promociones'] == 100 * cantidad // 2
+
+
+@pytest.mark.parametrize('nombre, regla', [
+    ('2x1', ('nxm', 2, 1)),
+    ('3x2', ('nxm', 3, 2)),
+    ('llevas_4_paga_3', ('nxm', 4, 3)),
+    ('LLEVAS_3_PAGA_1', ('nxm', 3, 1)),
+    ('llevas_2_paga_2', None),
+    ('llevas_2_paga_3', None),
+    ('descuento_porcentaje', ('porcentaje',)),
+    ('descuento_fijo', ('fijo',)),
+    ('envio_gratis', None),
+])
+def test_tipo_regla(nombre, regla):
+    assert tipo_regla(nombre) == regla
+
+
+def test_llevas_x_paga_y_aplica_en_el_checkout():
+    # Antes el checkout ignoraba estos tipos; ahora combinan unidades como el 2x1 / 3x2
+    promos = [_promo('llevas_3_paga_1', alcance='producto', productos=(1, 2))]
+    cotizacion = PricingService.cotizar([_linea(1, 100, 4), _linea(2, 40, 3), _linea(3, 500, 3)],
+                                        PricingService.compilar(promos))
+    # Unidades alcanzadas: 100 x4, 40 x3 -> grupos (100,100,100) (100,40,40); la última de 40 sobra
+    assert [l['descuento_promociones'] for l in cotizacion['lineas']] == [200, 80, 0]
+    assert [l['promociones'] for l in cotizacion['lineas']] == [[1], [1], []]
+
+
+def test_llevas_x_paga_y_en_una_sola_linea():
+    for cantidad in range(12):
+        assert PricingService.descuento_linea(tipo_regla('llevas_4_paga_3'), 0, cantidad, 100) == 100 * (cantidad // 4)
+        assert PricingService.descuento_linea(tipo_regla('llevas_3_paga_1'), 0, cantidad, 10) == 20 * (cantidad // 3)
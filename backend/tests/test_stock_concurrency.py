@@ -0,0 +1,180 @@
+"""
+Invariantes de stock y aprobación con concurrencia (los que verifica
+benchmarks/stress_checkout.py): el stock nunca queda negativo, ningún pedido se aprueba dos
+veces y ventas_count coincide con las unidades aprobadas.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+import pytest
+
+from services.order_service import APROBAR_LOTE_REINTENTOS, ConflictoAprobacion, OrderService
+from services.stock_service import StockInsuficiente, StockService
+
+_admins = count(1)
+
+
+@pytest.fixture
+def auth(ctx):
+    from flask_jwt_extended import create_access_token
+    from models import db, Admin
+    admin = Admin.query.first()
+    if not admin:
+        numero = next(_admins)
+        admin = Admin(username=f'test{numero}', email=f'test{numero}@local.test', password_hash='-')
+        db.session.add(admin)
+        db.session.commit()
+    return {'Authorization': f'Bearer {create_access_token(identity=str(admin.id))}'}
+
+
+@pytest.fixture
+def pedidos(app, crear_productos):
+    """crear_pedidos(n, stock) -> (producto_id, talle_id, [pedido_ids]): n pedidos de una unidad del mismo talle"""
+    from models import db, MetodoPago
+
+    def crear(n, stock):
+        producto, stock_por_talle = crear_productos(1, stock=stock, talles=('S',))[0]
+        talle_id = next(iter(stock_por_talle))
+        metodo = MetodoPago.query.first() or MetodoPago(nombre='Transferencia')
+        db.session.add(metodo)
+        db.session.commit()
+        cliente = app.test_client()
+        ids = []
+        for i in range(n):
+            respuesta = cliente.post('/api/orders', json={
+                'cliente_nombre': f'Test {i}', 'cliente_email': f'test{i}@local.test', 'calle': 'Calle',
+                'altura': i + 1, 'codigo_postal': '5800', 'ciudad': 'Río Cuarto', 'provincia': 'Córdoba',
+                'metodo_pago': metodo.id,
+                'items': [{'producto_id': producto.id, 'talle_id': talle_id, 'cantidad': 1}]
+            })
+            assert respuesta.status_code == 201, respuesta.get_json()
+            ids.append(respuesta.get_json()['id'])
+        return producto.id, talle_id, ids
+
+    return crear
+
+
+def _estado(producto_id, talle_id, pedido_ids):
+    """(stock, ventas_count, ids aprobados) leídos de la base"""
+    from models import db, Pedido, Producto, StockTalle
+    db.session.expire_all()
+    stock = StockTalle.query.filter_by(producto_id=producto_id, talle_id=talle_id).one().cantidad
+    ventas = db.session.get(Producto, producto_id).ventas_count
+    aprobados = {p.id for p in Pedido.query.filter(Pedido.id.in_(pedido_ids), Pedido.aprobado.is_(True))}
+    return stock, ventas, aprobados
+
+
+def _en_paralelo(funcion, argumentos, hilos=8):
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        return list(pool.map(funcion, argumentos))
+
+
+def test_descontar_concurrente_no_deja_stock_negativo(app, crear_productos):
+    from models import db
+    producto, stock_por_talle = crear_productos(1, stock=10, talles=('S',))[0]
+    producto_id, talle_id = producto.id, next(iter(stock_por_talle))
+
+    def descontar(_):
+        with app.app_context():
+            try:
+                StockService.descontar([(producto_id, talle_id, 3)])
+                db.session.commit()
+                return True
+            except StockInsuficiente as e:
+                db.session.rollback()
+                assert e.faltantes[0]['solicitado'] == 3
+                return False
+
+    exitos = sum(_en_paralelo(descontar, range(20)))
+    stock, ventas, _ = _estado(producto_id, talle_id, [])
+    assert exitos == 3
+    assert stock == 10 - 3 * exitos == 1
+    assert ventas == 3 * exitos
+
+
+def test_aprobaciones_duplicadas_aprueban_una_vez(app, auth, pedidos):
+    producto_id, talle_id, ids = pedidos(4, stock=10)
+
+    def aprobar(pedido_id):
+        return app.test_client().post(f'/api/admin/pedidos/{pedido_id}/aprobar', headers=auth).status_code
+
+    status = _en_paralelo(aprobar, [pid for pid in ids for _ in range(4)])
+    assert status.count(200) == len(ids)
+    assert set(status) <= {200, 400, 409}  # 409 si el UPDATE condicional perdió la carrera
+
+    stock, ventas, aprobados = _estado(producto_id, talle_id, ids)
+    assert aprobados == set(ids)
+    assert stock == 10 - len(ids)
+    assert ventas == len(ids)
+
+
+def test_lotes_y_aprobaciones_individuales_mezclados(app, auth, pedidos):
+    # Más pedidos que stock: parte queda con stock_insuficiente
+    producto_id, talle_id, ids = pedidos(8, stock=5)
+    mitad = len(ids) // 2
+    requests = [('lote', ids), ('lote', ids[::-1]), ('lote', ids[mitad:])]
+    requests += [('individual', pid) for pid in ids for _ in range(2)]
+
+    def enviar(request):
+        tipo, argumento = request
+        cliente = app.test_client()
+        if tipo == 'lote':
+            respuesta = cliente.post('/api/admin/pedidos/aprobar-lote', json={'pedido_ids': argumento}, headers=auth)
+            aprobados = [r['id'] for r in respuesta.get_json().get('resultados', []) if r['estado'] == 'aprobado']
+        else:
+            respuesta = cliente.post(f'/api/admin/pedidos/{argumento}/aprobar', headers=auth)
+            aprobados = [argumento] if respuesta.status_code == 200 else []
+        assert respuesta.status_code in (200, 400, 409), respuesta.get_json()
+        return aprobados
+
+    informados = [pid for aprobados in _en_paralelo(enviar, requests) for pid in aprobados]
+    assert len(informados) == len(set(informados)), 'pedido aprobado por más de una request'
+
+    stock, ventas, aprobados = _estado(producto_id, talle_id, ids)
+    assert stock >= 0
+    assert aprobados == set(informados)
+    assert len(aprobados) == 5 - stock
+    assert ventas == len(aprobados)
+
+
+def test_lote_reintenta_si_otra_aprobacion_gana_la_carrera(ctx, pedidos, monkeypatch):
+    from models import db, Pedido
+    producto_id, talle_id, ids = pedidos(2, stock=5)
+    disponibles = StockService.disponibles
+    llamadas = []
+
+    def aprobar_en_el_medio(pares):
+        # Entre la lectura de los pedidos y el UPDATE otra conexión aprueba el primero
+        if not llamadas:
+            with db.engine.begin() as conexion:
+                conexion.execute(Pedido.__table__.update().where(Pedido.__table__.c.id == ids[0])
+                                 .values(aprobado=True))
+        llamadas.append(1)
+        return disponibles(pares)
+
+    monkeypatch.setattr(StockService, 'disponibles', staticmethod(aprobar_en_el_medio))
+    resultado = OrderService.aprobar_lote(ids)
+
+    assert len(llamadas) == 2  # el primer intento choca con el UPDATE condicional
+    assert [r['estado'] for r in resultado['resultados']] == ['ya_aprobado', 'aprobado']
+    stock, ventas, _ = _estado(producto_id, talle_id, ids)
+    assert stock == 4  # el pedido aprobado por fuera no descontó; el lote descuenta una sola vez
+    assert ventas == 1
+
+
+def test_lote_responde_409_si_el_conflicto_persiste(app, auth, pedidos, monkeypatch):
+    producto_id, talle_id, ids = pedidos(2, stock=5)
+    intentos = []
+
+    def siempre_en_conflicto(pedido_ids, admin_id):
+        intentos.append(pedido_ids)
+        raise ConflictoAprobacion()
+
+    monkeypatch.setattr(OrderService, '_aprobar_lote', staticmethod(siempre_en_conflicto))
+    respuesta = app.test_client().post('/api/admin/pedidos/aprobar-lote', json={'pedido_ids': ids}, headers=auth)
+
+    assert respuesta.status_code == 409
+    assert 'reintentar' in respuesta.get_json()['error']
+    assert len(intentos) == APROBAR_LOTE_REINTENTOS
+    stock, ventas, aprobados = _estado(producto_id, talle_id, ids)
+    assert (stock, ventas, aprobados) == (5, 0, set())
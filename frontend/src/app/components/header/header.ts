@@ -74,7 +74,7 @@ export class HeaderComponent implements OnInit {
         if (!term.trim()) {
           return of({ items: [] });
         }
-        return this.apiService.getProductos({ busqueda: term, page_size: 6 }).pipe(
+        return this.apiService.getProductos({ busqueda: term, page_size: 6, view: 'card' }).pipe(
           catchError(error => {
             console.error('Error en búsqueda predictiva:', error);
             return of({ items: [] });
@@ -113,6 +113,7 @@ export class ProductosAdminComponent implements OnInit {
     filtros.page = this.paginaActual;
     filtros.page_size = this.productosPorPagina;
     filtros.activos = false;  // Mostrar todos en admin
+    filtros.view = 'card';  // El detalle completo se pide al editar
 
     this.apiService.getProductos(filtros).subscribe({
       next: (data) => {
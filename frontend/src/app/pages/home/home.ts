@@ -31,7 +31,7 @@ export class HomeComponent implements OnInit {
   }
 
   loadProductosDestacados() {
-    this.apiService.getProductos({ destacados: true }).subscribe({
+    this.apiService.getProductos({ destacados: true, view: 'card' }).subscribe({
       next: (data) => {
         const productos = data.items || data;
         this.productosDestacados = productos.slice(0, 9);
@@ -45,7 +45,7 @@ export class HomeComponent implements OnInit {
   }
 
   loadProductosOfertas() {
-    this.apiService.getProductos({ ofertas: true }).subscribe({
+    this.apiService.getProductos({ ofertas: true, view: 'card' }).subscribe({
       next: (data) => {
         const productos = data.items || data;
         this.productosOfertas = productos.slice(0, 9);
@@ -276,6 +276,7 @@ export class ProductosComponent implements OnInit, OnDestroy {
     // Paginación (cargar 20 por página)
     filtrosEnviar.page = 1;
     filtrosEnviar.page_size = this.pageSize;
+    filtrosEnviar.view = 'card';
 
     console.log('🔄 Filtros enviados:', filtrosEnviar);
 
@@ -339,6 +340,7 @@ export class ProductosComponent implements OnInit, OnDestroy {
     // Paginación
     filtrosEnviar.page = this.currentPage;
     filtrosEnviar.page_size = this.pageSize;
+    filtrosEnviar.view = 'card';
 
     this.apiService.getProductos(filtrosEnviar).subscribe({
       next: (data) => {
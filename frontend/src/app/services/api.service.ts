@@ -75,6 +75,7 @@ export class ApiService {
       if (filtros.page_size !== undefined) params.page_size = filtros.page_size;
       if (filtros.estado_stock) params.estado_stock = filtros.estado_stock;
       if (filtros.activos !== undefined) params.activos = filtros.activos;
+      if (filtros.view) params.view = filtros.view;  // 'card': versión compacta para listados
     }
 
     const queryString = Object.keys(params).map(key => `${key}=${encodeURIComponent(params[key])}`).join('&');
@@ -87,6 +88,11 @@ export class ApiService {
     return this.http.get(`${this.apiUrl}/productos/${id}`);
   }
 
+  // Varios productos en un solo pedido: { productos: { [id]: producto }, no_encontrados: number[] }
+  getProductosBatch(ids: number[]): Observable<any> {
+    return this.http.get(`${this.apiUrl}/productos/batch?ids=${ids.join(',')}`);
+  }
+
   createProducto(producto: any): Observable<any> {
     // Limpiar y preparar datos para enviar
     const productoLimpio: any = {
@@ -373,6 +379,10 @@ export class ApiService {
     return this.http.post(`${this.apiUrl}/admin/pedidos/${pedidoId}/aprobar`, {}, { headers: this.getHeaders() });
   }
 
+  aprobarPedidosLote(pedidoIds: number[]): Observable<any> {
+    return this.http.post(`${this.apiUrl}/admin/pedidos/aprobar-lote`, { pedido_ids: pedidoIds }, { headers: this.getHeaders() });
+  }
+
   // Envíos
   calcularEnvio(datos: any): Observable<any> {
     return this.http.post(`${this.apiUrl}/envios/calcular`, datos);
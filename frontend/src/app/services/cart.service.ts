@@ -150,8 +150,8 @@ export class CartService {
 
         this.cartItems = items;
         this.updateTotal();
-        // Opcional: refrescar precios si es necesario
-        // this.refreshCartData();
+        // Refrescar precios, stock y promociones guardados localmente
+        this.refreshCartData();
       } catch (e) {
         console.error('Error al cargar carrito local', e);
         this.cartItems = [];
@@ -161,7 +161,27 @@ export class CartService {
     this.notify();
   }
 
-  // refreshCartData implementation remains...
+  // Actualiza los datos de producto del carrito local con un único pedido batch
+  private refreshCartData(): void {
+    const ids = Array.from(new Set(this.cartItems.map(item => item.producto?.id).filter(id => !!id)));
+    if (ids.length === 0) return;
+
+    this.apiService.getProductosBatch(ids).subscribe({
+      next: (response: any) => {
+        const productos = response.productos || {};
+        this.cartItems.forEach(item => {
+          const fresco = productos[item.producto.id];
+          if (fresco) {
+            item.producto = fresco;
+            item.precio_unitario = fresco.precio_base;
+          }
+        });
+        localStorage.setItem(this.getCartKey(), JSON.stringify({ items: this.cartItems, lastUpdated: Date.now() }));
+        this.notify();
+      },
+      error: (err: any) => console.error('Error refrescando productos del carrito', err)
+    });
+  }
 
   private mergeGuestCart(): void {
     // Deprecated in favor of loadServerCart logic, but kept empty/simple if called externally
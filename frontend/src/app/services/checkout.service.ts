@@ -26,6 +26,11 @@ export class CheckoutService {
         return this.http.post<any[]>(`${this.apiUrl}/envios/calcular`, { codigo_postal, items });
     }
 
+    // Cotización del carrito (mismos precios que crearPedido, sin crear el pedido)
+    cotizar(datosPedido: any): Observable<any> {
+        return this.http.post<any>(`${this.apiUrl}/checkout/quote`, datosPedido);
+    }
+
     // Gestión de Pedidos
     crearPedido(datosPedido: any): Observable<any> {
         return this.http.post<any>(`${this.apiUrl}/orders`, datosPedido);